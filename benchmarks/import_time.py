@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+import_time.py
+
+Reports how long the oaepub script takes to start, using the import times
+recorded by 'python -X importtime', and checks that starting it has no side
+effects.
+
+Usage:
+  import_time.py [options] [--] [COMMAND ...]
+
+Options:
+  -h --help           Show this help message and exit
+  -r --repeat=N       Number of times to run each command, the best run is
+                      reported [default: 5]
+  -t --top=N          Number of the slowest imports to list [default: 10]
+  --max-ms=MS         Exit with an error if any command takes longer than this
+                      many milliseconds to import its modules, 0 for no limit
+                      [default: 0]
+
+Each COMMAND is a quoted string of arguments for oaepub; by default these are
+"--help" and "validate --help", which import no more than the command needs to
+start. Put "--" before any COMMAND which begins with a dash. Every command is
+run with its home directory set to an empty temporary directory, and fails the
+benchmark if it creates anything there, such as the OpenAccess_EPUB cache.
+"""
+
+#Standard Library modules
+import os
+import subprocess
+import sys
+import tempfile
+
+#Non-Standard Library modules
+from docopt import docopt
+
+#OpenAccess_EPUB modules
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      os.pardir, 'scripts', 'oaepub')
+
+DEFAULT_COMMANDS = ['--help', 'validate --help']
+
+
+def parse_importtime(stderr):
+    """
+    Returns a list of (module, self microseconds, cumulative microseconds) from
+    the output of 'python -X importtime'.
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            own, cumulative = int(fields[0]), int(fields[1])
+        except ValueError:  # The header line
+            continue
+        imports.append((fields[2].strip(), own, cumulative))
+    return imports
+
+
+def run_command(arguments):
+    """
+    Runs oaepub once with the arguments in a fresh home directory, returning the
+    parsed import times and the names of any files it created there.
+    """
+    with tempfile.TemporaryDirectory() as home:
+        environ = dict(os.environ, HOME=home)
+        process = subprocess.run([sys.executable, '-X', 'importtime', SCRIPT] + arguments,
+                                 stdout=subprocess.DEVNULL,
+                                 stderr=subprocess.PIPE,
+                                 env=environ,
+                                 universal_newlines=True)
+        created = os.listdir(home)
+    return parse_importtime(process.stderr), created
+
+
+def main(argv=None):
+    args = docopt(__doc__, argv=argv)
+    repeat = int(args['--repeat'])
+    top = int(args['--top'])
+    max_ms = float(args['--max-ms'])
+    commands = args['COMMAND'] or DEFAULT_COMMANDS
+
+    failed = False
+    for command in commands:
+        best = None
+        for _ in range(repeat):
+            imports, created = run_command(command.split())
+            total = sum(own for name, own, cumulative in imports)
+            if best is None or total < best[0]:
+                best = (total, imports, created)
+        total, imports, created = best
+        print('oaepub {0}: {1:.1f} ms importing {2} modules'.format(command,
+                                                                   total / 1000,
+                                                                   len(imports)))
+        slowest = sorted(imports, key=lambda item: item[1], reverse=True)[:top]
+        for name, own, cumulative in slowest:
+            print('  {0:>8.1f} ms  {1}'.format(own / 1000, name))
+        if created:
+            failed = True
+            print('  FAIL: created {0} in the home directory'.format(', '.join(created)))
+        if max_ms and total / 1000 > max_ms:
+            failed = True
+            print('  FAIL: slower than {0} ms'.format(max_ms))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
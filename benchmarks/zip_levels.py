@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+zip_levels.py
+
+Reports the time taken and the size produced when packaging EPUB contents with
+each of the compression settings supported by EPUBWriter.
+
+Usage:
+  zip_levels.py [options] INPUT ...
+
+Options:
+  -h --help           Show this help message and exit
+  -r --repeat=N       Number of times to time each setting, the best time is
+                      reported [default: 3]
+
+Each INPUT may be an EPUB file or a directory of EPUB contents (such as one kept
+by 'oaepub convert --no-cleanup'). The contents of all inputs are read into
+memory first, so that only the compression and writing are timed.
+"""
+
+#Standard Library modules
+import os
+import tempfile
+import time
+import zipfile
+
+#Non-Standard Library modules
+from docopt import docopt
+
+#OpenAccess_EPUB modules
+from openaccess_epub.utils.epub import EPUBWriter
+
+
+def read_contents(path):
+    """
+    Returns a list of (name, bytes) for the files of an EPUB file or directory,
+    with mimetype first.
+    """
+    contents = []
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for filename in sorted(files):
+                full_path = os.path.join(root, filename)
+                name = os.path.relpath(full_path, path).replace(os.sep, '/')
+                with open(full_path, 'rb') as inp:
+                    contents.append((name, inp.read()))
+    else:
+        with zipfile.ZipFile(path) as epub:
+            for name in epub.namelist():
+                contents.append((name, epub.read(name)))
+    contents.sort(key=lambda item: item[0] != 'mimetype')
+    return contents
+
+
+def time_setting(all_contents, compression, level, repeat):
+    """
+    Writes every input with the given setting, returning the best total time
+    and the total size of the EPUB files.
+    """
+    best = None
+    with tempfile.TemporaryDirectory() as tempdir:
+        for _ in range(repeat):
+            size = 0
+            start = time.perf_counter()
+            for index, contents in enumerate(all_contents):
+                location = os.path.join(tempdir, '{0}.epub'.format(index))
+                with EPUBWriter(location, compression, level) as writer:
+                    for name, data in contents:
+                        writer.write(name, data)
+            elapsed = time.perf_counter() - start
+            for index in range(len(all_contents)):
+                size += os.path.getsize(os.path.join(tempdir, '{0}.epub'.format(index)))
+            if best is None or elapsed < best:
+                best = elapsed
+    return best, size
+
+
+def main(argv=None):
+    args = docopt(__doc__, argv=argv)
+    repeat = int(args['--repeat'])
+
+    all_contents = [read_contents(path) for path in args['INPUT']]
+    raw_size = sum(len(data) for contents in all_contents for name, data in contents)
+    print('{0} EPUB(s), {1} bytes of content'.format(len(all_contents), raw_size))
+
+    settings = [('stored', 0)] + [('deflated', level) for level in range(1, 10)]
+    print('{0:<10} {1:>5} {2:>10} {3:>12} {4:>7}'.format('mode', 'level',
+                                                         'seconds', 'bytes',
+                                                         'ratio'))
+    for compression, level in settings:
+        elapsed, size = time_setting(all_contents, compression, level, repeat)
+        print('{0:<10} {1:>5} {2:>10.4f} {3:>12} {4:>7.3f}'.format(compression,
+                                                                   level,
+                                                                   elapsed,
+                                                                   size,
+                                                                   size / raw_size))
+
+
+if __name__ == '__main__':
+    main()
@@ -27,7 +27,8 @@ setup(name='openaccess_epub',
                 'openaccess_epub.publisher',
                 'openaccess_epub.utils'],
       package_data={'openaccess_epub': ['data/dtds/*/*.*',
-                                        'data/dtds/*/*/*.*']},
+                                        'data/dtds/*/*/*.*',
+                                        'data/epubcheck/*.java']},
       scripts=['scripts/oaepub'],
       data_files=[('', ['README.md'])],
       classifiers=['Development Status :: 3 - Alpha',
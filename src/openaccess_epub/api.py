@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+A library interface for converting articles to EPUB in memory.
+
+The oaepub commands work with files: they read the config file, locate images
+on disk or on the web, keep caches and log files, and write the EPUB beside
+its input. A service which receives article XML and its images, and wants an
+EPUB back, needs none of that. convert takes the XML and the images as bytes
+(or paths) and returns the EPUB as bytes, or writes it to a stream:
+
+    from openaccess_epub.api import convert
+    epub = convert(xml, images={'g001.png': png_data})
+
+Nothing is read other than the given inputs and the packaged DTDs, and nothing
+is written other than the output; the config file is not loaded, and no image
+is fetched, cached or optimized. No state is kept between calls, so convert may
+be called by several threads at once.
+"""
+
+#Standard Library modules
+import io
+import hashlib
+import logging
+import os
+
+#Non-Standard Library modules
+from lxml import etree
+
+#OpenAccess_EPUB modules
+from openaccess_epub.article import Article
+import openaccess_epub.utils.dtd as dtd_registry
+from openaccess_epub.utils.epub import EPUBWriter, write_EPUB, compression_options
+from openaccess_epub.utils.images import ImageIndex, ImageError
+from openaccess_epub.utils.image_store import image_file
+
+log = logging.getLogger('openaccess_epub.api')
+
+
+class ConversionError(Exception):
+    """
+    Raised when an article cannot be converted: its XML could not be parsed or
+    is invalid, its publisher is not supported, or its images are missing or
+    do not match their references.
+    """
+
+
+def read_article(xml_source, validation=True):
+    """
+    Parses an article from bytes, a path, or a binary file object, returning
+    the Article. Raises ConversionError if it could not be parsed, did not pass
+    validation, or its publisher is not supported.
+    """
+    if isinstance(xml_source, bytes):
+        xml_source = io.BytesIO(xml_source)
+    try:
+        #Validation is done here rather than by Article, which exits on failure
+        parsed_article = Article(xml_source, validation=False)
+    except (etree.LxmlError, AttributeError, KeyError, TypeError) as err:
+        raise ConversionError('Unable to parse the article: {0}'.format(err))
+    if validation:
+        public_id = parsed_article.document.docinfo.public_id
+        valid, errors = dtd_registry.validate(public_id, parsed_article.document)
+        if not valid:
+            raise ConversionError('The article did not pass validation:\n' + errors)
+    if parsed_article.doi is None or parsed_article.publisher is None:
+        raise ConversionError('The publisher of the article is not supported')
+    return parsed_article
+
+
+def image_files(images):
+    """
+    Returns a sorted list of image_files for a mapping of image file names to
+    their contents as bytes, or to their paths.
+    """
+    files = []
+    for name, image in (images or {}).items():
+        if isinstance(image, bytes):
+            files.append(image_file(name, None, hashlib.sha256(image).hexdigest(), image))
+        else:
+            files.append(image_file(name, os.fspath(image), None))
+    files.sort()
+    return files
+
+
+def convert(xml_source,
+            images=None,
+            config=None,
+            output=None,
+            epub_version=None,
+            validation=True):
+    """
+    Converts an article to EPUB, returning the EPUB as bytes.
+
+    Parameters
+    ----------
+    xml_source : bytes, str, or file object
+        The article XML as bytes, the path of the XML file, or a binary file
+        object from which to read it.
+    images : mapping, optional
+        Maps the file names of the images of the article, such as 'g001.png',
+        to their contents as bytes or to their paths. Images are matched to the
+        references in the article by name, as for an image directory.
+    config : config module or object, optional
+        Any object with the attributes of the OpenAccess_EPUB config file,
+        of which only the EPUB compression settings are used. The defaults are
+        used if not given; the config file is never loaded.
+    output : file object, optional
+        A seekable binary file object to which the EPUB is written, instead of
+        returning it. It is left open.
+    epub_version : {None, 2, 3}
+        The version of EPUB to be created, by default that of the publisher.
+    validation : bool, optional
+        Whether the article is validated against its DTD.
+
+    Returns
+    -------
+    epub : bytes or None
+        The EPUB, or None if it was written to `output`.
+
+    Raises ConversionError if the article cannot be converted.
+    """
+    if epub_version not in (None, 2, 3):
+        raise ValueError('Invalid EPUB version. Should be 2 or 3')
+    parsed_article = read_article(xml_source, validation)
+    if epub_version is None:
+        epub_version = parsed_article.publisher.epub_default
+    files = image_files(images)
+    try:
+        parsed_article.image_index = ImageIndex.build(parsed_article, files)
+    except ImageError as err:
+        raise ConversionError('Images for the article do not match its references: {0}'.format(err))
+    stream = output if output is not None else io.BytesIO()
+    with EPUBWriter(stream, **compression_options(config)) as writer:
+        write_EPUB(writer, parsed_article, files, epub_version)
+    if output is None:
+        return stream.getvalue()
+    return None
@@ -11,7 +11,6 @@ articles and in the conversion to EPUB.
 """
 
 #Standard Library modules
-from collections import namedtuple
 from keyword import iskeyword
 import logging
 import os
@@ -22,30 +21,13 @@ import sys
 from lxml import etree
 
 #OpenAccess_EPUB modules
-from openaccess_epub import JPTS10_PATH, JPTS11_PATH, JPTS20_PATH,\
-    JPTS21_PATH, JPTS22_PATH, JPTS23_PATH, JPTS30_PATH
 from openaccess_epub.utils import element_methods, publisher_plugin_location
+import openaccess_epub.utils.dtd as dtd_registry
+from openaccess_epub.utils import timing
 import openaccess_epub.publisher
 
 log = logging.getLogger('openaccess_epub.article')
 
-dtd_tuple = namedtuple('DTD_Tuple', 'path, name, version')
-
-dtds = {'-//NLM//DTD Journal Archiving and Interchange DTD v1.0 20021201//EN':
-        dtd_tuple(JPTS10_PATH, 'JPTS', 1.0),
-        '-//NLM//DTD Journal Archiving and Interchange DTD v1.1 20031101//EN':
-        dtd_tuple(JPTS11_PATH, 'JPTS', 1.1),
-        '-//NLM//DTD Journal Publishing DTD v2.0 20040830//EN':
-        dtd_tuple(JPTS20_PATH, 'JPTS', 2.0),
-        '-//NLM//DTD Journal Publishing DTD v2.1 20050630//EN':
-        dtd_tuple(JPTS21_PATH, 'JPTS', 2.1),
-        '-//NLM//DTD Journal Publishing DTD v2.2 20060430//EN':
-        dtd_tuple(JPTS22_PATH, 'JPTS', 2.2),
-        '-//NLM//DTD Journal Publishing DTD v2.3 20070202//EN':
-        dtd_tuple(JPTS23_PATH, 'JPTS', 2.3),
-        '-//NLM//DTD Journal Publishing DTD v3.0 20080202//EN':
-        dtd_tuple(JPTS30_PATH, 'JPTS', 3.0)}
-
 
 class Article(object):
     """
@@ -62,8 +44,10 @@ class Article(object):
 
     Parameters
     ----------
-    xml_file : str
-        Path to the xml file for parsing `xml_file`.
+    xml_file : str or file object
+        Path to the xml file for parsing, or a binary file object from which
+        to read the XML, such as one holding XML read from an archive
+        `xml_file`.
     validation : bool, optional
         DTD validation is used when this evaluates True, use is strongly advised
         `validation`.
@@ -94,39 +78,44 @@ class Article(object):
         """
         The initialization of the Article class.
         """
-        log.info('Parsing file: {0}'.format(xml_file))
+        log.info('Parsing file: {0}'.format(getattr(xml_file, 'name', xml_file)))
 
         #Parse the document
         parser = etree.XMLParser(remove_blank_text=True)
-        self.document = etree.parse(xml_file, parser)
+        with timing.stage('parse'):
+            self.document = etree.parse(xml_file, parser)
 
         #Find its public id so we can identify the appropriate DTD
         public_id = self.document.docinfo.public_id
         log.debug('Doctype PUBLIC: ' + public_id)
 
-        #Instantiate an lxml.etree.DTD class from the dtd files in our data
+        #Get the lxml.etree.DTD for the dtd files in our data, the registry
+        #parses each DTD only once per process
         try:
-            dtd = dtds[public_id]
+            dtd = dtd_registry.registry.info(public_id)
         except KeyError as err:
-            log.exception()
             log.error('Unkown DTD for value in Doctype PUBLIC: ' + public_id)
             raise err  # We can proceed no further without the DTD
         else:
-            self.dtd = etree.DTD(dtd.path)
+            self.dtd = dtd_registry.get_dtd(public_id)
             self.dtd_name, self.dtd_version = dtd.name, dtd.version
             log.debug('DTD: {0} {1}'.format(self.dtd_name, self.dtd_version))
 
         #If using a supported DTD type, execute validation
         if validation:
             log.debug('DTD validation is in use')
-            if not self.dtd.validate(self.document):
-                log.critical('The document did not pass validation:\n' +
-                             self.dtd.error_log.filter_from_errors())
+            with timing.stage('validate'):
+                valid, errors = dtd_registry.validate(public_id, self.document)
+            if not valid:
+                log.critical('The document did not pass validation:\n' + errors)
                 sys.exit(1)
 
         self.root = self.document.getroot()
         self.body = self.root.find('body')
 
+        #The openaccess_epub.utils.images.ImageIndex, once images are located
+        self.image_index = None
+
         #Attempt, as well as possible, to identify the publisher and doi for
         #the article.
         self.doi = self.get_DOI()
@@ -3,7 +3,7 @@
 """
 oaepub batch
 
-Convert all XML files in a directory to individual EPUB files
+Convert all XML files and archives in a directory to individual EPUB files
 
 Usage:
   batch [options] DIR ...
@@ -20,10 +20,25 @@ Batch Specific Options:
   -2 --epub2            Convert to EPUB2 (not implemented)
   -3 --epub3            Convert to EPUB3 (not implemented)
   --no-epubcheck        Disable the use of epubcheck to validate EPUBs
+  --epubcheck-jobs=N    Number of epubcheck processes run in the background
+                        while conversion continues [default: 1]
   --no-validate         Disable DTD validation of XML files during conversion.
                         This is only advised if you have pre-validated the files
                         (see 'oaepub validate -h')
   -r --recursive        Recursively traverse subdirectories for conversion
+  --no-archives         Do not convert the articles in archives (.tar.gz, .tgz,
+                        .tar and .zip files) found in the directories
+  --report=FILE         Write a report of one row per article to FILE, as CSV
+                        if FILE ends with ".csv" and as JSON lines otherwise,
+                        and finish with percentiles of the stage timings
+  --journal=FILE        Record the result of each article in a journal file, so
+                        that an interrupted batch may be resumed
+  --resume              Skip the articles which the journal records as already
+                        converted, and convert the rest. The journal is
+                        'oaepub-batch.journal' unless --journal is given
+  -j --jobs=N           Number of worker processes converting articles in
+                        parallel, each converts one article at a time
+                        [default: 1]
   -o --output=DIR       Directory in which to put the output. Default is set in
                         config file (see 'oaepub configure where')
   -i --images=DIR       Directory in which to find the images for the article
@@ -41,19 +56,59 @@ Logging Options:
 
 In contrast to the 'convert' command, the 'batch' command is intended for larger
 scale conversions of article XML to EPUB and is somewhat more specialized and
-less flexible. Local XML files are the only allowed input, all directory
-conflicts will result in the article being skipped (preventing overwrites), and
-the command will attempt to convert all XML files in the specified directories.
+less flexible. Local XML files and archives are the only allowed input, an
+already existing EPUB will result in the article being skipped (preventing
+overwrites), and the command will attempt to convert all XML files in the
+specified directories.
+
+Archives, such as PubMed Central article packages or publisher bundles, are read
+as a stream without being unpacked: each XML file in an archive is converted
+with the images stored in the same directory of the archive, which are written
+straight into its EPUB. An archive is converted by a single worker process, and
+its EPUBs and logs are placed as if its XML files sat beside it.
+
+With --journal or --resume, a line is added to the journal as each input
+finishes (an archive being one input however many articles it holds), recording
+its content hash, status, output EPUB and the time taken. With --resume, an
+article is only skipped if the journal says it was converted, its XML is
+unchanged and its EPUB still exists. Every other article is converted again. An
+existing EPUB is only replaced if the journal records it as the output of an
+input which was not converted, as when a conversion failed partway; any other
+existing EPUB is still skipped as a conflict. Each EPUB is built under a
+temporary name and moved into place once complete, so a failed conversion never
+removes the EPUB it would have replaced.
+
+The --report rows hold the status and failure reason for each article, the
+size in bytes of its XML and EPUB, the number of elements in its XML, and the
+wall clock and CPU time spent in each stage of its conversion: parse, validate,
+images, render, navigation, package, zip and epubcheck. Only wall clock time is
+known for epubcheck, which runs in its own process.
 
 If using the --images option, the argument should employ the "*" expansion. As
 a precaution against wasting time, this command will quit if the "*" is missing.
+
+With --jobs greater than 1, articles are converted by a pool of worker
+processes, each one taking an article from parsing through to writing the EPUB.
+Each EPUB is handed to epubcheck as soon as it is written, and is checked in the
+background while the following articles are converted. Results are reported in
+the order the articles were found, followed by a summary which includes the
+epubcheck errors for each EPUB that did not pass.
 """
 
 #Standard Library modules
+from collections import OrderedDict, namedtuple
+import csv
+import io
+import json
 import logging
+import multiprocessing
 import os
 import shutil
 import sys
+import tarfile
+import time
+import zipfile
+import zlib
 
 #Non-Standard Library modules
 from docopt import docopt
@@ -61,10 +116,359 @@ from docopt import docopt
 #OpenAccess_EPUB modules
 from openaccess_epub._version import __version__
 from openaccess_epub.utils import files_with_ext
+from openaccess_epub.utils.archives import archive_article, archive_articles,\
+    find_archives, is_archive
 from openaccess_epub.utils.epub import make_EPUB
+from openaccess_epub.utils.epubcheck_runner import EpubcheckRunner
+from openaccess_epub.utils.journal import BatchJournal
+import openaccess_epub.utils.dtd as dtd_registry
 import openaccess_epub.utils.images
 import openaccess_epub.utils.logs as oae_logging
+from openaccess_epub.utils.settings import command_overrides, load_settings
+from openaccess_epub.utils import timing
 from openaccess_epub.article import Article
+import openaccess_epub.publisher
+
+log = logging.getLogger('openaccess_epub.commands.batch')
+
+batch_result = namedtuple('batch_result', 'input, status, epub, elapsed, message, stats')
+batch_result.__new__.__defaults__ = (None,)
+
+#State for convert_article, set up once per process by init_worker
+_worker = {}
+
+
+def prewarm():
+    """
+    Parses all of the DTDs and imports all of the mapped publisher modules, so
+    that the first article converted does not pay for them. When this is called
+    before the worker pool is forked, the workers inherit the work.
+    """
+    dtd_registry.registry.preload()
+    for doi_prefix in openaccess_epub.publisher.get_doi_map():
+        try:
+            openaccess_epub.publisher.import_by_doi(doi_prefix)
+        except ImportError:
+            log.exception('Unable to import publisher for {0}'.format(doi_prefix))
+
+
+def init_worker(args, config, warm=False, replaceable=frozenset()):
+    """
+    Prepares a process for converting articles with convert_article, using the
+    settings `config` resolved by the main process. `replaceable` holds the
+    paths of the existing EPUBs which may be replaced rather than skipped.
+
+    Each process gets its own temporary log file, named by its process id, to
+    collect log messages until they can be moved to the log for the article.
+    """
+    _worker['args'] = args
+    _worker['temp_log'] = 'oaepub-batch-{0}.log'.format(os.getpid())
+    _worker['config'] = config
+    _worker['replaceable'] = replaceable
+    if warm:
+        prewarm()
+
+
+def convert_input(input_path):
+    """
+    Converts the article of an XML file, or each of the articles in an archive.
+    Returns a list of the batch_results, see convert_article.
+    """
+    if not is_archive(input_path):
+        return [convert_article(input_path)]
+    results = []
+    start = time.time()
+    try:
+        for article in archive_articles(input_path):
+            results.append(convert_article(article))
+    #A damaged or truncated archive ends its stream with one of these
+    except (tarfile.TarError, zipfile.BadZipfile, zlib.error, EOFError, OSError) as err:
+        log.exception('Unable to read archive {0}'.format(input_path))
+        results.append(batch_result(input_path, 'failed', None, time.time() - start,
+                                    '{0}: {1}'.format(type(err).__name__, err)))
+    if not results:
+        results.append(batch_result(input_path, 'failed', None, time.time() - start,
+                                    'No article XML found in archive'))
+    return results
+
+
+def input_outcome(results):
+    """
+    Returns the status, EPUB and time taken to record in the journal for an
+    input from its batch_results. An archive is only 'converted' if each of its
+    articles was, and its EPUBs are recorded as a list.
+    """
+    if len(results) == 1:
+        return results[0].status, results[0].epub, results[0].elapsed
+    statuses = set(result.status for result in results)
+    if statuses == set(['converted']):
+        status = 'converted'
+    elif 'failed' in statuses:
+        status = 'failed'
+    else:
+        status = 'skipped'
+    return (status,
+            [result.epub for result in results],
+            sum(result.elapsed for result in results))
+
+
+def convert_article(xml_file):
+    """
+    Converts a single article to EPUB, from an XML file or an archive_article
+    read from an archive. init_worker must have been called in this process
+    first. epubcheck is not run here, the EPUB is handed to the EpubcheckRunner
+    of the main process once the result comes back.
+
+    Returns a batch_result(input, status, epub, elapsed, message, stats), the
+    status is one of 'converted', 'skipped', or 'failed'. A failed result gives
+    the EPUB it would have made, once that is known, so that the journal may
+    record it. The stats are a dict of the byte sizes of the input and output,
+    the number of elements in the article, the total CPU time and the wall and
+    CPU time of each stage.
+    """
+    stats = {'input_bytes': None, 'epub_bytes': None, 'elements': None}
+    timer = timing.activate(timing.StageTimer())
+    cpu_start = time.process_time()
+    try:
+        result = _convert_article(xml_file, stats)
+    finally:
+        timing.activate(None)
+    stats['cpu'] = time.process_time() - cpu_start
+    stats['stages'] = {name: tuple(times) for name, times in timer.stages.items()}
+    if result.status == 'converted':
+        stats['epub_bytes'] = os.path.getsize(result.epub)
+    return result._replace(stats=stats)
+
+
+def _convert_article(xml_file, stats):
+    """
+    Does the work of convert_article, putting the size of the input and the
+    number of elements in the article into `stats`.
+    """
+    args = _worker['args']
+    config = _worker['config']
+    start = time.time()
+
+    if isinstance(xml_file, archive_article):
+        article = xml_file
+        #Reported as a path into the archive
+        xml_file = os.path.join(article.archive, article.name)
+        input_dirname = os.path.dirname(openaccess_epub.utils.get_absolute_path(article.archive))
+    else:
+        article = None
+
+    #We have to temporarily re-base our log while utils work
+    if not args['--no-log-file']:
+        oae_logging.replace_filehandler(logname='openaccess_epub',
+                                        new_file=_worker['temp_log'],
+                                        level=args['--log-level'],
+                                        frmt=oae_logging.STANDARD_FORMAT)
+
+    log.info('Processing input: {0}'.format(xml_file))
+
+    root_name = openaccess_epub.utils.file_root_name(xml_file)
+    abs_input_path = openaccess_epub.utils.get_absolute_path(xml_file)
+    if article is None:
+        input_dirname = os.path.dirname(abs_input_path)
+        stats['input_bytes'] = os.path.getsize(abs_input_path)
+    else:
+        stats['input_bytes'] = len(article.xml)
+
+    if not args['--no-log-file']:
+        log_name = root_name + '.log'
+        log_path = os.path.join(input_dirname, log_name)
+
+        #Re-base the log file to the new file location
+        oae_logging.replace_filehandler(logname='openaccess_epub',
+                                        new_file=log_path,
+                                        level=args['--log-level'],
+                                        frmt=oae_logging.STANDARD_FORMAT)
+        #Now we move over to the new log file
+        shutil.move(_worker['temp_log'], log_path)
+
+    epub_name = None
+    try:
+        #Parse the article now that logging is ready
+        if article is None:
+            parsed_article = Article(abs_input_path,
+                                     validation=not args['--no-validate'])
+        else:
+            xml_buffer = io.BytesIO(article.xml)
+            xml_buffer.name = xml_file
+            parsed_article = Article(xml_buffer,
+                                     validation=not args['--no-validate'])
+        stats['elements'] = sum(1 for element in parsed_article.root.iter())
+        if parsed_article.publisher is None:
+            return batch_result(xml_file, 'failed', None, time.time() - start,
+                                'Publisher support was not established')
+
+        #Get the output directory
+        if os.path.isabs(config.default_output):  # Absolute remains so
+            output_directory = config.default_output
+        else:  # Else rendered relative to input
+            output_directory = os.path.normpath(os.path.join(input_dirname, config.default_output))
+
+        #The root name must be added on for output
+        output_directory = os.path.join(output_directory, root_name)
+        epub_name = '{0}.epub'.format(output_directory)
+
+        #Output conflicts are skipped, so that previous data is kept, unless
+        #the journal records this EPUB as left by an unfinished conversion. It
+        #is only replaced once the new one is complete
+        replace = epub_name in _worker['replaceable']
+        if os.path.isfile(epub_name):
+            if replace:
+                log.info('Replacing EPUB {0} of an unfinished conversion'.format(epub_name))
+            else:
+                log.error('EPUB conflict during batch conversion, skipping.')
+                return batch_result(xml_file, 'skipped', None, time.time() - start,
+                                    'Output EPUB already exists')
+
+        #Images stored with the article in an archive are used as they are,
+        #otherwise they are located as usual
+        images = None
+        xml_data = None
+        if article is not None:
+            xml_data = article.xml
+            if article.images:
+                images = openaccess_epub.utils.images.located_images(article.images,
+                                                                     None,
+                                                                     False)
+
+        #Make the call to make_EPUB
+        success = make_EPUB(parsed_article,
+                            output_directory,
+                            abs_input_path,
+                            args['--images'],
+                            config_module=config,
+                            batch=True,
+                            images=images,
+                            xml_data=xml_data,
+                            replace=replace)
+
+        if not success:
+            return batch_result(xml_file, 'failed', epub_name, time.time() - start,
+                                'EPUB creation was not successful')
+
+    #Article exits on failed DTD validation, but one failed article should not
+    #bring down the rest of the batch
+    except (Exception, SystemExit) as err:
+        log.exception('Conversion of {0} failed'.format(xml_file))
+        return batch_result(xml_file, 'failed', epub_name, time.time() - start,
+                            '{0}: {1}'.format(type(err).__name__, err))
+
+    return batch_result(xml_file, 'converted', epub_name, time.time() - start,
+                        None)
+
+
+def print_summary(results, checks, elapsed, resumed=0):
+    """
+    Prints an aggregate summary of the results of the batch conversion, along
+    with the epubcheck_results in `checks` if epubcheck was run. `resumed` is
+    the number of articles skipped as already complete in the journal.
+    """
+    counts = {'converted': 0, 'skipped': 0, 'failed': 0}
+    for result in results:
+        counts[result.status] += 1
+    print('Batch conversion of {0} articles finished in {1:.2f} seconds'.format(len(results), elapsed))
+    if resumed:
+        print('  Complete in journal: {0}'.format(resumed))
+    print('  Converted: {0}'.format(counts['converted']))
+    print('  Skipped:   {0}'.format(counts['skipped']))
+    print('  Failed:    {0}'.format(counts['failed']))
+    for result in results:
+        if result.status != 'converted':
+            print('  {0} {1}: {2}'.format(result.status.upper(),
+                                          result.input,
+                                          result.message))
+    if not checks:
+        return
+    failed = [check for check in checks if not check.passed]
+    print('  Passed epubcheck: {0}'.format(len(checks) - len(failed)))
+    print('  Failed epubcheck: {0}'.format(len(failed)))
+    for check in failed:
+        print('  EPUBCHECK {0}'.format(check.epub))
+        for message in check.messages:
+            if message.severity in ('FATAL', 'ERROR'):
+                print('    {0} {1}: {2}'.format(message.severity,
+                                                message.location or check.epub,
+                                                message.text))
+
+
+def log_check(check):
+    """
+    Logs the messages of an epubcheck_result.
+    """
+    if check.passed:
+        log.info('{0} passed epubcheck in {1:.2f} seconds'.format(check.epub,
+                                                                 check.elapsed))
+    else:
+        log.error('{0} failed epubcheck'.format(check.epub))
+    for message in check.messages:
+        log.info('epubcheck {0}: {1}: {2}'.format(message.severity,
+                                                   message.location or check.epub,
+                                                   message.text))
+
+
+def report_row(result, check=None):
+    """
+    Returns an OrderedDict of the report columns for a batch_result and its
+    epubcheck_result, if it was checked.
+    """
+    stats = result.stats or {}
+    stages = dict(stats.get('stages', {}))
+    if check is not None:
+        stages['epubcheck'] = (check.elapsed, None)
+    row = OrderedDict()
+    row['input'] = result.input
+    row['status'] = result.status
+    row['message'] = result.message
+    row['epubcheck'] = None if check is None else ('passed' if check.passed else 'failed')
+    row['input_bytes'] = stats.get('input_bytes')
+    row['epub_bytes'] = stats.get('epub_bytes')
+    row['elements'] = stats.get('elements')
+    row['wall'] = result.elapsed
+    row['cpu'] = stats.get('cpu')
+    for stage in timing.STAGES:
+        wall, cpu = stages.get(stage, (None, None))
+        row[stage + '_wall'] = wall
+        row[stage + '_cpu'] = cpu
+    return row
+
+
+def write_report(path, rows):
+    """
+    Writes the report rows to a CSV file if the path ends with '.csv', or to a
+    file of JSON lines otherwise.
+    """
+    with open(path, 'w', encoding='utf-8', newline='') as report:
+        if path.lower().endswith('.csv'):
+            if not rows:
+                return
+            writer = csv.DictWriter(report, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            for row in rows:
+                report.write(json.dumps(row) + '\n')
+
+
+def print_percentiles(rows):
+    """
+    Prints percentiles of the wall clock time per article, in total and for
+    each stage, as well as of the total CPU time.
+    """
+    columns = ['wall', 'cpu'] + [stage + '_wall' for stage in timing.STAGES]
+    print('Timing percentiles in seconds, per article')
+    print('  {0:<16} {1:>7} {2:>9} {3:>9} {4:>9} {5:>9} {6:>10}'.format('stage', 'count',
+                                                                   'p50', 'p90',
+                                                                   'p99', 'max',
+                                                                   'total'))
+    for column in columns:
+        summary = timing.summarize(row[column] for row in rows)
+        if not summary['count']:
+            continue
+        print('  {0:<16} {count:>7} {p50:>9.4f} {p90:>9.4f} {p99:>9.4f} {max:>9.4f} {total:>10.3f}'.format(column, **summary))
 
 
 def main(argv=None):
@@ -76,6 +480,19 @@ def main(argv=None):
     if args['--images'] is not None and '*' not in args['--images']:
         sys.exit('Argument for --images option must contain "*"')
 
+    try:
+        jobs = int(args['--jobs'])
+    except ValueError:
+        sys.exit('Argument for --jobs option must be an integer')
+    if jobs < 1:
+        sys.exit('Argument for --jobs option must be at least 1')
+    try:
+        check_jobs = int(args['--epubcheck-jobs'])
+    except ValueError:
+        sys.exit('Argument for --epubcheck-jobs option must be an integer')
+    if check_jobs < 1:
+        sys.exit('Argument for --epubcheck-jobs option must be at least 1')
+
     #Basic logging configuration
     oae_logging.config_logging(args['--no-log-file'],
                                args['--log-to'],
@@ -86,70 +503,97 @@ def main(argv=None):
     #Get a logger, the 'openaccess_epub' logger was set up above
     command_log = logging.getLogger('openaccess_epub.commands.batch')
 
-    #Load the config module, we do this after logging configuration
-    config = openaccess_epub.utils.load_config_module()
+    #The settings are resolved once, and handed to the worker processes
+    config = load_settings(command_overrides(args))
 
+    #Gather all of the inputs first, results are reported in this order
+    inputs = []
     for directory in args['DIR']:
-        for xml_file in files_with_ext('.xml', directory,
-                                       recursive=args['--recursive']):
-
-            #We have to temporarily re-base our log while utils work
-            if not args['--no-log-file']:
-                oae_logging.replace_filehandler(logname='openaccess_epub',
-                                                new_file='temp.log',
-                                                level=args['--log-level'],
-                                                frmt=oae_logging.STANDARD_FORMAT)
-
-            command_log.info('Processing input: {0}'.format(xml_file))
-
-            root_name = openaccess_epub.utils.file_root_name(xml_file)
-            abs_input_path = openaccess_epub.utils.get_absolute_path(xml_file)
-
-            if not args['--no-log-file']:
-                log_name = root_name + '.log'
-                log_path = os.path.join(os.path.dirname(abs_input_path),
-                                        log_name)
-
-                #Re-base the log file to the new file location
-                oae_logging.replace_filehandler(logname='openaccess_epub',
-                                                new_file=log_path,
-                                                level=args['--log-level'],
-                                                frmt=oae_logging.STANDARD_FORMAT)
-                #Now we move over to the new log file
-                shutil.move('temp.log', log_path)
-
-            #Parse the article now that logging is ready
-            parsed_article = Article(abs_input_path,
-                                     validation=not args['--no-validate'])
-            #Get the output directory
-            if args['--output'] is not None:
-                output_directory = openaccess_epub.utils.get_absolute_path(args['--output'])
+        inputs += files_with_ext('.xml', directory,
+                                 recursive=args['--recursive'])
+        if not args['--no-archives']:
+            inputs += find_archives(directory, recursive=args['--recursive'])
+
+    journal = None
+    resumed = 0
+    replaceable = frozenset()
+    if args['--journal'] is not None or args['--resume']:
+        journal = BatchJournal(args['--journal'] or 'oaepub-batch.journal')
+    if args['--resume']:
+        pending = []
+        for xml_file in inputs:
+            if journal.is_complete(openaccess_epub.utils.get_absolute_path(xml_file)):
+                resumed += 1
             else:
-                if os.path.isabs(config.default_output):  # Absolute remains so
-                    output_directory = config.default_output
-                else:  # Else rendered relative to input
-                    abs_dirname = os.path.dirname(abs_input_path)
-                    output_directory = os.path.normpath(os.path.join(abs_dirname, config.default_output))
+                pending.append(xml_file)
+        command_log.info('Resuming, {0} of {1} articles are already complete'.format(resumed, len(inputs)))
+        inputs = pending
+        replaceable = journal.unfinished_epubs()
+
+    start = time.time()
+    results = []
+    checks = []
+    if config.disable_epubcheck:
+        runner = None
+    else:
+        runner = EpubcheckRunner(config.epubcheck_jarfile, check_jobs)
+
+    def collect(input_path, input_results):
+        results.extend(input_results)
+        if journal is not None:
+            journal.record(openaccess_epub.utils.get_absolute_path(input_path),
+                           *input_outcome(input_results))
+        for result in input_results:
+            if runner is not None and result.status == 'converted':
+                checks.append(runner.submit(result.epub))
 
-            #The root name must be added on for output
-            output_directory = os.path.join(output_directory, root_name)
+    if jobs == 1:
+        init_worker(args, config, replaceable=replaceable)
+        try:
+            for input_path in inputs:
+                collect(input_path, convert_input(input_path))
+        finally:
+            if journal is not None:
+                journal.close()
+    else:
+        command_log.info('Converting with {0} worker processes'.format(jobs))
+        #Warming up before the pool is made lets forked workers inherit the
+        #DTDs and publisher modules, workers that are not forked warm up in
+        #init_worker
+        prewarm()
+        pool = multiprocessing.Pool(processes=jobs,
+                                    initializer=init_worker,
+                                    initargs=(args, config, True, replaceable))
+        try:
+            #imap gives the results back in the order of submission
+            for input_path, input_results in zip(inputs, pool.imap(convert_input, inputs)):
+                for result in input_results:
+                    command_log.info('{0}: {1}'.format(result.status, result.input))
+                collect(input_path, input_results)
+        finally:
+            pool.close()
+            pool.join()
+            if journal is not None:
+                journal.close()
 
-            #Make the call to make_EPUB
-            success = make_EPUB(parsed_article,
-                                output_directory,
-                                abs_input_path,
-                                args['--images'],
-                                config_module=config,
-                                batch=True)
+    if runner is not None:
+        command_log.info('Waiting on epubcheck for {0} EPUBs'.format(len(checks)))
+        runner.close()
+        checks = [future.result() for future in checks]
+        for check in checks:
+            log_check(check)
 
-            #Cleanup is mandatory
-            command_log.info('Removing {0}'.format(output_directory))
-            shutil.rmtree(output_directory)
+    if not args['--silent']:
+        print_summary(results, checks, time.time() - start, resumed)
 
-            if not args['--no-epubcheck'] and success:
-                epub_name = '{0}.epub'.format(output_directory)
-                openaccess_epub.utils.epubcheck(epub_name, config)
+    if args['--report'] is not None:
+        checked = dict((check.epub, check) for check in checks)
+        rows = [report_row(result, checked.get(result.epub) if result.status == 'converted' else None)
+                for result in results]
+        write_report(args['--report'], rows)
+        if not args['--silent']:
+            print_percentiles(rows)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
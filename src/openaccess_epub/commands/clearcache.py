@@ -16,17 +16,29 @@ Clearcache Specific Options:
   -d --dry-run     Will print out what it would delete, instead of actually
                    deleting anything. Good idea to try this once before you
                    trust the command (because you are cautious and wise)
+  --max-size=MB    For prune, remove the least recently used articles until
+                   the image cache is no larger than this many megabytes
+  --older-than=DAYS
+                   For prune, remove the articles in the image cache which
+                   have not been used in this many days
 
 Recognized commands for oaepub clearcache are:
-  all     Delete all cached data: images, logs
-  images  Delete only the cached image files
-  logs    Delete only the cached log files
-  manual  Print out the cache location then exit
+  all          Delete all cached data: images, logs, conversions
+  conversions  Delete only the cached EPUB conversions
+  images       Delete only the cached image files, including optimized images
+  logs         Delete only the cached log files
+  manual       Print out the cache location then exit
+  prune        Remove images from the cache by size or age, keeping the most
+                 recently used
 
 Remember that you can disable any or all caching. Caching is very helpful for
 development, but may not be necessary for all users. If you want to manually
 alter your cache, you can use 'oaepub clearcache manual' to tell you where the
 cache is located.
+
+The prune command works from the index kept by the image cache, without walking
+the cache, so it is quick to run often. If neither of its options are given, it
+prunes to the image_cache_max_size in the config file.
 """
 
 #Standard Library modules
@@ -41,7 +53,8 @@ from docopt import docopt
 
 #OpenAccess_EPUB modules
 from openaccess_epub._version import __version__
-import openaccess_epub.utils
+from openaccess_epub.utils.image_store import ImageStore
+from openaccess_epub.utils.settings import load_settings
 
 
 def empty_it(path, dry_run):
@@ -55,15 +68,49 @@ def empty_it(path, dry_run):
             shutil.rmtree(os.path.join(root, d))
 
 
+def prune(config, args):
+    """
+    Removes the least recently used articles from the image cache, as set by
+    the --max-size and --older-than options.
+    """
+    try:
+        max_size = args['--max-size']
+        if max_size is not None:
+            max_size = int(float(max_size) * 1024 * 1024)
+        older_than = args['--older-than']
+        if older_than is not None:
+            older_than = float(older_than) * 24 * 60 * 60
+    except ValueError:
+        sys.exit('Arguments for --max-size and --older-than must be numbers')
+    if max_size is None and older_than is None:
+        configured = getattr(config, 'image_cache_max_size', 0)
+        if not configured:
+            sys.exit('No --max-size or --older-than given, and the image cache has no maximum size')
+        max_size = int(configured * 1024 * 1024)
+    store = ImageStore(config.image_cache)
+    evicted, freed = store.prune(max_size=max_size,
+                                 older_than=older_than,
+                                 dry_run=args['--dry-run'])
+    if args['--dry-run']:
+        for doi, doi_freed in evicted:
+            print('Evicting {0}, freeing {1} bytes'.format(doi, doi_freed))
+        message = 'Would remove {0} articles from the image cache, freeing {1:.1f} MB'
+    else:
+        message = 'Removed {0} articles from the image cache, freeing {1:.1f} MB'
+    print(message.format(len(evicted), freed / (1024 * 1024)))
+
+
 def main(argv=None):
     args = docopt(__doc__,
                   argv=argv,
                   version='OpenAccess_EPUB v.' + __version__,
                   options_first=True)
 
-    config = openaccess_epub.utils.load_config_module()
+    config = load_settings()
 
-    cache_loc = openaccess_epub.utils.cache_location()
+    cache_loc = config.cache_location
+    conversion_cache = config.conversion_cache
+    optimized_images = os.path.join(cache_loc, 'optimized_images')
 
     if args['COMMAND'] == 'manual':
         # We'll *try* to launch a file browser, at least print cache location
@@ -84,10 +131,19 @@ def main(argv=None):
         sys.exit()
     elif args['COMMAND'] == 'images':
         empty_it(config.image_cache, dry_run=args['--dry-run'])
+        empty_it(optimized_images, dry_run=args['--dry-run'])
+        sys.exit()
+    elif args['COMMAND'] == 'conversions':
+        empty_it(conversion_cache, dry_run=args['--dry-run'])
+        sys.exit()
+    elif args['COMMAND'] == 'prune':
+        prune(config, args)
         sys.exit()
     elif args['COMMAND'] == 'all':
         empty_it(os.path.join(cache_loc, 'logs'), dry_run=args['--dry-run'])
         empty_it(config.image_cache, dry_run=args['--dry-run'])
+        empty_it(optimized_images, dry_run=args['--dry-run'])
+        empty_it(conversion_cache, dry_run=args['--dry-run'])
         sys.exit()
 
 
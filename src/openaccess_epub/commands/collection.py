@@ -3,7 +3,8 @@
 """
 oaepub collection
 
-Convert and compile a collection of article XML files into a single EPUB
+Convert and compile a collection of article XML files into a single EPUB, or
+into a set of EPUB volumes
 
 Usage:
   collection [--silent | --verbosity=LEVEL] [--epub2 | --epub3] [options]
@@ -20,8 +21,8 @@ General Options:
 Collection Specific Options:
   -2 --epub2            Convert to EPUB2
   -3 --epub3            Convert to EPUB3
-  --no-cleanup          The EPUB contents prior to .epub-packaging will not be
-                        removed
+  --no-cleanup          The EPUB contents will also be written to a directory,
+                        which is kept after .epub-packaging
   --no-epubcheck        Disable the use of epubcheck to validate EPUBs
   --no-validate         Disable DTD validation of XML files during conversion.
                         This is only advised if you have pre-validated the files
@@ -34,6 +35,17 @@ Collection Specific Options:
                         filename without extension. For more information and
                         default configuration see the config file
                         ('oaepub configure where')
+  -j --jobs=N           Number of worker processes converting articles in
+                        parallel [default: 1]
+
+Volume Options:
+  --max-volume-size=MB  Split the collection into volumes whose articles,
+                        with their local images, total at most this many
+                        megabytes, 0 for no limit [default: 0]
+  --max-articles-per-volume=N
+                        Split the collection into volumes of at most this
+                        many articles, 0 for no limit [default: 0]
+  --volume=N            Build only the Nth volume of the collection
 
 Logging Options:
   --no-log-file         Disable logging to file
@@ -50,13 +62,36 @@ the --log-to option is used).
 If using the --images option, the argument should employ the "*" expansion. As
 a precaution against wasting time, this command will quit if the "*" is missing.
 
+Each article is written into the EPUB as soon as it has been converted, and only
+a compact record of its navigation and metadata is kept, from which the
+navigation and package documents are written once all articles are done. A
+collection of thousands of articles is thus built in about the memory needed for
+its largest article.
+
+With --jobs greater than 1, the articles are parsed, given their images and
+rendered by a pool of worker processes. Their files and records are merged in
+the order of the collection file, so the EPUB is the same as one built by a
+single process. Unless --epub2 or --epub3 is given, the EPUB version is that of
+the publisher of the first article in the collection file.
+
+A large collection may be split into volumes with the options --max-volume-size
+and --max-articles-per-volume. The collection file is divided, in order, before
+any article is converted; the size of an article is that of its XML file and of
+its image directory, if one is given with --images or found beside the XML file.
+Each volume is a complete EPUB, with its own navigation and package documents,
+named after the collection file with its volume number, such as
+"my_collection_vol02.epub". As the division depends only on the collection file
+and the options, separate runs of this command, each given a different volume
+number with --volume, may build the volumes in parallel.
+
 Note: Metadata in a Collection EPUB is limited by necessity, not by mistake.
 """
 
 #Standard Library modules
+from collections import deque, namedtuple
 import logging
+import multiprocessing
 import os
-import shutil
 import sys
 
 #Non-Standard Library modules
@@ -67,18 +102,248 @@ from openaccess_epub._version import __version__
 from openaccess_epub.navigation import Navigation
 from openaccess_epub.package import Package
 import openaccess_epub.utils as utils
-from openaccess_epub.utils.epub import epub_zip, make_epub_base
+from openaccess_epub.utils.epub import epub_zip, make_epub_base,\
+    BufferWriter, EPUBWriter, DirectoryWriter, compression_options
 import openaccess_epub.utils.images
 import openaccess_epub.utils.logs as oae_logging
+from openaccess_epub.utils.settings import command_overrides, load_settings
 from openaccess_epub.article import Article
 
 
+rendered_article = namedtuple('rendered_article', 'navigation, package, epub_version')
+
+
+def directory_size(directory):
+    """
+    Returns the total size in bytes of the files in a directory.
+    """
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for filename in filenames:
+            total += os.path.getsize(os.path.join(dirpath, filename))
+    return total
+
+
+def article_size(xml_path, explicit, config):
+    """
+    Estimates the size in bytes an article adds to a volume: that of its XML
+    file, and of its image directory if it may be found locally. Images which
+    will come from the cache or be fetched are not counted.
+    """
+    size = os.path.getsize(xml_path)
+    rootname = utils.file_root_name(xml_path)
+    if explicit:
+        images = openaccess_epub.utils.images.explicit_images(explicit, rootname)
+    elif config.use_input_relative_images:
+        images = openaccess_epub.utils.images.input_relative_images(xml_path,
+                                                                    rootname,
+                                                                    config)
+    else:
+        images = None
+    if images is not None:
+        size += directory_size(images)
+    return size
+
+
+def partition_volumes(xml_paths, sizes, max_size=0, max_articles=0):
+    """
+    Divides the articles of a collection, in order, into volumes. A volume is
+    closed before the article which would take it over `max_size` bytes or
+    `max_articles` articles, but always holds at least one article. A limit of
+    0 is no limit.
+
+    Returns a list of lists of the paths in each volume.
+    """
+    volumes = []
+    volume, volume_size = [], 0
+    for xml_path, size in zip(xml_paths, sizes):
+        if volume and ((max_size and volume_size + size > max_size) or
+                       (max_articles and len(volume) >= max_articles)):
+            volumes.append(volume)
+            volume, volume_size = [], 0
+        volume.append(xml_path)
+        volume_size += size
+    if volume:
+        volumes.append(volume)
+    return volumes
+
+
+def render_article(writer, xml_path, args, config, epub_version):
+    """
+    Converts an article of the collection, writing its content and images with
+    `writer`. Returns a rendered_article holding the nav_record and
+    package_record of the article, and the EPUB version used, which is that of
+    its publisher if `epub_version` is None.
+    """
+    parsed_article = Article(xml_path, validation=not args['--no-validate'])
+    if parsed_article.publisher is None:
+        sys.exit('Publisher support was not established for {0}'.format(xml_path))
+    if epub_version is None:
+        epub_version = parsed_article.publisher.epub_default
+
+    #Get the images, which must be indexed before the package records the
+    #article
+    if not openaccess_epub.utils.images.get_images(writer,
+                                                   args['--images'],
+                                                   xml_path,
+                                                   config,
+                                                   parsed_article):
+        sys.exit('Images for {0} could not be located'.format(xml_path))
+
+    #The records are made before rendering, which may alter the article
+    nav_record = Navigation(collection=True).record(parsed_article)
+    package_record = Package(collection=True).record(parsed_article)
+
+    parsed_article.publisher.render_content(writer, epub_version)
+    return rendered_article(nav_record, package_record, epub_version)
+
+
+#State for render_in_worker, set up once per process by init_worker
+_worker = {}
+
+
+def init_worker(args, config, epub_version):
+    """
+    Prepares a worker process for rendering articles with render_in_worker.
+    """
+    _worker['args'] = args
+    _worker['config'] = config
+    _worker['epub_version'] = epub_version
+
+
+def render_in_worker(xml_path):
+    """
+    Renders an article of the collection in a worker process. Returns the
+    BufferWriter holding its files and its rendered_article, or None and the
+    reason if it could not be converted.
+    """
+    buffer = BufferWriter()
+    try:
+        rendered = render_article(buffer,
+                                  xml_path,
+                                  _worker['args'],
+                                  _worker['config'],
+                                  _worker['epub_version'])
+    except SystemExit as err:
+        #Exiting would only end the worker, the main process exits instead
+        if isinstance(err.code, str):
+            return None, err.code
+        return None, 'Unable to convert {0}'.format(xml_path)
+    return buffer, rendered
+
+
+def windowed_results(pool, function, items, window):
+    """
+    Yields the results of `function` for each of the items, in order, computed
+    by the worker pool. No more than `window` items are in flight at a time, so
+    results are not gathered in memory faster than they are used.
+    """
+    pending = deque()
+    for item in items:
+        pending.append(pool.apply_async(function, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def collection_epub_version(xml_path):
+    """
+    Returns the default EPUB version of the publisher of an article, which
+    settles the version of the whole collection, so that volumes built
+    separately do not differ.
+    """
+    parsed_article = Article(xml_path, validation=False)
+    if parsed_article.publisher is None:
+        sys.exit('Publisher support was not established for {0}'.format(xml_path))
+    return parsed_article.publisher.epub_default
+
+
+def build_volume(output_directory, title, xml_paths, results, args, config,
+                 epub_version):
+    """
+    Builds one EPUB of the collection, with its own navigation and package
+    documents, from the articles at `xml_paths`. If `results` is None the
+    articles are rendered here, otherwise it is the iterator of the worker pool
+    from which their rendered files and records are taken, in order.
+    """
+    command_log = logging.getLogger('openaccess_epub.commands.collection')
+    command_log.info('Processing collection output in {0}'.format(output_directory))
+
+    if args['--no-cleanup']:
+        if os.path.isdir(output_directory):
+            utils.dir_exists(output_directory)
+        writer = DirectoryWriter(output_directory)
+    else:
+        parent_directory = os.path.dirname(output_directory)
+        try:
+            os.makedirs(parent_directory)
+        except OSError as err:
+            if err.errno != 17:
+                command_log.exception('Unable to recursively create output directories')
+        writer = EPUBWriter(output_directory + '.epub',
+                            **compression_options(config))
+
+    #Instantiate collection NCX and OPF
+    navigation = Navigation(collection=True)
+    package = Package(collection=True, title=title)
+
+    with writer:
+        #Write the basic EPUB files
+        make_epub_base(writer)
+
+        #Each article is written into the EPUB as soon as it is rendered, and
+        #only its records are kept for the navigation and package documents
+        for xml_path in xml_paths:
+            if results is None:
+                rendered = render_article(writer, xml_path, args, config, epub_version)
+            else:
+                buffer, rendered = next(results)
+                if buffer is None:
+                    sys.exit(rendered)
+                buffer.write_to(writer)
+            navigation.add_record(rendered.navigation)
+            package.add_record(rendered.package)
+
+        if epub_version == 2:
+            navigation.render_EPUB2(writer)
+            package.render_EPUB2(writer)
+        elif epub_version == 3:
+            navigation.render_EPUB3(writer)
+            package.render_EPUB3(writer)
+
+    #The kept directory still needs to be zipped into the EPUB
+    if args['--no-cleanup']:
+        epub_zip(output_directory, **compression_options(config))
+
+    #Running epubcheck on the output verifies the validity of the ePub,
+    #requires a local installation of java and epubcheck.
+    if not config.disable_epubcheck:
+        epub_name = '{0}.epub'.format(output_directory)
+        openaccess_epub.utils.epubcheck(epub_name, config)
+
+
 def main(argv=None):
     args = docopt(__doc__,
                   argv=argv,
                   version='OpenAccess_EPUB v.' + __version__,
                   options_first=True)
 
+    try:
+        jobs = int(args['--jobs'])
+    except ValueError:
+        sys.exit('Argument for --jobs option must be an integer')
+    if jobs < 1:
+        sys.exit('Argument for --jobs option must be at least 1')
+    try:
+        max_size = float(args['--max-volume-size'])
+        max_articles = int(args['--max-articles-per-volume'])
+        volume_number = int(args['--volume']) if args['--volume'] else None
+    except ValueError:
+        sys.exit('Arguments for the volume options must be numbers')
+    if max_size < 0 or max_articles < 0:
+        sys.exit('Volume limits must not be negative')
+
     c_file = args['COLLECTION_FILE']
     c_file_root = utils.file_root_name(c_file)
     abs_input_path = utils.get_absolute_path(c_file)
@@ -98,8 +363,8 @@ def main(argv=None):
 
     command_log = logging.getLogger('openaccess_epub.commands.collection')
 
-    #Load the config module, we do this after logging configuration
-    config = openaccess_epub.utils.load_config_module()
+    #Resolve the settings, we do this after logging configuration
+    config = load_settings(command_overrides(args))
 
     #Quit if the collection file is not there
     if not os.path.isfile(c_file):
@@ -111,82 +376,81 @@ def main(argv=None):
         inputs = [line.strip() for line in f.readlines()]
 
     #Get the output directory
-    if args['--output'] is not None:
-        output_directory = utils.get_absolute_path(args['--output'])
+    if os.path.isabs(config.default_output):  # Absolute remains so
+        output_directory = config.default_output
+    else:  # Else rendered relative to input
+        abs_dirname = os.path.dirname(abs_input_path)
+        output_directory = os.path.normpath(os.path.join(abs_dirname, config.default_output))
+
+    xml_paths = [utils.evaluate_relative_path(os.path.dirname(abs_input_path),
+                                              xml_file) for xml_file in inputs]
+
+    #Divide the collection into volumes, a single one if there are no limits
+    if max_size:
+        #Configured in megabytes
+        sizes = [article_size(xml_path, args['--images'], config) for xml_path in xml_paths]
     else:
-        if os.path.isabs(config.default_output):  # Absolute remains so
-            output_directory = config.default_output
-        else:  # Else rendered relative to input
-            abs_dirname = os.path.dirname(abs_input_path)
-            output_directory = os.path.normpath(os.path.join(abs_dirname, config.default_output))
-
-    output_directory = os.path.join(output_directory, c_file_root)
-    command_log.info('Processing collection output in {0}'.format(output_directory))
-
-    if os.path.isdir(output_directory):
-        utils.dir_exists(output_directory)
+        sizes = [0] * len(xml_paths)
+    volumes = partition_volumes(xml_paths,
+                                sizes,
+                                int(max_size * 1024 * 1024),
+                                max_articles) or [[]]
+    if len(volumes) > 1:
+        width = len(str(len(volumes)))
+        names = ['{0}_vol{1:0{2}d}'.format(c_file_root, number, width)
+                 for number in range(1, len(volumes) + 1)]
+        titles = ['{0}, Volume {1}'.format(c_file_root, number)
+                  for number in range(1, len(volumes) + 1)]
+        command_log.info('Collection divided into {0} volumes'.format(len(volumes)))
+    else:
+        names, titles = [c_file_root], [c_file_root]
+    selected = list(range(len(volumes)))
+    if volume_number is not None:
+        if not 1 <= volume_number <= len(volumes):
+            sys.exit('The collection has {0} volumes, no volume {1}'.format(len(volumes),
+                                                                           volume_number))
+        selected = [volume_number - 1]
+
+    if args['--epub2']:
+        epub_version = 2
+    elif args['--epub3']:
+        epub_version = 3
+    elif xml_paths:
+        epub_version = collection_epub_version(xml_paths[0])  # No mixing!
+    else:
+        epub_version = None
+
+    pool, results = None, None
+    if jobs > 1:
+        command_log.info('Converting with {0} worker processes'.format(jobs))
+        #Forked workers inherit the DTD and publisher loaded for the version.
+        #The articles of the selected volumes form one queue, so the workers
+        #carry on with the next volume while one is being finished, but only a
+        #few articles ahead, to keep the memory used bounded
+        pool = multiprocessing.Pool(processes=jobs,
+                                    initializer=init_worker,
+                                    initargs=(args, config, epub_version))
+        queued = (xml_path for index in selected for xml_path in volumes[index])
+        results = windowed_results(pool, render_in_worker, queued, 2 * jobs)
     try:
-        os.makedirs(output_directory)
-    except OSError as err:
-        if err.errno != 17:
-            command_log.exception('Unable to recursively create output directories')
-
-    #Instantiate collection NCX and OPF
-    navigation = Navigation(collection=True)
-    package = Package(collection=True, title=c_file_root)
-
-    #Copy over the basic epub directory
-    make_epub_base(output_directory)
-
-    epub_version = None
-
-    #Iterate over the inputs
-    for xml_file in inputs:
-        xml_path = utils.evaluate_relative_path(os.path.dirname(abs_input_path),
-                                                xml_file)
-        parsed_article = Article(xml_path, validation=not args['--no-validate'])
-        if epub_version is None:  # Only set this once, no mixing!
-            if args['--epub2']:
-                epub_version = 2
-            elif args['--epub3']:
-                epub_version = 3
-            else:
-                epub_version = parsed_article.publisher.epub_default
-
-        navigation.process(parsed_article)
-        package.process(parsed_article)
-
-        #Get the Digital Object Identifier
-        doi = parsed_article.get_DOI()
-        journal_doi, article_doi = doi.split('/')
-
-        #Get the images
-        openaccess_epub.utils.images.get_images(output_directory,
-                                                args['--images'],
-                                                xml_path,
-                                                config,
-                                                parsed_article)
-
-        parsed_article.publisher.render_content(output_directory, epub_version)
-
-    if epub_version == 2:
-        navigation.render_EPUB2(output_directory)
-        package.render_EPUB2(output_directory)
-    elif epub_version == 3:
-        navigation.render_EPUB3(output_directory)
-        package.render_EPUB3(output_directory)
-    epub_zip(output_directory)
-
-    #Cleanup removes the produced output directory, keeps the EPUB
-    if not args['--no-cleanup']:
-        command_log.info('Removing {0}'.format(output_directory))
-        shutil.rmtree(output_directory)
-
-    #Running epubcheck on the output verifies the validity of the ePub,
-    #requires a local installation of java and epubcheck.
-    if not args['--no-epubcheck']:
-        epub_name = '{0}.epub'.format(output_directory)
-        openaccess_epub.utils.epubcheck(epub_name, config)
+        for index in selected:
+            build_volume(os.path.join(output_directory, names[index]),
+                         titles[index],
+                         volumes[index],
+                         results,
+                         args,
+                         config,
+                         epub_version)
+    except BaseException:
+        if pool is not None:
+            pool.terminate()
+        raise
+    else:
+        if pool is not None:
+            pool.close()
+    finally:
+        if pool is not None:
+            pool.join()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
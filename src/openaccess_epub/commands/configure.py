@@ -42,6 +42,11 @@ CONFIG_TEXT = '''# -*- coding: utf-8 -*-
 # broadly defined options, and should have the same meaning within the context
 # of distinct oaepub subcommands. Note that commandline options passed to the
 # oaepub commands will always take precedence over these defaults.
+#
+# Any value set here may also be overridden by an environment variable named
+# OAEPUB_ and the name of the value in upper case, such as OAEPUB_USE_IMAGE_CACHE
+# set to y or n, OAEPUB_IMAGE_FETCH_WORKERS set to a number, or
+# OAEPUB_INPUT_RELATIVE_IMAGES set to a comma-separated list.
 
 # TAKE NOTE: The Meaning of Absolute or Relative Paths
 # Some options require absolute path locations. Others require relative path
@@ -89,16 +94,67 @@ image_cache = '{image-cache}'
 # A Boolean toggle for whether or not to use the Image Cache
 use_image_cache = {use-image-cache}
 
+# The maximum size of the image cache in megabytes, 0 for no limit. The least
+# recently used articles are removed to stay within it
+image_cache_max_size = {image-cache-max-size}
+
 # -- Image Fetching Options --
 # A Boolean toggle for whether or not to use Image Fetching
 use_image_fetching = {use-image-fetching}
 
+# The number of images downloaded at the same time
+image_fetch_workers = {image-fetch-workers}
+
+# The most requests per second sent to any one server, 0 for no limit
+image_fetch_rate = {image-fetch-rate}
+
+# How many times a failed download is retried, waiting longer each time
+image_fetch_retries = {image-fetch-retries}
+
+# -- Image Optimization Options --
+# A Boolean toggle for whether or not to optimize images before they are put
+# into the EPUB: TIFF images are converted, large images are scaled down and PNG
+# images are recompressed. Requires the Pillow package
+optimize_images = {optimize-images}
+
+# The largest width or height of an image in pixels, 0 for no limit
+image_max_dimension = {image-max-dimension}
+
+# The format TIFF images are converted to, one of 'png' or 'jpeg'
+tiff_conversion = '{tiff-conversion}'
+
+# The quality of JPEG images produced, from 1 (smallest) to 95 (best)
+jpeg_quality = {jpeg-quality}
+
 # -- Output Configuration -----------------------------------------------------
 # OpenAccess_EPUB can place the output in the desired location. A relative path
 # will be interpreted as relative to the input, and an absolute path will serve
 # as a fixed output directory.
 default_output = '{default-output}'
 
+# The compression of the files within the EPUB, one of 'stored' (none) or
+# 'deflated'. The mimetype file is always stored, as the EPUB standard requires.
+epub_compression = '{epub-compression}'
+
+# The level of compression for 'deflated', from 1 (fastest) to 9 (smallest)
+epub_compression_level = {epub-compression-level}
+
+# -- Conversion Cache Configuration -------------------------------------------
+# OpenAccess_EPUB can keep a copy of each EPUB it produces, keyed by the article
+# XML, its images, this configuration and the OpenAccess_EPUB version. When an
+# article is converted again with none of these changed, the cached EPUB is
+# reused instead of rendering it again.
+
+# An absolute path to the conversion cache directory
+conversion_cache = '{conversion-cache}'
+
+# A Boolean toggle for whether or not to use the Conversion Cache
+use_conversion_cache = {use-conversion-cache}
+
+# The maximum size of the conversion cache in megabytes, the least recently
+# used EPUB files are removed to stay within it
+conversion_cache_max_size = {conversion-cache-max-size}
+
 # -- CSS Configuration --------------------------------------------------------
 # OpenAccess_EPUB can utilize a CSS file relative to the input if configured,
 # it will be employed instead of the default CSS if found. This variable sets
@@ -147,6 +203,49 @@ def boolean(x):
     return x.upper() in ('Y', 'YES')
 
 
+def integer(x):
+    try:
+        value = int(x)
+    except ValueError:
+        raise ValidationError('Please enter a whole number.')
+    if value < 0:
+        raise ValidationError('Please enter a positive number.')
+    return value
+
+
+def positive_integer(x):
+    value = integer(x)
+    if value < 1:
+        raise ValidationError('Please enter a number of at least 1.')
+    return value
+
+
+def compression(x):
+    if x.lower() not in ('stored', 'deflated'):
+        raise ValidationError("Please enter either 'stored' or 'deflated'.")
+    return x.lower()
+
+
+def compression_level(x):
+    value = integer(x)
+    if value > 9:
+        raise ValidationError('Please enter a number from 0 to 9.')
+    return value
+
+
+def image_format(x):
+    if x.lower() not in ('png', 'jpeg'):
+        raise ValidationError("Please enter either 'png' or 'jpeg'.")
+    return x.lower()
+
+
+def jpeg_quality(x):
+    value = integer(x)
+    if not 1 <= value <= 95:
+        raise ValidationError('Please enter a number from 1 to 95.')
+    return value
+
+
 def list_opts(x):
     try:
         return ', '.join(['\'' + unix_path_coercion(opt.strip()) + '\'' for opt in x.split(',')])
@@ -206,8 +305,21 @@ def configure(default=None, dev=None):
                 'use-input-relative-images': 'y',
                 'image-cache': os.path.join(cache_loc, 'img_cache'),
                 'use-image-cache': 'n',
+                'image-cache-max-size': '4096',
                 'use-image-fetching': 'y',
+                'image-fetch-workers': '8',
+                'image-fetch-rate': '4',
+                'image-fetch-retries': '4',
+                'optimize-images': 'n',
+                'image-max-dimension': '2048',
+                'tiff-conversion': 'png',
+                'jpeg-quality': '85',
                 'default-output': '.',
+                'epub-compression': 'deflated',
+                'epub-compression-level': '6',
+                'conversion-cache': os.path.join(cache_loc, 'conversion_cache'),
+                'use-conversion-cache': 'n',
+                'conversion-cache-max-size': '2048',
                 'input-relative-css': '.',
                 'epubcheck-jarfile': os.path.join(cache_loc,
                                                  'epubcheck-3.0',
@@ -221,8 +333,21 @@ def configure(default=None, dev=None):
         defaults['use-input-relative-images'] = boolean(defaults['use-input-relative-images'])
         defaults['image-cache'] = absolute_path(defaults['image-cache'])
         defaults['use-image-cache'] = boolean(defaults['use-image-cache'])
+        defaults['image-cache-max-size'] = integer(defaults['image-cache-max-size'])
         defaults['use-image-fetching'] = boolean(defaults['use-image-fetching'])
+        defaults['image-fetch-workers'] = positive_integer(defaults['image-fetch-workers'])
+        defaults['image-fetch-rate'] = integer(defaults['image-fetch-rate'])
+        defaults['image-fetch-retries'] = integer(defaults['image-fetch-retries'])
+        defaults['optimize-images'] = boolean(defaults['optimize-images'])
+        defaults['image-max-dimension'] = integer(defaults['image-max-dimension'])
+        defaults['tiff-conversion'] = image_format(defaults['tiff-conversion'])
+        defaults['jpeg-quality'] = jpeg_quality(defaults['jpeg-quality'])
         defaults['default-output'] = nonempty(defaults['default-output'])
+        defaults['epub-compression'] = compression(defaults['epub-compression'])
+        defaults['epub-compression-level'] = compression_level(defaults['epub-compression-level'])
+        defaults['conversion-cache'] = absolute_path(defaults['conversion-cache'])
+        defaults['use-conversion-cache'] = boolean(defaults['use-conversion-cache'])
+        defaults['conversion-cache-max-size'] = integer(defaults['conversion-cache-max-size'])
         defaults['input-relative-css'] = nonempty(defaults['input-relative-css'])
         defaults['epubcheck-jarfile'] = absolute_path(defaults['epubcheck-jarfile'])
         config = config_formatter(CONFIG_TEXT, defaults)
@@ -291,6 +416,12 @@ consume extra disk space for storage.''')
     user_prompt(config_dict, 'use-image-cache', 'Use image cache?: (y/N)',
                 default=defaults['use-image-cache'],
                 validator=boolean)
+    print('''
+What is the largest size, in megabytes, the image cache may grow to? Use 0 for
+no limit.''')
+    user_prompt(config_dict, 'image-cache-max-size', 'Image cache size?:',
+                default=defaults['image-cache-max-size'],
+                validator=integer)
     #Image fetching online details
     print('''
 Should OpenAccess_EPUB attempt to download the images from the Internet? This
@@ -299,6 +430,47 @@ need to download them manually if this does not work.''')
     user_prompt(config_dict, 'use-image-fetching', 'Attempt image download?: (Y/n)',
                 default=defaults['use-image-fetching'],
                 validator=boolean)
+    print('''
+How many images should be downloaded at the same time?''')
+    user_prompt(config_dict, 'image-fetch-workers', 'Simultaneous downloads?:',
+                default=defaults['image-fetch-workers'],
+                validator=positive_integer)
+    print('''
+How many requests per second may be sent to any one server? Use 0 for no limit.''')
+    user_prompt(config_dict, 'image-fetch-rate', 'Requests per second?:',
+                default=defaults['image-fetch-rate'],
+                validator=integer)
+    print('''
+How many times should a failed download be retried?''')
+    user_prompt(config_dict, 'image-fetch-retries', 'Download retries?:',
+                default=defaults['image-fetch-retries'],
+                validator=integer)
+    print('''
+OpenAccess_EPUB can optimize images before putting them in the ePub, converting
+TIFF images, which ePub readers do not support, scaling down very large images
+and recompressing PNG images. This requires the Pillow package. Optimized images
+are cached, so each is only optimized once.
+
+Should images be optimized?''')
+    user_prompt(config_dict, 'optimize-images', 'Optimize images?: (y/N)',
+                default=defaults['optimize-images'],
+                validator=boolean)
+    print('''
+What is the largest width or height, in pixels, an image may have? Use 0 for no
+limit.''')
+    user_prompt(config_dict, 'image-max-dimension', 'Maximum dimension?:',
+                default=defaults['image-max-dimension'],
+                validator=integer)
+    print('''
+Should TIFF images be converted to 'png' (lossless) or 'jpeg' (smaller)?''')
+    user_prompt(config_dict, 'tiff-conversion', 'TIFF conversion?:',
+                default=defaults['tiff-conversion'],
+                validator=image_format)
+    print('''
+What quality should JPEG images have? From 1 (smallest) to 95 (best).''')
+    user_prompt(config_dict, 'jpeg-quality', 'JPEG quality?:',
+                default=defaults['jpeg-quality'],
+                validator=jpeg_quality)
     #Output configuration
     print('''
  -- Configure Output Behavior --
@@ -314,6 +486,40 @@ is to place them in the same directory as the input.''')
                 default=defaults['default-output'],
                 validator=nonempty)
     print('''
+Should the files within the ePub be compressed? 'deflated' produces much smaller
+ePub files, 'stored' leaves them uncompressed.''')
+    user_prompt(config_dict, 'epub-compression', 'Compression?:',
+                default=defaults['epub-compression'],
+                validator=compression)
+    print('''
+What level of compression should be used? From 1 (fastest) to 9 (smallest).''')
+    user_prompt(config_dict, 'epub-compression-level', 'Compression level?:',
+                default=defaults['epub-compression-level'],
+                validator=compression_level)
+    print('''
+ -- Configure Conversion Cache --
+
+OpenAccess_EPUB can keep a copy of each ePub it produces and reuse it when the
+same article is converted again with unchanged XML, images and configuration.
+This saves a great deal of time when regularly converting large collections.
+
+Where should OpenAccess_EPUB place the conversion cache?''')
+    user_prompt(config_dict, 'conversion-cache', 'Conversion cache?:',
+                default=defaults['conversion-cache'],
+                validator=absolute_path)
+    print('''
+Should OpenAccess_EPUB use the conversion cache by default?''')
+    user_prompt(config_dict, 'use-conversion-cache',
+                'Use conversion cache?: (y/N)',
+                default=defaults['use-conversion-cache'],
+                validator=boolean)
+    print('''
+What is the largest size, in megabytes, the conversion cache may grow to?''')
+    user_prompt(config_dict, 'conversion-cache-max-size',
+                'Conversion cache size?:',
+                default=defaults['conversion-cache-max-size'],
+                validator=integer)
+    print('''
  -- Configure CSS Behavior --
 
 ePub files use CSS for improved styling, and ePub-readers must support a basic
@@ -19,8 +19,8 @@ General Options:
 Convert Specific Options:
   -2 --epub2            Convert to EPUB2
   -3 --epub3            Convert to EPUB3
-  --no-cleanup          The EPUB contents prior to .epub-packaging will not be
-                        removed
+  --no-cleanup          The EPUB contents will also be written to a directory,
+                        which is kept after .epub-packaging
   --no-epubcheck        Disable the use of epubcheck to validate EPUBs
   --no-validate         Disable DTD validation of XML files during conversion.
                         This is only advised if you have pre-validated the files
@@ -71,6 +71,7 @@ from openaccess_epub.utils.epub import make_EPUB
 import openaccess_epub.utils.images
 import openaccess_epub.utils.inputs as input_utils
 import openaccess_epub.utils.logs as oae_logging
+from openaccess_epub.utils.settings import command_overrides, load_settings
 from openaccess_epub.article import Article
 
 
@@ -97,8 +98,8 @@ def main(argv=None):
     #Get a logger, the 'openaccess_epub' logger was set up above
     command_log = logging.getLogger('openaccess_epub.commands.convert')
 
-    #Load the config module, we do this after logging configuration
-    config = openaccess_epub.utils.load_config_module()
+    #Resolve the settings, we do this after logging configuration
+    config = load_settings(command_overrides(args))
 
     current_dir = os.getcwd()
     #Our basic flow is to iterate over the args['INPUT'] list
@@ -147,14 +148,11 @@ def main(argv=None):
             sys.exit(1)
 
         #Get the output directory
-        if args['--output'] is not None:
-            output_directory = openaccess_epub.utils.get_absolute_path(args['--output'])
-        else:
-            if os.path.isabs(config.default_output):  # Absolute remains so
-                output_directory = config.default_output
-            else:  # Else rendered relative to input
-                abs_dirname = os.path.dirname(abs_input_path)
-                output_directory = os.path.normpath(os.path.join(abs_dirname, config.default_output))
+        if os.path.isabs(config.default_output):  # Absolute remains so
+            output_directory = config.default_output
+        else:  # Else rendered relative to input
+            abs_dirname = os.path.dirname(abs_input_path)
+            output_directory = os.path.normpath(os.path.join(abs_dirname, config.default_output))
 
         #The root name must be added on for output
         output_directory = os.path.join(output_directory, root_name)
@@ -165,16 +163,12 @@ def main(argv=None):
                             abs_input_path,
                             args['--images'],
                             config_module=config,
-                            epub_version=epub_version)
-
-        #Cleanup removes the produced output directory, keeps the EPUB
-        if not args['--no-cleanup']:
-            command_log.info('Removing {0}'.format(output_directory))
-            shutil.rmtree(output_directory)
+                            epub_version=epub_version,
+                            keep_directory=args['--no-cleanup'])
 
         #Running epubcheck on the output verifies the validity of the EPUB,
         #requires a local installation of java and epubcheck.
-        if not args['--no-epubcheck'] and success:
+        if not config.disable_epubcheck and success:
             epub_name = '{0}.epub'.format(output_directory)
             openaccess_epub.utils.epubcheck(epub_name, config)
 
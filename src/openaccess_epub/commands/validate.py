@@ -42,21 +42,11 @@ import lxml.etree
 
 #OpenAccess_EPUB modules
 from openaccess_epub._version import __version__
-from openaccess_epub import JPTS10_PATH, JPTS11_PATH, JPTS20_PATH,\
-    JPTS21_PATH, JPTS22_PATH, JPTS23_PATH, JPTS30_PATH
 from openaccess_epub.utils import files_with_ext
+import openaccess_epub.utils.dtd as dtd_registry
 import openaccess_epub.utils.logs as logs
 
 
-DTDS = {'-//NLM//DTD Journal Archiving and Interchange DTD v1.0 20021201//EN': lxml.etree.DTD(JPTS10_PATH),
-        '-//NLM//DTD Journal Archiving and Interchange DTD v1.1 20031101//EN': lxml.etree.DTD(JPTS11_PATH),
-        '-//NLM//DTD Journal Publishing DTD v2.0 20040830//EN': lxml.etree.DTD(JPTS20_PATH),
-        '-//NLM//DTD Journal Publishing DTD v2.1 20050630//EN': lxml.etree.DTD(JPTS21_PATH),
-        '-//NLM//DTD Journal Publishing DTD v2.2 20060430//EN': lxml.etree.DTD(JPTS22_PATH),
-        '-//NLM//DTD Journal Publishing DTD v2.3 20070202//EN': lxml.etree.DTD(JPTS23_PATH),
-        '-//NLM//DTD Journal Publishing DTD v3.0 20080202//EN': lxml.etree.DTD(JPTS30_PATH)}
-
-
 def main(argv=None):
     args = docopt(__doc__,
                   argv=argv,
@@ -106,12 +96,13 @@ def main(argv=None):
 
             #Find its public id so we can identify the appropriate DTD
             public_id = document.docinfo.public_id
-            #Get the dtd by the public id
+            #Get the dtd by the public id, DTDs are only parsed when first used
             try:
-                dtd = DTDS[public_id]
+                dtd = dtd_registry.get_dtd(public_id)
             except KeyError as err:
                 log.info('FAILED: Unknown DTD Error; {0}'.format(xml_file))
                 log.info(str(err))
+                continue
 
             #Actual DTD validation
             if not dtd.validate(document):
@@ -0,0 +1,44 @@
+/*
+ * Checks many EPUB files with epubcheck in one Java virtual machine.
+ *
+ * Run with the epubcheck .jar on the class path, using the single-file source
+ * launcher of Java 11 and later:
+ *
+ *     java -cp epubcheck.jar EpubcheckServer.java END-TOKEN
+ *
+ * The path of an EPUB file is read from each line of standard input and the
+ * EPUB is checked, its messages being printed as the epubcheck command line
+ * prints them. After each EPUB a line holding the end token and DONE is
+ * printed, or the end token and FAILED if epubcheck could not check it.
+ */
+
+import com.adobe.epubcheck.api.EpubCheck;
+import com.adobe.epubcheck.util.DefaultReportImpl;
+
+import java.io.BufferedReader;
+import java.io.File;
+import java.io.InputStreamReader;
+import java.nio.charset.StandardCharsets;
+
+public class EpubcheckServer {
+    public static void main(String[] args) throws Exception {
+        String endToken = args[0];
+        //Messages printed to either stream arrive in order, on one stream
+        System.setErr(System.out);
+        BufferedReader input = new BufferedReader(
+            new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        String path;
+        while ((path = input.readLine()) != null) {
+            String status;
+            try {
+                new EpubCheck(new File(path), new DefaultReportImpl(path)).validate();
+                status = "DONE";
+            } catch (Throwable err) {
+                System.out.println("FATAL: " + path + ": " + err);
+                status = "FAILED";
+            }
+            System.out.println(endToken + " " + status);
+            System.out.flush();
+        }
+    }
+}
@@ -16,7 +16,6 @@ publisher-specific metadata methods required.
 #Standard Library modules
 from collections import namedtuple
 import logging
-import os
 
 #Non-Standard Library modules
 from lxml import etree
@@ -30,8 +29,37 @@ log = logging.getLogger('openaccess_epub.navigation')
 
 navpoint = namedtuple('navpoint', 'id, label, playOrder, source, children')
 
+#Everything the Navigation needs from an article, see Navigation.record
+nav_record = namedtuple('nav_record', 'doi, title, contributors, nav, figures, tables, depth, play_orders')
+
+
+class _ArticleMap(object):
+    """
+    The state of the mapping of one article, while its nav_record is made.
+    """
+    def __init__(self, article_doi):
+        self.article_doi = article_doi
+        self.depth = 0
+        self.figures = []
+        self.tables = []
+        self.play_orders = 0
+
+    @property
+    def play_order(self):
+        self.play_orders += 1
+        return self.play_orders
+
 
 class Navigation(object):
+    """
+    The Navigation class
+
+    Each processed article is reduced to a compact nav_record of its navpoints
+    and the little metadata the navigation documents use, so that no article
+    is kept once it has been processed. A collection of any size may thus be
+    processed article by article, its navigation documents being rendered from
+    the records in a final pass.
+    """
 
     def __init__(self, collection=False, title=''):
         self.collection = collection
@@ -41,8 +69,6 @@ class Navigation(object):
         self.figures_list = []
         self.tables_list = []
 
-        self.article = None
-        self.article_doi = None
         self.all_dois = []  # Used to create UID
 
         #These are the limited forms of metadata that might make it in to the
@@ -58,75 +84,111 @@ class Navigation(object):
         self.nav_depth = 0
 
         self._play_order = 0
-        self._auto_id = 0
 
     def process(self, article):
         """
         Ingests an Article to create navigation structures and parse global
         metadata.
         """
-        if self.article is not None and not self.collection:
-            log.warning('Could not process additional article. Navigation only \
-handles one article unless collection mode is set.')
-            return False
-
         if article.publisher is None:
             log.error('''Navigation cannot be generated for an Article \
 without a publisher!''')
             return
-        self.article = article
-        self.article_doi = self.article.doi.split('/')[1]
-        self.all_dois.append(self.article.doi)
-        if self.collection:
-            pass
-        else:
-            self.title = self.article.publisher.nav_title()
-        for author in self.article.publisher.nav_contributors():
-            self.contributors.add(author)
+        return self.add_record(self.record(article))
+
+    def record(self, article):
+        """
+        Returns the nav_record for an article. This neither uses nor changes
+        the state of the Navigation, other than whether it is in collection
+        mode, so records may be made in any order, or elsewhere, and added in
+        order with add_record.
+
+        The play order of the navpoints in a record counts from 1 within the
+        article.
+        """
+        article_map = _ArticleMap(article.doi.split('/')[1])
+        nav = self.map_navigation(article, article_map)
+        return nav_record(article.doi,
+                          article.publisher.nav_title(),
+                          tuple(article.publisher.nav_contributors()),
+                          nav,
+                          article_map.figures,
+                          article_map.tables,
+                          article_map.depth,
+                          article_map.play_orders)
+
+    def add_record(self, record):
+        """
+        Adds the navigation of an article, from its nav_record, after that of
+        the articles already added.
+        """
+        if self.all_dois and not self.collection:
+            log.warning('Could not process additional article. Navigation only \
+handles one article unless collection mode is set.')
+            return False
 
-        #Analyze the structure of the article to create internal mapping
-        self.map_navigation()
+        offset = self._play_order
 
-    def map_navigation(self):
+        def place(nav_pt):
+            return nav_pt._replace(playOrder=str(nav_pt.playOrder + offset),
+                                   children=[place(child) for child in nav_pt.children])
+
+        self.all_dois.append(record.doi)
+        if not self.collection:
+            self.title = record.title
+        for author in record.contributors:
+            self.contributors.add(author)
+        self.nav += [place(nav_pt) for nav_pt in record.nav]
+        self.figures_list += record.figures
+        self.tables_list += record.tables
+        if record.depth > self.nav_depth:
+            self.nav_depth = record.depth
+        self._play_order += record.play_orders
+
+    def map_navigation(self, article, article_map):
         """
-        This is a wrapper for depth-first recursive analysis of the article
+        This is a wrapper for depth-first recursive analysis of the article,
+        returning its list of navpoint trees
         """
+        article_doi = article_map.article_doi
+        nav = []
         #All articles should have titles
-        title_id = 'titlepage-{0}'.format(self.article_doi)
-        title_label = self.article.publisher.nav_title()
-        title_source = 'main.{0}.xhtml#title'.format(self.article_doi)
-        title_navpoint = navpoint(title_id, title_label, self.play_order,
+        title_id = 'titlepage-{0}'.format(article_doi)
+        title_label = article.publisher.nav_title()
+        title_source = 'main.{0}.xhtml#title'.format(article_doi)
+        title_navpoint = navpoint(title_id, title_label, article_map.play_order,
                                   title_source, [])
-        self.nav.append(title_navpoint)
+        nav.append(title_navpoint)
         #When processing a collection of articles, we will want all subsequent
         #navpoints for this article to be located under the title
         if self.collection:
             nav_insertion = title_navpoint.children
         else:
-            nav_insertion = self.nav
+            nav_insertion = nav
 
         #If the article has a body, we'll need to parse it for navigation
-        if self.article.body is not None:
+        if article.body is not None:
             #Here is where we invoke the recursive parsing!
-            for nav_pt in self.recursive_article_navmap(self.article.body):
+            for nav_pt in self.recursive_article_navmap(article.body, article_map):
                 nav_insertion.append(nav_pt)
 
         #Add a navpoint to the references if appropriate
-        if self.article.root.xpath('./back/ref'):
-            ref_id = 'references-{0}'.format(self.article_doi)
+        if article.root.xpath('./back/ref'):
+            ref_id = 'references-{0}'.format(article_doi)
             ref_label = 'References'
-            ref_source = 'biblio.{0}.xhtml#references'.format(self.article_doi)
-            ref_navpoint = navpoint(ref_id, ref_label, self.play_order,
+            ref_source = 'biblio.{0}.xhtml#references'.format(article_doi)
+            ref_navpoint = navpoint(ref_id, ref_label, article_map.play_order,
                                     ref_source, [])
             nav_insertion.append(ref_navpoint)
+        return nav
 
-    def recursive_article_navmap(self, src_element, depth=0, first=True):
+    def recursive_article_navmap(self, src_element, article_map, depth=0):
         """
         This function recursively traverses the content of an input article to
         add the correct elements to the NCX file's navMap and Lists.
         """
-        if depth > self.nav_depth:
-            self.nav_depth = depth
+        if depth > article_map.depth:
+            article_map.depth = depth
         navpoints = []
         tagnames = ['sec', 'fig', 'table-wrap']
         for child in src_element:
@@ -140,12 +202,12 @@ without a publisher!''')
 
             #Safely handle missing id attributes
             if 'id' not in child.attrib:
-                child.attrib['id'] = self.auto_id
+                child.attrib['id'] = self.auto_id(child)
 
             #If in collection mode, we'll prepend the article DOI to avoid
             #collisions
             if self.collection:
-                child_id = '-'.join([self.article_doi,
+                child_id = '-'.join([article_map.article_doi,
                                      child.attrib['id']])
             else:
                 child_id = child.attrib['id']
@@ -158,31 +220,33 @@ without a publisher!''')
             label = element_methods.all_text(child_title)
             if not label:
                 continue  # If no text in the title, skip this element
-            source = 'main.{0}.xhtml#{1}'.format(self.article_doi,
+            source = 'main.{0}.xhtml#{1}'.format(article_map.article_doi,
                                                child.attrib['id'])
             if tagname == 'sec':
-                children = self.recursive_article_navmap(child, depth=depth + 1)
+                children = self.recursive_article_navmap(child,
+                                                         article_map,
+                                                         depth=depth + 1)
                 navpoints.append(navpoint(child_id,
                                           label,
-                                          self.play_order,
+                                          article_map.play_order,
                                           source,
                                           children))
             #figs and table-wraps do not have children
             elif tagname == 'fig':  # Add navpoints to list_of_figures
-                self.figures_list.append(navpoint(child.attrib['id'],
-                                                  label,
-                                                  None,
-                                                  source,
-                                                  []))
+                article_map.figures.append(navpoint(child.attrib['id'],
+                                                    label,
+                                                    None,
+                                                    source,
+                                                    []))
             elif tagname == 'table-wrap':  # Add navpoints to list_of_tables
-                self.tables_list.append(navpoint(child.attrib['id'],
-                                                 label,
-                                                 None,
-                                                 source,
-                                                 []))
+                article_map.tables.append(navpoint(child.attrib['id'],
+                                                   label,
+                                                   None,
+                                                   source,
+                                                   []))
         return navpoints
 
-    def render_EPUB2(self, location):
+    def render_EPUB2(self, writer):
         """
         Creates the NCX specified file for EPUB2
         """
@@ -262,10 +326,10 @@ without a publisher!''')
                 content = etree.SubElement(navtarget, 'content')
                 content.attrib['src'] = nav_pt.source
 
-        with open(os.path.join(location, 'EPUB', 'toc.ncx'), 'wb') as output:
-            output.write(etree.tostring(document, encoding='utf-8', pretty_print=True))
+        writer.write('EPUB/toc.ncx',
+                     etree.tostring(document, encoding='utf-8', pretty_print=True))
 
-    def render_EPUB3(self, location):
+    def render_EPUB3(self, writer):
         def make_nav(nav=None):
             if nav is None:
                 nav_element = etree.Element('ol')
@@ -333,17 +397,24 @@ without a publisher!''')
                 a.attrib['href'] = nav_pt.source
                 a.text = nav_pt.label
 
-        with open(os.path.join(location, 'EPUB', 'nav.xhtml'), 'wb') as output:
-            output.write(etree.tostring(document, encoding='utf-8', pretty_print=True))
+        writer.write('EPUB/nav.xhtml',
+                     etree.tostring(document, encoding='utf-8', pretty_print=True))
 
-    @property
-    def play_order(self):
-        self._play_order += 1
-        return str(self._play_order)
+    def auto_id(self, element):
+        """
+        Generates an id for an element that is missing one.
 
-    @property
-    def auto_id(self):
-        self._auto_id += 1
-        id_gen = 'OAE-{0}'.format(self._auto_id)
+        The id is derived from the position of the element in its article, such
+        as 'OAE-body-sec2-fig1', so that it does not depend on the order in
+        which elements or articles are processed.
+        """
+        steps = []
+        while element.getparent() is not None:
+            position = 1
+            for sibling in element.itersiblings(element.tag, preceding=True):
+                position += 1
+            steps.append('{0}{1}'.format(element.tag, position))
+            element = element.getparent()
+        id_gen = 'OAE-' + '-'.join(reversed(steps))
         log.debug('Navigation element missing ID: assigned {0}'.format(id_gen))
         return id_gen
@@ -29,23 +29,46 @@ from openaccess_epub.utils import OrderedSet
 
 log = logging.getLogger('openaccess_epub.package')
 
-spine_item = namedtuple('Spine_Item', 'idref, linear')
+spine_item = namedtuple('spine_item', 'idref, linear')
+
+#How an image is described in the manifest, from the image index
+manifest_item = namedtuple('manifest_item', 'media_type, manifest_id')
+
+#Everything the Package needs from an article, see Package.record
+package_record = namedtuple('package_record', 'doi, spine, images, pub_id, title, dates, languages, contributors, publisher, description, subjects, rights')
+
+
+def build_datetime():
+    """
+    Returns the UTC datetime recorded as the date of EPUB creation.
+
+    If the SOURCE_DATE_EPOCH environment variable is set, its value (seconds
+    since the epoch) is used instead of the current time, so that building the
+    same content twice produces identical Package Documents.
+    """
+    source_date_epoch = os.environ.get('SOURCE_DATE_EPOCH')
+    if source_date_epoch is not None:
+        return datetime.datetime.fromtimestamp(int(source_date_epoch),
+                                               datetime.timezone.utc)
+    return datetime.datetime.now(datetime.timezone.utc)
 
 
 class Package(object):
     """
     The Package class
+
+    Each processed article is reduced to a compact package_record, so that no
+    article is kept once it has been processed. A collection of any size may
+    thus be processed article by article, its Package Document being rendered
+    from the records in a final pass.
     """
 
     def __init__(self, collection=False, title=''):
         self.collection = collection
         self.spine_list = []
 
-        self.article = None
-        self.article_doi = None
-
         self.all_dois = []  # Used to create unique id and rights in collections
-        #self.all_articles = []
+        self.images = {}  # Image manifest_items by name, from processed articles
 
         #Metadata elements
         self.pub_id = None
@@ -81,84 +104,131 @@ class Package(object):
         using the article's publisher attribute (an instance of a Publisher
         class).
 
+        Only a compact package_record of the article is kept, see record.
+
         Parameters
         ----------
         article : openaccess_epub.article.Article instance
             An article to be included in the EPUB, to be processed for metadata
             and appropriate content document references.
         """
-        if self.article is not None and not self.collection:
-            log.warning('Could not process additional article. Package only \
-handles one article unless collection mode is set.')
-            return False
-
         if article.publisher is None:
             log.error('''Package cannot be generated for an Article \
 without a publisher!''')
             return
-        self.article = article
-        self.article_doi = self.article.doi.split('/')[1]
-        self.all_dois.append(self.article.doi)
+        return self.add_record(self.record(article))
+
+    def record(self, article):
+        """
+        Returns the package_record for an article, holding its spine entries,
+        the manifest details of its images and its metadata. This does not use
+        or change the state of the Package, other than whether it is in
+        collection mode, so records may be made in any order, or elsewhere, and
+        added in order with add_record.
+        """
+        article_doi = article.doi.split('/')[1]
+
+        #The image index describes the article's images for the manifest
+        images = []
+        if article.image_index is not None:
+            for entry in article.image_index:
+                images.append(('EPUB/' + entry.src,
+                               manifest_item(entry.media_type, entry.manifest_id)))
 
         #Analyze the article to add entries to the spine
-        dash_doi = self.article_doi.replace('.', '-')
+        dash_doi = article_doi.replace('.', '-')
+        spine = []
 
         #Entry for the main content document
         main_idref = 'main-{0}-xhtml'.format(dash_doi)
-        self.spine_list.append(spine_item(main_idref, True))
+        spine.append(spine_item(main_idref, True))
 
         #Entry for the biblio content document
         biblio_idref = 'biblio-{0}-xhtml'.format(dash_doi)
-        if self.article.root.xpath('./back/ref-list/ref'):
-                self.spine_list.append(spine_item(biblio_idref, True))
+        if article.root.xpath('./back/ref-list/ref'):
+                spine.append(spine_item(biblio_idref, True))
 
         #Entry for the tables content document
         tables_idref = 'tables-{0}-xhtml'.format(dash_doi)
-        if self.article.publisher.has_out_of_flow_tables():
-            self.spine_list.append(spine_item(tables_idref, False))
+        if article.publisher.has_out_of_flow_tables():
+            spine.append(spine_item(tables_idref, False))
 
-        self.acquire_metadata()
+        return self.acquire_metadata(article, spine, images)
 
-    def acquire_metadata(self):
+    def acquire_metadata(self, article, spine, images):
         """
         Handles the acquisition of metadata for both collection mode and single
         mode, uses the metadata methods belonging to the article's publisher
-        attribute.
+        attribute. Returns the package_record of the article.
         """
         #For space economy
-        publisher = self.article.publisher
+        publisher = article.publisher
 
         if self.collection:  # collection mode metadata gathering
-            pass
+            pub_id, title, dates = None, None, ()
         else:  # single mode metadata gathering
-            self.pub_id = publisher.package_identifier()
-            self.title = publisher.package_title()
-            for date in publisher.package_date():
-                self.dates.add(date)
+            pub_id = publisher.package_identifier()
+            title = publisher.package_title()
+            dates = tuple(publisher.package_date())
 
         #Common metadata gathering
-        for lang in publisher.package_language():
+        return package_record(article.doi,
+                              tuple(spine),
+                              tuple(images),
+                              pub_id,
+                              title,
+                              dates,
+                              tuple(publisher.package_language()),
+                              tuple(publisher.package_contributors()),
+                              publisher.package_publisher(),
+                              publisher.package_description(),
+                              tuple(publisher.package_subject()),
+                              publisher.package_rights())
+
+    def add_record(self, record):
+        """
+        Adds an article, from its package_record, after the articles already
+        added.
+        """
+        if self.all_dois and not self.collection:
+            log.warning('Could not process additional article. Package only \
+handles one article unless collection mode is set.')
+            return False
+
+        self.all_dois.append(record.doi)
+        self.spine_list += record.spine
+        self.images.update(record.images)
+
+        if not self.collection:
+            self.pub_id = record.pub_id
+            self.title = record.title
+            for date in record.dates:
+                self.dates.add(date)
+
+        for lang in record.languages:
             self.languages.add(lang)  # languages
-        for contributor in publisher.package_contributors():  # contributors
+        for contributor in record.contributors:  # contributors
             self.contributors.add(contributor)
-        self.publishers.add(publisher.package_publisher())  # publisher names
-        desc = publisher.package_description()
-        if desc is not None:
-            self.descriptions.add(desc)
-        for subj in publisher.package_subject():
+        self.publishers.add(record.publisher)  # publisher names
+        if record.description is not None:
+            self.descriptions.add(record.description)
+        for subj in record.subjects:
             self.subjects.add(subj)  # subjects
         #Rights
-        art_rights = publisher.package_rights()
-        self.rights.add(art_rights)
-        if art_rights not in self.rights_associations:
-            self.rights_associations[art_rights] = [self.article.doi]
+        self.rights.add(record.rights)
+        if record.rights not in self.rights_associations:
+            self.rights_associations[record.rights] = [record.doi]
         else:
-            self.rights_associations[art_rights].append(self.article.doi)
+            self.rights_associations[record.rights].append(record.doi)
 
-    def file_manifest(self, location):
+    def file_manifest(self, names):
         """
-        An iterator through the files in a location which yields item elements
-        suitable for insertion into the package manifest.
+        An iterator through the files written to the EPUB directory, given as
+        '/'-separated names relative to the root of the EPUB, which yields item
+        elements suitable for insertion into the package manifest.
+
+        Images described by the image index of a processed article take their
+        media type and id from it, other files are described by extension.
         """
         #Maps file extensions to mimetypes
         mimetypes = {'.jpg': 'image/jpeg',
@@ -174,29 +244,30 @@ without a publisher!''')
                      '.ttf': 'application/vnd.ms-opentype',
                      '.otf': 'application/vnd.ms-opentype'}
 
-        current_dir = os.getcwd()
-        os.chdir(location)
-        for dirpath, _dirnames, filenames in os.walk('.'):
-            dirpath = dirpath[2:]  # A means to avoid dirpath prefix of './'
-            for fn in filenames:
-                fn_ext = os.path.splitext(fn)[-1]
-                item = etree.Element('item')
-                #Here we set three attributes: href, media-type, and id
-                if not dirpath:
-                    item.attrib['href'] = fn
-                else:
-                    item.attrib['href'] = '/'.join([dirpath, fn])
-                item.attrib['media-type'] = mimetypes[fn_ext]
-                #Special handling for common image types
-                if fn_ext in ['.jpg', '.png', '.tif', '.jpeg']:
-                    #the following lines assume we are using the convention
-                    #where the article doi is prefixed by 'images-'
-                    item.attrib['id'] = '-'.join([dirpath[7:],
-                                                  fn.replace('.', '-')])
-                else:
-                    item.attrib['id'] = fn.replace('.', '-')
+        for name in sorted(names):
+            if not name.startswith('EPUB/'):
+                continue
+            href = name[5:]
+            dirpath, fn = href.rpartition('/')[::2]
+            fn_ext = os.path.splitext(fn)[-1]
+            item = etree.Element('item')
+            #Here we set three attributes: href, media-type, and id
+            item.attrib['href'] = href
+            if name in self.images:
+                item.attrib['media-type'] = self.images[name].media_type
+                item.attrib['id'] = self.images[name].manifest_id
                 yield item
-        os.chdir(current_dir)
+                continue
+            item.attrib['media-type'] = mimetypes[fn_ext]
+            #Special handling for common image types
+            if fn_ext in ['.jpg', '.png', '.tif', '.jpeg']:
+                #the following lines assume we are using the convention
+                #where the article doi is prefixed by 'images-'
+                item.attrib['id'] = '-'.join([dirpath[7:],
+                                              fn.replace('.', '-')])
+            else:
+                item.attrib['id'] = fn.replace('.', '-')
+            yield item
 
     def make_element(self, tagname, doc, attrs={}, text=''):
         new_element = etree.Element(self.ns_rectify(tagname, doc))
@@ -228,7 +299,7 @@ without a publisher!''')
         document = etree.ElementTree(root)
         return document
 
-    def render_EPUB2(self, location):
+    def render_EPUB2(self, writer):
         log.info('Rendering Package Document for EPUB2')
         document = self._init_package_doc(version='2.0')
         package = document.getroot()
@@ -342,7 +413,7 @@ applies.'''
 
         #Make the Manifest
         manifest = etree.SubElement(package, 'manifest')
-        for item in self.file_manifest(os.path.join(location, 'EPUB')):
+        for item in self.file_manifest(writer.namelist()):
             if item.attrib['id'] == 'toc-ncx':
                 item.attrib['id'] = 'ncx'  # Special id for toc.ncx
             manifest.append(item)
@@ -355,10 +426,10 @@ applies.'''
             itemref.attrib['idref'] = item.idref
             itemref.attrib['linear'] = 'yes' if item.linear else 'no'
 
-        with open(os.path.join(location, 'EPUB', 'package.opf'), 'wb') as output:
-            output.write(etree.tostring(document, encoding='utf-8', pretty_print=True))
+        writer.write('EPUB/package.opf',
+                     etree.tostring(document, encoding='utf-8', pretty_print=True))
 
-    def render_EPUB3(self, location):
+    def render_EPUB3(self, writer):
         log.info('Rendering Package Document for EPUB3')
         document = self._init_package_doc(version='3.0')
         package = document.getroot()
@@ -367,18 +438,19 @@ applies.'''
         metadata = etree.SubElement(package, 'metadata')
 
         #Metadata: Identifier
-        today = datetime.date.today().strftime('%Y.%m.%d')
+        #The identifier depends only on the content, the date of creation is
+        #recorded separately by dc:date and dcterms:modified
         if not self.collection:  # Identifier for single article
             ident = self.make_element('dc:identifier',
                                       document,
                                       {'id': 'pub-identifier'},
-                                      '.'.join([self.pub_id.value, today]))
+                                      self.pub_id.value)
             metadata.append(ident)
         else:  # Identifier for collection
             ident = self.make_element('dc:identifier',
                                       document,
                                       {'id': 'pub-identifier'},
-                                      ','.join(self.all_dois) + '.' + today)
+                                      ','.join(self.all_dois))
             metadata.append(ident)
         #Metadata: Identifier Refinement
         meta = self.make_element('meta',
@@ -486,13 +558,14 @@ applies.'''
         #EPUB3 differs significantly from EPUB2, only one dc:date is allowed
         #and it must be the date of EPUB publication
         #Must also be of proper format: http://www.w3.org/TR/NOTE-datetime
-        simple_date = datetime.date.today().strftime('%Y-%m-%d')
+        build_date = build_datetime()
+        simple_date = build_date.strftime('%Y-%m-%d')
         metadata.append(self.make_element('dc:date',
                                           document,
                                           {'id': 'pub-date'},
                                           simple_date))
         #Must have meta with dcterms:modified
-        now = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        now = build_date.strftime('%Y-%m-%dT%H:%M:%SZ')
         metadata.append(self.make_element('meta',
                                           document,
                                           {'property': 'dcterms:modified'},
@@ -559,7 +632,7 @@ applies.'''
 
         #Make the Manifest
         manifest = etree.SubElement(package, 'manifest')
-        for item in self.file_manifest(os.path.join(location, 'EPUB')):
+        for item in self.file_manifest(writer.namelist()):
             if item.attrib['id'] == 'nav-xhtml':
                 item.attrib['id'] = 'htmltoc'  # Special id for nav.xhtml
                 item.attrib['properties'] = 'nav'
@@ -574,5 +647,5 @@ applies.'''
             itemref.attrib['idref'] = item.idref
             itemref.attrib['linear'] = 'yes' if item.linear else 'no'
 
-        with open(os.path.join(location, 'EPUB', 'package.opf'), 'wb') as output:
-            output.write(etree.tostring(document, encoding='utf-8', pretty_print=True))
+        writer.write('EPUB/package.opf',
+                     etree.tostring(document, encoding='utf-8', pretty_print=True))
@@ -12,10 +12,9 @@ from copy import copy, deepcopy
 from importlib import import_module
 import logging
 import sys
-try:
-    from importlib.abc import SourceLoader
-except ImportError:  # Compatibility for Python 3.0 and 3.1
-    from importlib.abc import PyLoader as SourceLoader
+import threading
+from importlib.abc import SourceLoader
+from importlib.util import spec_from_file_location
 import weakref
 
 #Non-Standard Library modules
@@ -30,37 +29,83 @@ __all__ = ['contributor_tuple', 'date_tuple', 'identifier_tuple',
 
 log = logging.getLogger('openaccess_epub.publisher')
 
-contributor_tuple = namedtuple('Contributor', 'name, role, file_as')
-date_tuple = namedtuple('Date', 'year, month, day, season, event')
-identifier_tuple = namedtuple('Identifier', 'value, scheme')
+contributor_tuple = namedtuple('contributor_tuple', 'name, role, file_as')
+date_tuple = namedtuple('date_tuple', 'year, month, day, season, event')
+identifier_tuple = namedtuple('identifier_tuple', 'value, scheme')
 
 
 ### Section Start - Dynamic Extension with publisher_plugins folder ############
 ################################################################################
 #The code in this section is devoting to creating easy publisher-wise extension
-#for rapid testing and development without modifying installed source
-plugin_dir = publisher_plugin_location()
-doi_map_file = os.path.join(plugin_dir, 'doi_map')
+#for rapid testing and development without modifying installed source. Nothing
+#is done until a publisher module is first imported by import_by_doi, so that
+#importing this module touches neither the cache nor the import system
 
-doi_map = {'10.1371': 'plos',
-           '10.3389': 'frontiers'}
+#The publisher modules included with OpenAccess_EPUB, by DOI prefix
+DEFAULT_DOI_MAP = {'10.1371': 'plos',
+                   '10.3389': 'frontiers'}
 
-#By inserting at the beginning, the plugin directory will override the source
-#modules if they exist
-__path__.insert(0, publisher_plugin_location())
+_plugins = {}
+_plugins_lock = threading.Lock()
 
-if not os.path.isfile(doi_map_file):
-    os.makedirs(os.path.dirname(doi_map_file))
-    with open(doi_map_file, 'a'):
-        os.utime(doi_map_file, None)
 
-with open(doi_map_file, 'r') as mapping:
-    for line in mapping:
-        key, val = line.split(':')
-        doi_map[key.strip()] = val.strip()
+def read_doi_map(doi_map_file):
+    """
+    Returns the DEFAULT_DOI_MAP updated with the lines of a doi_map file, each
+    of the form "<publisher-doi>: <short-publisher-name>". A missing file
+    leaves the default mapping as it is.
+    """
+    doi_map = dict(DEFAULT_DOI_MAP)
+    try:
+        with open(doi_map_file, 'r') as mapping:
+            for line in mapping:
+                if not line.strip():
+                    continue
+                key, val = line.split(':')
+                doi_map[key.strip()] = val.strip()
+    except IOError:
+        log.debug('No doi_map file at {0}'.format(doi_map_file))
+    return doi_map
+
+
+def enable_plugins():
+    """
+    Puts the publisher_plugins directory, if there is one, ahead of the
+    installed publisher modules and returns the DOI map, reading the doi_map
+    file in it. This is done once per process, on the first call.
+    """
+    with _plugins_lock:
+        if 'doi_map' not in _plugins:
+            plugin_dir = publisher_plugin_location()
+            if os.path.isdir(plugin_dir):
+                #By inserting at the beginning, the plugin directory will
+                #override the source modules if they exist
+                __path__.insert(0, plugin_dir)
+            #The publisher modules are found by PublisherFinder ahead of the
+            #default finder, which would otherwise claim the directories
+            sys.path_hooks.insert(0, PublisherFinder)
+            for path_entry in __path__:
+                sys.path_importer_cache.pop(path_entry, None)
+            _plugins['doi_map'] = read_doi_map(os.path.join(plugin_dir, 'doi_map'))
+        return _plugins['doi_map']
+
+
+def get_doi_map():
+    """
+    Returns the mapping of publisher DOI prefixes to the names of their
+    publisher modules, including those of the publisher plugins.
+    """
+    return enable_plugins()
 
 
 class PublisherFinder(object):
+    """
+    Finds the publisher modules in one entry of the __path__ of this package,
+    such as the publisher_plugins directory, for the import system.
+
+    The file found for each module name is remembered, so each entry is only
+    searched once for a name until importlib.invalidate_caches is called.
+    """
     prefix = 'openaccess_epub.publisher'
 
     def __init__(self, path_entry):
@@ -68,42 +113,87 @@ class PublisherFinder(object):
             raise ImportError
         else:
             self.path_entry = path_entry
+            self._resolved = {}
             return None
 
-    def find_module(self, fullname, path=None):
-        path = path or self.path_entry
+    def find_filename(self, fullname):
+        """
+        Returns the path of the source file for a module in this entry, or None
+        if there is none.
+        """
         name = fullname.split('.')[-1]
-        for fname in [os.path.join(i, name + '.py') for i in __path__]:
-            if os.path.isfile(fname):
-                return PublisherLoader(path)
-        return None
+        try:
+            return self._resolved[name]
+        except KeyError:
+            fname = os.path.join(self.path_entry, name + '.py')
+            if not os.path.isfile(fname):
+                fname = None
+            self._resolved[name] = fname
+            return fname
+
+    def find_spec(self, fullname, target=None):
+        if not fullname.startswith(self.prefix + '.'):
+            return None
+        fname = self.find_filename(fullname)
+        if fname is None:
+            return None
+        return spec_from_file_location(fullname,
+                                       fname,
+                                       loader=PublisherLoader(fullname, fname))
+
+    def invalidate_caches(self):
+        self._resolved.clear()
 
 
 class PublisherLoader(SourceLoader):
+    """
+    Loads a publisher module from its source file, keeping its compiled
+    bytecode in the __pycache__ directory beside it as the import system does
+    for any other module. The bytecode is used for as long as the modification
+    time and size of the source match those recorded in it.
+    """
 
-    def __init__(self, path_entry):
-        self.path_entry = path_entry
+    def __init__(self, fullname, path):
+        self.fullname = fullname
+        self.path = path
         return None
 
-    #This is poorly documented, the argument to get_data is implicitly supplied
-    #by a call to get_filename
-    def get_data(self, filepath):
-        with open(filepath, 'r') as source:
-            return bytes(source.read(), 'utf-8')
-
-    def get_filename(self, path):
-        name = path.split('.')[-1]
-        for fname in [os.path.join(i, name + '.py') for i in __path__]:
-            if os.path.isfile(fname):
-                return fname
-        return None
+    def get_filename(self, fullname):
+        return self.path
 
-sys.path_hooks.append(PublisherFinder)
+    def get_data(self, filepath):
+        with open(filepath, 'rb') as data:
+            return data.read()
+
+    def path_stats(self, path):
+        stat = os.stat(path)
+        return {'mtime': stat.st_mtime, 'size': stat.st_size}
+
+    def set_data(self, path, data):
+        """
+        Writes bytecode for a module to `path`, under a temporary name which is
+        then renamed into place, so that another process never reads it half
+        written. Failure to write, as for a read-only installation, only means
+        the source is compiled again next time.
+        """
+        directory = os.path.dirname(path)
+        temp_path = '{0}.{1}'.format(path, os.getpid())
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(temp_path, 'wb') as bytecode:
+                bytecode.write(data)
+            os.replace(temp_path, path)
+        except OSError as err:
+            log.debug('Unable to write bytecode to {0}: {1}'.format(path, err))
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
 
 
 def import_by_doi(doi):
     try:
-        mod_name = doi_map[doi]
+        mod_name = get_doi_map()[doi]
     except KeyError:  # Informative recasting of KeyError to ImportError
         raise ImportError('DOI publisher prefix "{0}" not mapped to module name'.format(doi))
     module = import_module('.'.join([__name__, mod_name]))
@@ -122,7 +212,85 @@ def func_registrar():
     return register
 
 
-class Publisher(object):
+#The phases of the transform engine, see Publisher.transform
+TRANSFORM_PHASES = ('convert', 'post')
+
+element_handler = namedtuple('element_handler', 'tag, phase, func')
+
+
+def element_registrar():
+    handler_list = []
+
+    def register(tag, phase='convert'):
+        if phase not in TRANSFORM_PHASES:
+            raise ValueError('phase should be one of {0}'.format(TRANSFORM_PHASES))
+
+        def decorator(func):
+            handler_list.append(element_handler(tag, phase, func))
+            return func
+        return decorator
+    register.all = handler_list
+    return register
+
+
+class PublisherMeta(type):
+    """
+    Builds the dispatch tables of a Publisher class when the class is created.
+
+    The post-processing methods, named 'process_<tag>_tag', are collected into
+    `process_tag_methods`, a dictionary mapping tags to functions, so that the
+    traversal of a document needs a single dictionary lookup per element rather
+    than formatting a method name and attempting an attribute lookup. The tag is
+    derived from the method name by replacing underscores with hyphens, and
+    the underscored form is included as well.
+
+    The element methods registered with element2/element3 are likewise
+    collected into `element_methods`, mapping 2 and 3 to {phase: {tag:
+    [function, ...]}}. Only functions defined in the class or its bases are
+    included, so a method registered by another publisher module is ignored.
+    Methods are looked up by name, so an override in a subclass is used in place
+    of the registered method. Methods for the same tag keep their order of
+    registration.
+    """
+    def __init__(cls, name, bases, namespace):
+        super(PublisherMeta, cls).__init__(name, bases, namespace)
+        process_tag_methods = {}
+        for attr in dir(cls):
+            if not (attr.startswith('process_') and attr.endswith('_tag')):
+                continue
+            func = getattr(cls, attr)
+            if not callable(func):
+                continue
+            tag = attr[len('process_'):-len('_tag')]
+            process_tag_methods[tag] = func
+            process_tag_methods[tag.replace('_', '-')] = func
+        cls.process_tag_methods = process_tag_methods
+
+        cls.element_methods = {}
+        for version in (2, 3):
+            registrar = getattr(cls, 'element{0}'.format(version), None)
+            handlers = registrar.all if registrar is not None else []
+            cls.element_methods[version] = cls.element_dispatch(handlers)
+
+    def element_dispatch(cls, handlers):
+        """
+        Builds the dispatch table for the transform engine from a list of
+        registered element_handlers, as {phase: {tag: [function, ...]}}.
+        """
+        dispatch = dict((phase, {}) for phase in TRANSFORM_PHASES)
+        mro = cls.__mro__
+        for handler in handlers:
+            name = handler.func.__name__
+            if not any(vars(base).get(name) is handler.func for base in mro):
+                continue  # Registered by another publisher
+            tag_methods = dispatch[handler.phase].setdefault(handler.tag, [])
+            func = getattr(cls, name)
+            if func not in tag_methods:
+                tag_methods.append(func)
+        return dispatch
+
+
+class Publisher(object, metaclass=PublisherMeta):
     """
     Meta class for publishers, sub-class per publisher to add support
     """
@@ -136,6 +304,11 @@ class Publisher(object):
     special2 = func_registrar()  # EPUB2 methods
     special3 = func_registrar()  # EPUB3 methods
 
+    #Element methods convert single elements, they are registered by tag and
+    #phase and dispatched during one traversal of the document per phase
+    element2 = element_registrar()  # EPUB2 methods
+    element3 = element_registrar()  # EPUB3 methods
+
     def __init__(self, article):
         """
         The initialization of the Publisher class.
@@ -155,6 +328,8 @@ class Publisher(object):
         self.epub3_maker_methods = self.maker3.all
         self.epub2_special_methods = self.special2.all
         self.epub3_special_methods = self.special3.all
+        self.epub2_element_methods = self.element_methods[2]
+        self.epub3_element_methods = self.element_methods[3]
 
     @property
     def article(self):
@@ -170,28 +345,136 @@ class Publisher(object):
     def doi_suffix(self):
         return self.article.doi.split('/', 1)[1]
 
-    def post_process(self, document, epub_version):
-        def recursive_traverse(element):
+    def image_src(self, xlink_href):
+        """
+        Returns the location of the image file for an xlink:href, relative to
+        the content documents, as recorded in the image index of the article.
 
-            try:
-                tag_method = getattr(self,
-                                     'process_{0}_tag'.format(element.tag.replace('-', '_')),
-                                     None)
-            except AttributeError:
-                if element is None:
-                    return
-                if isinstance(element, etree._Comment):
-                    log.warning('''Comment encountered during recursive \
-post-processing, removing it''')
-                    remove(element)
-                    return
-            if tag_method is not None and callable(tag_method):
-                tag_method(element, epub_version)
-            for subel in element:
-                recursive_traverse(subel)
+        Without an image index, such as when the content is rendered without
+        locating the images, the PLoS naming convention is assumed: the last
+        part of the xlink:href with a '.png' extension.
+        """
+        index = self.article.image_index
+        if index is not None and xlink_href in index:
+            return index[xlink_href].src
+        file_name = xlink_href.split('.')[-1] + '.png'
+        return '/'.join(['images-' + self.doi_suffix(), file_name])
 
+    def image_dimensions(self, xlink_href):
+        """
+        Returns a dict of the width and height attributes for the <img> of an
+        xlink:href, as recorded in the image index of the article. The dict is
+        empty if the dimensions of the image are not known.
+        """
+        index = self.article.image_index
+        if index is None or xlink_href not in index:
+            return {}
+        entry = index[xlink_href]
+        if entry.width is None or entry.height is None:
+            return {}
+        return {'width': str(entry.width), 'height': str(entry.height)}
+
+    def transform(self, document, epub_version, phase, headings=False):
+        """
+        Applies the element methods registered for `phase` to the body of the
+        document in a single traversal.
+
+        The 'convert' phase visits elements in post-order: the descendants of an
+        element are all converted before the element itself, and siblings are
+        visited in document order. The elements are collected before any
+        method is called, so elements created by a method are not visited, and
+        an element removed by a method (for instance by a method converting its
+        parent, or one replacing the element) is skipped. A method should
+        therefore only modify the element it is given, its descendants, or its
+        position in the tree. If a method changes the tag of the element or
+        removes it, later methods for the old tag are not called.
+
+        The 'post' phase visits elements in pre-order, each element before its
+        descendants, and calls the registered methods for the tag followed by
+        the post-processing method `process_<tag>_tag` if one is defined. If
+        `headings` is True, the titles of nested <div> elements are converted
+        to headings according to their depth as well (see depth_headings).
+        """
+        if int(epub_version) == 2:
+            dispatch = self.epub2_element_methods[phase]
+        else:
+            dispatch = self.epub3_element_methods[phase]
         body = document.getroot().find('body')
-        recursive_traverse(body)
+        if body is None:
+            return
+        if phase == 'convert':
+            self._convert_traversal(body, epub_version, dispatch)
+        else:
+            self._post_traversal(body, epub_version, dispatch, headings)
+
+    def _convert_traversal(self, body, epub_version, dispatch):
+        if not dispatch:
+            return
+        #Collect the elements in post-order before modifying anything
+        order = []
+        stack = [(body, False)]
+        while stack:
+            element, expanded = stack.pop()
+            if expanded:
+                order.append(element)
+                continue
+            stack.append((element, True))
+            for child in reversed(element):
+                stack.append((child, False))
+
+        for element in order:
+            tag = element.tag
+            methods = dispatch.get(tag)
+            if methods is None:
+                continue
+            if element is not body and element.getparent() is None:
+                continue  # Removed from the document already
+            for method in methods:
+                method(self, element, epub_version)
+                if element.tag != tag or element.getparent() is None:
+                    break
+
+    def _post_traversal(self, body, epub_version, dispatch, headings):
+        depth_tags = ['h2', 'h3', 'h4', 'h5', 'h6']
+        process_tag_methods = self.process_tag_methods
+        #The depths of the <div> elements receiving headings, body is 0
+        depths = {body: 0}
+        stack = [body]
+        while stack:
+            element = stack.pop()
+            tag = element.tag
+            if tag is etree.Comment:
+                log.warning('''Comment encountered during recursive \
+post-processing, removing it''')
+                remove(element)
+                continue
+            elif not isinstance(tag, str):
+                log.warning('Removing {0} encountered during post-processing'.format(element))
+                remove(element)
+                continue
+            methods = dispatch.get(tag)
+            if methods is not None:
+                for method in methods:
+                    method(self, element, epub_version)
+                    if element.tag != tag or element.getparent() is None:
+                        break
+                #Post-processing follows any change of tag by the methods
+                tag = element.tag
+            tag_method = process_tag_methods.get(tag)
+            if tag_method is not None:
+                tag_method(self, element, epub_version)
+            if headings and element.tag == 'div' and element is not body:
+                parent_depth = depths.get(element.getparent())
+                if parent_depth is not None:
+                    depths[element] = parent_depth + 1
+                    self.heading_for_div(element, parent_depth + 1, depth_tags)
+            stack.extend(reversed(element))
+
+    def post_process(self, document, epub_version):
+        """
+        Post-processes the body of the document, see Publisher.transform.
+        """
+        self.transform(document, epub_version, 'post')
 
     def make_document(self, titlestring):
         """
@@ -223,7 +506,11 @@ post-processing, removing it''')
 
         return document
 
-    def render_content(self, output_directory, epub_version=None):
+    def render_content(self, writer, epub_version=None):
+        """
+        Renders the content documents of the article and writes them to the
+        EPUB with `writer`, an EPUBWriter or DirectoryWriter.
+        """
         if epub_version is None:
             epub_version = self.epub_default
         self.main = self.make_document('main')
@@ -242,6 +529,7 @@ post-processing, removing it''')
             else:
                 for func in self.epub2_maker_methods:
                     self.__getattribute__(func.__name__)()
+                self.transform(self.main, epub_version, 'convert')
                 for func in self.epub2_special_methods:
                     self.__getattribute__(func.__name__)()
         elif int(epub_version) == 3:
@@ -251,6 +539,7 @@ post-processing, removing it''')
             else:
                 for func in self.epub3_maker_methods:
                     self.__getattribute__(func.__name__)()
+                self.transform(self.main, epub_version, 'convert')
                 for func in self.epub3_special_methods:
                     self.__getattribute__(func.__name__)()
         else:
@@ -258,34 +547,32 @@ post-processing, removing it''')
             raise ValueError('epub_version should be 2 or 3')
 
         #Conduct post-processing on all documents and write them
-        self.post_process(self.main, epub_version)
-        self.depth_headings(self.main)
-        self.write_document(self.main_filename(output_directory), self.main)
+        self.transform(self.main, epub_version, 'post', headings=True)
+        self.write_document(writer, self.main_filename(), self.main)
 
-        for fn, doc in [(self.biblio_filename(output_directory), self.biblio),
-                        (self.tables_filename(output_directory), self.tables)]:
+        for fn, doc in [(self.biblio_filename(), self.biblio),
+                        (self.tables_filename(), self.tables)]:
             if len(doc.getroot().find('body')) == 0:
                 continue
             self.post_process(doc, epub_version)
-            self.write_document(fn, doc)
+            self.write_document(writer, fn, doc)
 
-    def main_filename(self, output_directory):
-        return os.path.join(output_directory, 'EPUB', self.main_fragment[:-4])
+    def main_filename(self):
+        return 'EPUB/' + self.main_fragment[:-4]
 
-    def biblio_filename(self, output_directory):
-        return os.path.join(output_directory, 'EPUB', self.biblio_fragment[:-4])
+    def biblio_filename(self):
+        return 'EPUB/' + self.biblio_fragment[:-4]
 
-    def tables_filename(self, output_directory):
-        return os.path.join(output_directory, 'EPUB', self.tables_fragment[:-4])
+    def tables_filename(self):
+        return 'EPUB/' + self.tables_fragment[:-4]
 
-    def write_document(self, name, document):
+    def write_document(self, writer, name, document):
         """
-        This function will write a document to an XML file.
+        This function will write a document to an XML file in the EPUB.
         """
-        with open(name, 'wb') as out:
-            out.write(etree.tostring(document,
-                                     encoding='utf-8',
-                                     pretty_print=True))
+        writer.write(name, etree.tostring(document,
+                                          encoding='utf-8',
+                                          pretty_print=True))
 
     def nav_contributors(self):
         """
@@ -650,39 +937,50 @@ post-processing, removing it''')
         rename_attributes(element, {'sec-type': 'class'})
 
     def depth_headings(self, document):
+        """
+        Converts the titles of nested <div> elements to headings according to
+        their depth. This is done as part of the post-processing of the main
+        document by render_content, it is kept for documents processed apart.
+        """
         depth_tags = ['h2', 'h3', 'h4', 'h5', 'h6']
 
         def recursive_traverse(element, depth=0):
             for div in element.findall('div'):
-                label = div.find('label')
-                title = div.find('title')
-                if label is not None:
-                    #If there is a label, but it is empty
-                    if len(label) == 0 and label.text is None:
-                        remove(label)
-                        label = None
-                if title is not None:
-                    #If there is a title, but it is empty
-                    if len(title) == 0 and title.text is None:
-                        remove(title)
-                        title = None
-                if label is not None:
-                    label.tag = 'b'
-                if title is not None:
-                    if depth < len(depth_tags):
-                        title.tag = depth_tags[depth]
-                    else:
-                        title.tag = 'span'
-                        title.attrib['class'] = 'extendedheader' + str(depth)
-                    if label is not None:
-                        #If the label exists, prepend its text then remove it
-                        title.text = ' '.join([label.text, title.text])
-                        remove(label)
+                self.heading_for_div(div, depth, depth_tags)
                 recursive_traverse(div, depth=depth + 1)
 
         body = document.getroot().find('body')
         recursive_traverse(body, depth=1)
 
+    def heading_for_div(self, div, depth, depth_tags):
+        """
+        Converts the label and title of a <div> to a heading for its depth.
+        """
+        label = div.find('label')
+        title = div.find('title')
+        if label is not None:
+            #If there is a label, but it is empty
+            if len(label) == 0 and label.text is None:
+                remove(label)
+                label = None
+        if title is not None:
+            #If there is a title, but it is empty
+            if len(title) == 0 and title.text is None:
+                remove(title)
+                title = None
+        if label is not None:
+            label.tag = 'b'
+        if title is not None:
+            if depth < len(depth_tags):
+                title.tag = depth_tags[depth]
+            else:
+                title.tag = 'span'
+                title.attrib['class'] = 'extendedheader' + str(depth)
+            if label is not None:
+                #If the label exists, prepend its text then remove it
+                title.text = ' '.join([label.text, title.text])
+                remove(label)
+
     def has_out_of_flow_tables(self):
         """
         Returns True if the article has out-of-flow tables, indicates separate
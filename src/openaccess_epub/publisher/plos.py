@@ -764,92 +764,88 @@ class PLoS(Publisher):
             notes_sec.attrib['class'] = 'back-notes'
             body.append(notes_sec)
 
-    @Publisher.special2
-    @Publisher.special3
-    def convert_disp_formula_elements(self):
+    @Publisher.element2('disp-formula')
+    @Publisher.element3('disp-formula')
+    def convert_disp_formula_element(self, disp, epub_version):
         """
         <disp-formula> elements must be converted to conforming elements
         """
-        for disp in self.main.getroot().findall('.//disp-formula'):
-            #find label element
-            label_el = disp.find('label')
-            graphic_el = disp.find('graphic')
-            if graphic_el is None:  # No graphic, assume math as text instead
-                text_span = etree.Element('span', {'class': 'disp-formula'})
-                if 'id' in disp.attrib:
-                    text_span.attrib['id'] = disp.attrib['id']
-                append_all_below(text_span, disp)
-                #Insert the text span before the disp-formula
-                insert_before(disp, text_span)
-                #If a label exists, modify and insert before text_span
-                if label_el is not None:
-                    label_el.tag = 'b'
-                    insert_before(text_span, label_el)
-                #Remove the disp-formula
-                remove(disp)
-                #Skip the rest, which deals with the graphic element
-                continue
-            #The graphic element is present
-            #Create a file reference for the image
-            xlink_href = ns_format(graphic_el, 'xlink:href')
-            graphic_xlink_href = graphic_el.attrib[xlink_href]
-            file_name = graphic_xlink_href.split('.')[-1] + '.png'
-            img_dir = 'images-' + self.doi_suffix()
-            img_path = '/'.join([img_dir, file_name])
-
-            #Create the img element
-            img_element = etree.Element('img', {'alt': 'A Display Formula',
-                                                'class': 'disp-formula',
-                                                'src': img_path})
-            #Transfer the id attribute
+        #find label element
+        label_el = disp.find('label')
+        graphic_el = disp.find('graphic')
+        if graphic_el is None:  # No graphic, assume math as text instead
+            text_span = etree.Element('span', {'class': 'disp-formula'})
             if 'id' in disp.attrib:
-                img_element.attrib['id'] = disp.attrib['id']
-            #Insert the img element
-            insert_before(disp, img_element)
-            #Create content for the label
+                text_span.attrib['id'] = disp.attrib['id']
+            append_all_below(text_span, disp)
+            #Insert the text span before the disp-formula
+            insert_before(disp, text_span)
+            #If a label exists, modify and insert before text_span
             if label_el is not None:
                 label_el.tag = 'b'
-                insert_before(img_element, label_el)
-            #Remove the old disp-formula element
+                insert_before(text_span, label_el)
+            #Remove the disp-formula
             remove(disp)
-
-    @Publisher.special2
-    @Publisher.special3
-    def convert_inline_formula_elements(self):
+            #Skip the rest, which deals with the graphic element
+            return
+        #The graphic element is present
+        #Create a file reference for the image
+        xlink_href = ns_format(graphic_el, 'xlink:href')
+        graphic_xlink_href = graphic_el.attrib[xlink_href]
+        img_path = self.image_src(graphic_xlink_href)
+
+        #Create the img element
+        img_element = etree.Element('img', {'alt': 'A Display Formula',
+                                            'class': 'disp-formula',
+                                            'src': img_path})
+        img_element.attrib.update(self.image_dimensions(graphic_xlink_href))
+        #Transfer the id attribute
+        if 'id' in disp.attrib:
+            img_element.attrib['id'] = disp.attrib['id']
+        #Insert the img element
+        insert_before(disp, img_element)
+        #Create content for the label
+        if label_el is not None:
+            label_el.tag = 'b'
+            insert_before(img_element, label_el)
+        #Remove the old disp-formula element
+        remove(disp)
+
+    @Publisher.element2('inline-formula')
+    @Publisher.element3('inline-formula')
+    def convert_inline_formula_element(self, inline, epub_version):
         """
         <inline-formula> elements must be converted to be conforming
 
         These elements may contain <inline-graphic> elements, textual content,
         or both.
         """
-        for inline in self.main.getroot().findall('.//inline-formula'):
-            #inline-formula elements will be modified in situ
-            remove_all_attributes(inline)
-            inline.tag = 'span'
-            inline.attrib['class'] = 'inline-formula'
-            inline_graphic = inline.find('inline-graphic')
-            if inline_graphic is None:
-                # Do nothing more if there is no graphic
-                continue
-            #Need to conver the inline-graphic element to an img element
-            inline_graphic.tag = 'img'
-            #Get a copy of the attributes, then remove them
-            inline_graphic_attributes = copy(inline_graphic.attrib)
-            remove_all_attributes(inline_graphic)
-            #Create a file reference for the image
-            xlink_href = ns_format(inline_graphic, 'xlink:href')
-            graphic_xlink_href = inline_graphic_attributes[xlink_href]
-            file_name = graphic_xlink_href.split('.')[-1] + '.png'
-            img_dir = 'images-' + self.doi_suffix()
-            img_path = '/'.join([img_dir, file_name])
-            #Set the source to the image path
-            inline_graphic.attrib['src'] = img_path
-            inline_graphic.attrib['class'] = 'inline-formula'
-            inline_graphic.attrib['alt'] = 'An Inline Formula'
-
-    @Publisher.special2
-    @Publisher.special3
-    def convert_disp_quote_elements(self):
+        #inline-formula elements will be modified in situ
+        remove_all_attributes(inline)
+        inline.tag = 'span'
+        inline.attrib['class'] = 'inline-formula'
+        inline_graphic = inline.find('inline-graphic')
+        if inline_graphic is None:
+            # Do nothing more if there is no graphic
+            return
+        #Need to conver the inline-graphic element to an img element
+        inline_graphic.tag = 'img'
+        #Get a copy of the attributes, then remove them
+        inline_graphic_attributes = copy(inline_graphic.attrib)
+        remove_all_attributes(inline_graphic)
+        #Create a file reference for the image
+        xlink_href = ns_format(inline_graphic, 'xlink:href')
+        graphic_xlink_href = inline_graphic_attributes[xlink_href]
+        img_path = self.image_src(graphic_xlink_href)
+        #Set the source to the image path
+        inline_graphic.attrib['src'] = img_path
+        inline_graphic.attrib['class'] = 'inline-formula'
+        inline_graphic.attrib['alt'] = 'An Inline Formula'
+        inline_graphic.attrib.update(self.image_dimensions(graphic_xlink_href))
+
+    @Publisher.element2('disp-quote')
+    @Publisher.element3('disp-quote')
+    def convert_disp_quote_element(self, disp_quote, epub_version):
         """
         Extract or extended quoted passage from another work, usually made
         typographically distinct from surrounding text
@@ -857,15 +853,14 @@ class PLoS(Publisher):
         <disp-quote> elements have a relatively complex content model, but PLoS
         appears to employ either <p>s or <list>s.
         """
-        for disp_quote in self.main.getroot().findall('.//disp-quote'):
-            if disp_quote.getparent().tag == 'p':
-                elevate_element(disp_quote)
-            disp_quote.tag = 'div'
-            disp_quote.attrib['class'] = 'disp-quote'
+        if disp_quote.getparent().tag == 'p':
+            elevate_element(disp_quote)
+        disp_quote.tag = 'div'
+        disp_quote.attrib['class'] = 'disp-quote'
 
-    @Publisher.special2
-    @Publisher.special3
-    def convert_boxed_text_elements(self):
+    @Publisher.element2('boxed-text')
+    @Publisher.element3('boxed-text')
+    def convert_boxed_text_element(self, boxed_text, epub_version):
         """
         Textual material that is part of the body of text but outside the
         flow of the narrative text, for example, a sidebar, marginalia, text
@@ -876,27 +871,26 @@ class PLoS(Publisher):
         This method will elevate the <sec> element, adding class information as
         well as processing the title.
         """
-        for boxed_text in self.main.getroot().findall('.//boxed-text'):
-            sec_el = boxed_text.find('sec')
-            if sec_el is not None:
-                sec_el.tag = 'div'
-                title = sec_el.find('title')
-                if title is not None:
-                    title.tag = 'b'
-                sec_el.attrib['class'] = 'boxed-text'
-                if 'id' in boxed_text.attrib:
-                    sec_el.attrib['id'] = boxed_text.attrib['id']
-                replace(boxed_text, sec_el)
-            else:
-                div_el = etree.Element('div', {'class': 'boxed-text'})
-                if 'id' in boxed_text.attrib:
-                    div_el.attrib['id'] = boxed_text.attrib['id']
-                append_all_below(div_el, boxed_text)
-                replace(boxed_text, div_el)
+        sec_el = boxed_text.find('sec')
+        if sec_el is not None:
+            sec_el.tag = 'div'
+            title = sec_el.find('title')
+            if title is not None:
+                title.tag = 'b'
+            sec_el.attrib['class'] = 'boxed-text'
+            if 'id' in boxed_text.attrib:
+                sec_el.attrib['id'] = boxed_text.attrib['id']
+            replace(boxed_text, sec_el)
+        else:
+            div_el = etree.Element('div', {'class': 'boxed-text'})
+            if 'id' in boxed_text.attrib:
+                div_el.attrib['id'] = boxed_text.attrib['id']
+            append_all_below(div_el, boxed_text)
+            replace(boxed_text, div_el)
 
-    @Publisher.special2
-    @Publisher.special3
-    def convert_supplementary_material_elements(self):
+    @Publisher.element2('supplementary-material')
+    @Publisher.element3('supplementary-material')
+    def convert_supplementary_material_element(self, supplementary, epub_version):
         """
         Supplementary material are not, nor are they generally expected to be,
         packaged into the epub file. Though this is a technical possibility,
@@ -911,45 +905,44 @@ class PLoS(Publisher):
         contain 1 <label> element, followed by a <caption><title><p></caption>
         substructure.
         """
-        for supplementary in self.main.getroot().findall('.//supplementary-material'):
-            #Create a div element to hold the supplementary content
-            suppl_div = etree.Element('div')
-            if 'id' in supplementary.attrib:
-                suppl_div.attrib['id'] = supplementary.attrib['id']
-            insert_before(supplementary, suppl_div)
-            #Get the sub elements
-            label = supplementary.find('label')
-            caption = supplementary.find('caption')
-            #Get the external resource URL for the supplementary information
-            ns_xlink_href = ns_format(supplementary, 'xlink:href')
-            xlink_href = supplementary.attrib[ns_xlink_href]
-            resource_url = self.fetch_single_representation(xlink_href)
-            if label is not None:
-                label.tag = 'a'
-                label.attrib['href'] = resource_url
-                append_new_text(label, '. ', join_str='')
-                suppl_div.append(label)
-            if caption is not None:
-                title = caption.find('title')
-                paragraphs = caption.findall('p')
-                if title is not None:
-                    title.tag = 'b'
-                    suppl_div.append(title)
-                for paragraph in paragraphs:
-                    suppl_div.append(paragraph)
-            #This is a fix for odd articles with <p>s outside of <caption>
-            #See journal.pctr.0020006, PLoS themselves fail to format this for
-            #the website, though the .pdf is good
-            #It should be noted that journal.pctr.0020006 does not pass
-            #validation because it places a <p> before a <caption>
-            #By placing this at the end of the method, it conforms to the spec
-            #by expecting such p tags after caption. This causes a hiccup in
-            #the rendering for journal.pctr.0020006, but it's better than
-            #skipping the data entirely AND it should also work for conforming
-            #articles.
-            for paragraph in supplementary.findall('p'):
+        #Create a div element to hold the supplementary content
+        suppl_div = etree.Element('div')
+        if 'id' in supplementary.attrib:
+            suppl_div.attrib['id'] = supplementary.attrib['id']
+        insert_before(supplementary, suppl_div)
+        #Get the sub elements
+        label = supplementary.find('label')
+        caption = supplementary.find('caption')
+        #Get the external resource URL for the supplementary information
+        ns_xlink_href = ns_format(supplementary, 'xlink:href')
+        xlink_href = supplementary.attrib[ns_xlink_href]
+        resource_url = self.fetch_single_representation(xlink_href)
+        if label is not None:
+            label.tag = 'a'
+            label.attrib['href'] = resource_url
+            append_new_text(label, '. ', join_str='')
+            suppl_div.append(label)
+        if caption is not None:
+            title = caption.find('title')
+            paragraphs = caption.findall('p')
+            if title is not None:
+                title.tag = 'b'
+                suppl_div.append(title)
+            for paragraph in paragraphs:
                 suppl_div.append(paragraph)
-            remove(supplementary)
+        #This is a fix for odd articles with <p>s outside of <caption>
+        #See journal.pctr.0020006, PLoS themselves fail to format this for
+        #the website, though the .pdf is good
+        #It should be noted that journal.pctr.0020006 does not pass
+        #validation because it places a <p> before a <caption>
+        #By placing this at the end of the method, it conforms to the spec
+        #by expecting such p tags after caption. This causes a hiccup in
+        #the rendering for journal.pctr.0020006, but it's better than
+        #skipping the data entirely AND it should also work for conforming
+        #articles.
+        for paragraph in supplementary.findall('p'):
+            suppl_div.append(paragraph)
+        remove(supplementary)
 
     def fetch_single_representation(self, item_xlink_href):
         """
@@ -972,61 +965,56 @@ class PLoS(Publisher):
         resource = 'fetchSingleRepresentation.action?uri=' + item_xlink_href
         return base_url.format(resource)
 
-    @Publisher.special2
-    @Publisher.special3
-    def convert_fig_elements(self):
+    @Publisher.element2('fig')
+    @Publisher.element3('fig')
+    def convert_fig_element(self, fig, epub_version):
         """
         Responsible for the correct conversion of JPTS 3.0 <fig> elements to
         EPUB xhtml. Aside from translating <fig> to <img>, the content model
         must be edited.
         """
-        for fig in self.main.getroot().findall('.//fig'):
-            if fig.getparent().tag == 'p':
-                elevate_element(fig)
-        for fig in self.main.getroot().findall('.//fig'):
-            #self.convert_fn_elements(fig)
-            #self.convert_disp_formula_elements(fig)
-            #Find label and caption
-            label_el = fig.find('label')
-            caption_el = fig.find('caption')
-            #Get the graphic node, this should be mandatory later on
-            graphic_el = fig.find('graphic')
-            #Create a file reference for the image
-            xlink_href = ns_format(graphic_el, 'xlink:href')
-            graphic_xlink_href = graphic_el.attrib[xlink_href]
-            file_name = graphic_xlink_href.split('.')[-1] + '.png'
-            img_dir = 'images-' + self.doi_suffix()
-            img_path = '/'.join([img_dir, file_name])
-
-            #Create the content: using image path, label, and caption
-            img_el = etree.Element('img', {'alt': 'A Figure', 'src': img_path,
-                                           'class': 'figure'})
-            if 'id' in fig.attrib:
-                img_el.attrib['id'] = fig.attrib['id']
-            insert_before(fig, img_el)
-
-            #Create content for the label and caption
-            if caption_el is not None or label_el is not None:
-                img_caption_div = etree.Element('div', {'class': 'figure-caption'})
-                img_caption_div_b = etree.SubElement(img_caption_div, 'b')
-                if label_el is not None:
-                    append_all_below(img_caption_div_b, label_el)
-                    append_new_text(img_caption_div_b, '. ', join_str='')
-                if caption_el is not None:
-                    caption_title = caption_el.find('title')
-                    if caption_title is not None:
-                        append_all_below(img_caption_div_b, caption_title)
-                        append_new_text(img_caption_div_b, ' ', join_str='')
-                    for each_p in caption_el.findall('p'):
-                        append_all_below(img_caption_div, each_p)
-                insert_before(fig, img_caption_div)
-
-            #Remove the original <fig>
-            remove(fig)
-
-    @Publisher.special2
-    @Publisher.special3
-    def convert_verse_group_elements(self):
+        if fig.getparent().tag == 'p':
+            elevate_element(fig)
+        #Find label and caption
+        label_el = fig.find('label')
+        caption_el = fig.find('caption')
+        #Get the graphic node, this should be mandatory later on
+        graphic_el = fig.find('graphic')
+        #Create a file reference for the image
+        xlink_href = ns_format(graphic_el, 'xlink:href')
+        graphic_xlink_href = graphic_el.attrib[xlink_href]
+        img_path = self.image_src(graphic_xlink_href)
+
+        #Create the content: using image path, label, and caption
+        img_el = etree.Element('img', {'alt': 'A Figure', 'src': img_path,
+                                       'class': 'figure'})
+        img_el.attrib.update(self.image_dimensions(graphic_xlink_href))
+        if 'id' in fig.attrib:
+            img_el.attrib['id'] = fig.attrib['id']
+        insert_before(fig, img_el)
+
+        #Create content for the label and caption
+        if caption_el is not None or label_el is not None:
+            img_caption_div = etree.Element('div', {'class': 'figure-caption'})
+            img_caption_div_b = etree.SubElement(img_caption_div, 'b')
+            if label_el is not None:
+                append_all_below(img_caption_div_b, label_el)
+                append_new_text(img_caption_div_b, '. ', join_str='')
+            if caption_el is not None:
+                caption_title = caption_el.find('title')
+                if caption_title is not None:
+                    append_all_below(img_caption_div_b, caption_title)
+                    append_new_text(img_caption_div_b, ' ', join_str='')
+                for each_p in caption_el.findall('p'):
+                    append_all_below(img_caption_div, each_p)
+            insert_before(fig, img_caption_div)
+
+        #Remove the original <fig>
+        remove(fig)
+
+    @Publisher.element2('verse-group')
+    @Publisher.element3('verse-group')
+    def convert_verse_group_element(self, verse_group, epub_version):
         """
         A song, poem, or verse
 
@@ -1040,36 +1028,35 @@ class PLoS(Publisher):
         title, and subtitle elements correctly, while converting <verse-lines>
         to italicized lines.
         """
-        for verse_group in self.main.getroot().findall('.//verse-group'):
-            #Find some possible sub elements for the heading
-            label = verse_group.find('label')
-            title = verse_group.find('title')
-            subtitle = verse_group.find('subtitle')
-            #Modify the verse-group element
-            verse_group.tag = 'div'
-            verse_group.attrib['id'] = 'verse-group'
-            #Create a title for the verse_group
-            if label is not None or title is not None or subtitle is not None:
-                new_verse_title = etree.Element('b')
-                #Insert it at the beginning
-                verse_group.insert(0, new_verse_title)
-                #Induct the title elements into the new title
-                if label is not None:
-                    append_all_below(new_verse_title, label)
-                    remove(label)
-                if title is not None:
-                    append_all_below(new_verse_title, title)
-                    remove(title)
-                if subtitle is not None:
-                    append_all_below(new_verse_title, subtitle)
-                    remove(subtitle)
-            for verse_line in verse_group.findall('verse-line'):
-                verse_line.tag = 'p'
-                verse_line.attrib['class'] = 'verse-line'
-
-    @Publisher.special2
-    @Publisher.special3
-    def convert_fn_elements(self):
+        #Find some possible sub elements for the heading
+        label = verse_group.find('label')
+        title = verse_group.find('title')
+        subtitle = verse_group.find('subtitle')
+        #Modify the verse-group element
+        verse_group.tag = 'div'
+        verse_group.attrib['id'] = 'verse-group'
+        #Create a title for the verse_group
+        if label is not None or title is not None or subtitle is not None:
+            new_verse_title = etree.Element('b')
+            #Insert it at the beginning
+            verse_group.insert(0, new_verse_title)
+            #Induct the title elements into the new title
+            if label is not None:
+                append_all_below(new_verse_title, label)
+                remove(label)
+            if title is not None:
+                append_all_below(new_verse_title, title)
+                remove(title)
+            if subtitle is not None:
+                append_all_below(new_verse_title, subtitle)
+                remove(subtitle)
+        for verse_line in verse_group.findall('verse-line'):
+            verse_line.tag = 'p'
+            verse_line.attrib['class'] = 'verse-line'
+
+    @Publisher.element2('fn')
+    @Publisher.element3('fn')
+    def convert_fn_element(self, footnote, epub_version):
         """
         <fn> elements may be used in the main text body outside of tables and
         figures for purposes such as erratum notes. It appears that PLoS
@@ -1081,31 +1068,30 @@ class PLoS(Publisher):
         identified as an Erratum, in which case it will be removed in
         accordance with PLoS' apparent guidelines.
         """
-        for footnote in self.main.getroot().findall('.//fn'):
-            #Use only the first paragraph
-            paragraph = footnote.find('p')
-            #If no paragraph, move on
-            if paragraph is None:
-                remove(footnote)
-                continue
-            #Simply remove corrected errata items
-            paragraph_text = str(etree.tostring(paragraph, method='text', encoding='utf-8'), encoding='utf-8')
-            if paragraph_text.startswith('Erratum') and 'Corrected' in paragraph_text:
-                remove(footnote)
-                continue
-            #Transfer some attribute information from the fn element to the paragraph
-            if 'id' in footnote.attrib:
-                paragraph.attrib['id'] = footnote.attrib['id']
-            if 'fn-type' in footnote.attrib:
-                paragraph.attrib['class'] = 'fn-type-{0}'.footnote.attrib['fn-type']
-            else:
-                paragraph.attrib['class'] = 'fn'
-                #Replace the
-            replace(footnote, paragraph)
+        #Use only the first paragraph
+        paragraph = footnote.find('p')
+        #If no paragraph, move on
+        if paragraph is None:
+            remove(footnote)
+            return
+        #Simply remove corrected errata items
+        paragraph_text = str(etree.tostring(paragraph, method='text', encoding='utf-8'), encoding='utf-8')
+        if paragraph_text.startswith('Erratum') and 'Corrected' in paragraph_text:
+            remove(footnote)
+            return
+        #Transfer some attribute information from the fn element to the paragraph
+        if 'id' in footnote.attrib:
+            paragraph.attrib['id'] = footnote.attrib['id']
+        if 'fn-type' in footnote.attrib:
+            paragraph.attrib['class'] = 'fn-type-{0}'.footnote.attrib['fn-type']
+        else:
+            paragraph.attrib['class'] = 'fn'
+            #Replace the
+        replace(footnote, paragraph)
 
-    @Publisher.special2
-    @Publisher.special3
-    def convert_list_elements(self):
+    @Publisher.element2('list')
+    @Publisher.element3('list')
+    def convert_list_element(self, list_el, epub_version):
         """
         A sequence of two or more items, which may or may not be ordered.
 
@@ -1123,34 +1109,32 @@ class PLoS(Publisher):
         #edit the CSS to provide formatting support for arbitrary prefixes...
 
         #This is a block level element, so elevate it if found in p
-        for list_el in self.main.getroot().findall('.//list'):
-            if list_el.getparent().tag == 'p':
-                elevate_element(list_el)
+        if list_el.getparent().tag == 'p':
+            elevate_element(list_el)
 
         #list_el is used instead of list (list is reserved)
-        for list_el in self.main.getroot().findall('.//list'):
-            if 'list-type' not in list_el.attrib:
-                list_el_type = 'order'
-            else:
-                list_el_type = list_el.attrib['list-type']
-            #Unordered lists
-            if list_el_type in ['', 'bullet', 'simple']:
-                list_el.tag = 'ul'
-                #CSS must be used to recognize the class and suppress bullets
-                if list_el_type == 'simple':
-                    list_el.attrib['class'] = 'simple'
-            #Ordered lists
-            else:
-                list_el.tag = 'ol'
-                list_el.attrib['class'] = list_el_type
-            #Convert the list-item element tags to 'li'
-            for list_item in list_el.findall('list-item'):
-                list_item.tag = 'li'
-            remove_all_attributes(list_el, exclude=['id', 'class'])
-
-    @Publisher.special2
-    @Publisher.special3
-    def convert_def_list_elements(self):
+        if 'list-type' not in list_el.attrib:
+            list_el_type = 'order'
+        else:
+            list_el_type = list_el.attrib['list-type']
+        #Unordered lists
+        if list_el_type in ['', 'bullet', 'simple']:
+            list_el.tag = 'ul'
+            #CSS must be used to recognize the class and suppress bullets
+            if list_el_type == 'simple':
+                list_el.attrib['class'] = 'simple'
+        #Ordered lists
+        else:
+            list_el.tag = 'ol'
+            list_el.attrib['class'] = list_el_type
+        #Convert the list-item element tags to 'li'
+        for list_item in list_el.findall('list-item'):
+            list_item.tag = 'li'
+        remove_all_attributes(list_el, exclude=['id', 'class'])
+
+    @Publisher.element2('def-list')
+    @Publisher.element3('def-list')
+    def convert_def_list_element(self, def_list, epub_version):
         """
         A list in which each item consists of two parts: a word, phrase, term,
         graphic, chemical structure, or equation paired with one of more
@@ -1161,35 +1145,34 @@ class PLoS(Publisher):
         will convert the <def-list> to a classed <div> with a styled format
         for the terms and definitions.
         """
-        for def_list in self.main.getroot().findall('.//def-list'):
-            #Remove the attributes, excepting id
-            remove_all_attributes(def_list, exclude=['id'])
-            #Modify the def-list element
-            def_list.tag = 'div'
-            def_list.attrib['class'] = 'def-list'
-            for def_item in def_list.findall('def-item'):
-                #Get the term being defined, modify it
-                term = def_item.find('term')
-                term.tag = 'p'
-                term.attrib['class']= 'def-item-term'
-                #Insert it before its parent def_item
-                insert_before(def_item, term)
-                #Get the definition, handle missing with a warning
-                definition = def_item.find('def')
-                if definition is None:
-                    log.warning('Missing def element in def-item')
-                    remove(def_item)
-                    continue
-                #PLoS appears to consistently place all definition text in a
-                #paragraph subelement of the def element
-                def_para = definition.find('p')
-                def_para.attrib['class'] = 'def-item-def'
-                #Replace the def-item element with the p element
-                replace(def_item, def_para)
-
-    @Publisher.special2
-    @Publisher.special3
-    def convert_ref_list_elements(self):
+        #Remove the attributes, excepting id
+        remove_all_attributes(def_list, exclude=['id'])
+        #Modify the def-list element
+        def_list.tag = 'div'
+        def_list.attrib['class'] = 'def-list'
+        for def_item in def_list.findall('def-item'):
+            #Get the term being defined, modify it
+            term = def_item.find('term')
+            term.tag = 'p'
+            term.attrib['class']= 'def-item-term'
+            #Insert it before its parent def_item
+            insert_before(def_item, term)
+            #Get the definition, handle missing with a warning
+            definition = def_item.find('def')
+            if definition is None:
+                log.warning('Missing def element in def-item')
+                remove(def_item)
+                continue
+            #PLoS appears to consistently place all definition text in a
+            #paragraph subelement of the def element
+            def_para = definition.find('p')
+            def_para.attrib['class'] = 'def-item-def'
+            #Replace the def-item element with the p element
+            replace(def_item, def_para)
+
+    @Publisher.element2('ref-list')
+    @Publisher.element3('ref-list')
+    def convert_ref_list_element(self, ref_list, epub_version):
         """
         List of references (citations) for an article, which is often called
         “References”, “Bibliography”, or “Additional Reading”.
@@ -1203,124 +1186,121 @@ class PLoS(Publisher):
         access to PLOS' algorithm for proper citation formatting.
         """
         #TODO: Handle nested ref-lists
-        for ref_list in self.main.getroot().findall('.//ref-list'):
-            remove_all_attributes(ref_list)
-            ref_list.tag = 'div'
-            ref_list.attrib['class'] = 'ref-list'
-            label = ref_list.find('label')
-            if label is not None:
-                label.tag = 'h3'
-            for ref in ref_list.findall('ref'):
-                ref_p = etree.Element('p')
-                ref_p.text = str(etree.tostring(ref, method='text', encoding='utf-8'), encoding='utf-8')
-                replace(ref, ref_p)
-
-    @Publisher.special2
-    @Publisher.special3
-    def convert_table_wrap_elements(self):
+        remove_all_attributes(ref_list)
+        ref_list.tag = 'div'
+        ref_list.attrib['class'] = 'ref-list'
+        label = ref_list.find('label')
+        if label is not None:
+            label.tag = 'h3'
+        for ref in ref_list.findall('ref'):
+            ref_p = etree.Element('p')
+            ref_p.text = str(etree.tostring(ref, method='text', encoding='utf-8'), encoding='utf-8')
+            replace(ref, ref_p)
+
+    @Publisher.element2('table-wrap')
+    @Publisher.element3('table-wrap')
+    def convert_table_wrap_element(self, table_wrap, epub_version):
         """
         Responsible for the correct conversion of JPTS 3.0 <table-wrap>
         elements to EPUB content.
 
         The 'id' attribute is treated as mandatory by this method.
         """
-        for table_wrap in self.main.getroot().findall('.//table-wrap'):
-
-            table_div = etree.Element('div', {'id': table_wrap.attrib['id']})
-
-            label = table_wrap.find('label')
-            caption = table_wrap.find('caption')
-            alternatives = table_wrap.find('alternatives')
-            graphic = table_wrap.find('graphic')
-            table = table_wrap.find('table')
-            if graphic is None:
-                if alternatives is not None:
-                    graphic = alternatives.find('graphic')
-            if table is None:
-                if alternatives is not None:
-                    table = alternatives.find('table')
-
-            #Handling the label and caption
-            if label is not None and caption is not None:
-                caption_div = etree.Element('div', {'class': 'table-caption'})
-                caption_div_b = etree.SubElement(caption_div, 'b')
+
+        table_div = etree.Element('div', {'id': table_wrap.attrib['id']})
+
+        label = table_wrap.find('label')
+        caption = table_wrap.find('caption')
+        alternatives = table_wrap.find('alternatives')
+        graphic = table_wrap.find('graphic')
+        table = table_wrap.find('table')
+        if graphic is None:
+            if alternatives is not None:
+                graphic = alternatives.find('graphic')
+        if table is None:
+            if alternatives is not None:
+                table = alternatives.find('table')
+
+        #Handling the label and caption
+        if label is not None and caption is not None:
+            caption_div = etree.Element('div', {'class': 'table-caption'})
+            caption_div_b = etree.SubElement(caption_div, 'b')
+            if label is not None:
+                append_all_below(caption_div_b, label)
+            if caption is not None:
+                #Find, optional, title element and paragraph elements
+                caption_title = caption.find('title')
+                if caption_title is not None:
+                    append_all_below(caption_div_b, caption_title)
+                caption_ps = caption.findall('p')
+                #For title and each paragraph, give children to the div
+                for caption_p in caption_ps:
+                    append_all_below(caption_div, caption_p)
+            #Add this to the table div
+            table_div.append(caption_div)
+
+        ### Practical Description ###
+        #A table may have both, one of, or neither of graphic and table
+        #The different combinations should be handled, but a table-wrap
+        #with neither should fail with an error
+        #
+        #If there is both an image and a table, the image should be placed
+        #in the text flow with a link to the html table
+        #
+        #If there is an image and no table, the image should be placed in
+        #the text flow without a link to an html table
+        #
+        #If there is a table with no image, then the table should be placed
+        #in the text flow.
+
+        if graphic is not None:
+            #Create the image path for the graphic
+            xlink_href = ns_format(graphic, 'xlink:href')
+            graphic_xlink_href = graphic.attrib[xlink_href]
+            img_path = self.image_src(graphic_xlink_href)
+            #Create the new img element
+            img_element = etree.Element('img', {'alt': 'A Table',
+                                                'src': img_path,
+                                                'class': 'table'})
+            img_element.attrib.update(self.image_dimensions(graphic_xlink_href))
+            #Add this to the table div
+            table_div.append(img_element)
+            #If table, add it to the list, and link to it
+            if table is not None:  # Both graphic and table
+                #The label attribute is just a means of transmitting some
+                #plaintext which will be used for the labeling in the html
+                #tables file
+                div = etree.SubElement(self.tables.find('body'),
+                                       'div',
+                                       {'id': table_wrap.attrib['id']})
+
                 if label is not None:
-                    append_all_below(caption_div_b, label)
-                if caption is not None:
-                    #Find, optional, title element and paragraph elements
-                    caption_title = caption.find('title')
-                    if caption_title is not None:
-                        append_all_below(caption_div_b, caption_title)
-                    caption_ps = caption.findall('p')
-                    #For title and each paragraph, give children to the div
-                    for caption_p in caption_ps:
-                        append_all_below(caption_div, caption_p)
-                #Add this to the table div
-                table_div.append(caption_div)
-
-            ### Practical Description ###
-            #A table may have both, one of, or neither of graphic and table
-            #The different combinations should be handled, but a table-wrap
-            #with neither should fail with an error
-            #
-            #If there is both an image and a table, the image should be placed
-            #in the text flow with a link to the html table
-            #
-            #If there is an image and no table, the image should be placed in
-            #the text flow without a link to an html table
-            #
-            #If there is a table with no image, then the table should be placed
-            #in the text flow.
-
-            if graphic is not None:
-                #Create the image path for the graphic
-                xlink_href = ns_format(graphic, 'xlink:href')
-                graphic_xlink_href = graphic.attrib[xlink_href]
-                file_name = graphic_xlink_href.split('.')[-1] + '.png'
-                img_dir = 'images-' + self.doi_suffix()
-                img_path = '/'.join([img_dir, file_name])
-                #Create the new img element
-                img_element = etree.Element('img', {'alt': 'A Table',
-                                                    'src': img_path,
-                                                    'class': 'table'})
+                    bold_label = etree.SubElement(div, 'b')
+                    append_all_below(bold_label, label)
+                #Add the table to the tables list
+                div.append(deepcopy(table))
+                #Also add the table's foot if it exists
+                table_wrap_foot = table_wrap.find('table-wrap-foot')
+                if table_wrap_foot is not None:
+                    table_wrap_foot.tag = 'div'
+                    table_wrap_foot.attrib['class'] = 'table-wrap-foot'
+                    div.append(table_wrap_foot)
+                #Create a link to the html version of the table
+                html_table_link = etree.Element('a')
+                html_table_link.attrib['href'] = self.tables_fragment.format(table_wrap.attrib['id'])
+                html_table_link.text = 'Go to HTML version of this table'
                 #Add this to the table div
-                table_div.append(img_element)
-                #If table, add it to the list, and link to it
-                if table is not None:  # Both graphic and table
-                    #The label attribute is just a means of transmitting some
-                    #plaintext which will be used for the labeling in the html
-                    #tables file
-                    div = etree.SubElement(self.tables.find('body'),
-                                           'div',
-                                           {'id': table_wrap.attrib['id']})
-
-                    if label is not None:
-                        bold_label = etree.SubElement(div, 'b')
-                        append_all_below(bold_label, label)
-                    #Add the table to the tables list
-                    div.append(deepcopy(table))
-                    #Also add the table's foot if it exists
-                    table_wrap_foot = table_wrap.find('table-wrap-foot')
-                    if table_wrap_foot is not None:
-                        table_wrap_foot.tag = 'div'
-                        table_wrap_foot.attrib['class'] = 'table-wrap-foot'
-                        div.append(table_wrap_foot)
-                    #Create a link to the html version of the table
-                    html_table_link = etree.Element('a')
-                    html_table_link.attrib['href'] = self.tables_fragment.format(table_wrap.attrib['id'])
-                    html_table_link.text = 'Go to HTML version of this table'
-                    #Add this to the table div
-                    table_div.append(html_table_link)
-                    remove(table)
-
-            elif table is not None:  # Table only
-                #Simply append the table to the table div
-                table_div.append(table)
-            elif graphic is None and table is None:
-                sys.exit('Encountered table-wrap element with neither graphic nor table. Exiting.')
-
-            #Replace the original table-wrap with the newly constructed div
-            replace(table_wrap, table_div)
+                table_div.append(html_table_link)
+                remove(table)
+
+        elif table is not None:  # Table only
+            #Simply append the table to the table div
+            table_div.append(table)
+        elif graphic is None and table is None:
+            sys.exit('Encountered table-wrap element with neither graphic nor table. Exiting.')
+
+        #Replace the original table-wrap with the newly constructed div
+        replace(table_wrap, table_div)
 
     @Publisher.special3
     def html5_table_modification(self):
@@ -1339,26 +1319,24 @@ class PLoS(Publisher):
         for colgroup in self.tables.findall('//colgroup'):
             remove(colgroup)
 
-    @Publisher.special2
-    @Publisher.special3
-    def convert_graphic_elements(self):
+    @Publisher.element2('graphic', phase='post')
+    @Publisher.element3('graphic', phase='post')
+    def convert_graphic_element(self, graphic, epub_version):
         """
         This is a method for the odd special cases where <graphic> elements are
         standalone, or rather, not a part of a standard graphical element such
-        as a figure or a table. This method should always be employed after the
-        standard cases have already been handled.
-        """
-        for graphic in self.main.getroot().findall('.//graphic'):
-            graphic.tag = 'img'
-            graphic.attrib['alt'] = 'unowned-graphic'
-            ns_xlink_href = ns_format(graphic, 'xlink:href')
-            if ns_xlink_href in graphic.attrib:
-                xlink_href = graphic.attrib[ns_xlink_href]
-                file_name = xlink_href.split('.')[-1] + '.png'
-                img_dir = 'images-' + self.doi_suffix()
-                img_path = '/'.join([img_dir, file_name])
-                graphic.attrib['src'] = img_path
-            remove_all_attributes(graphic, exclude=['id', 'class', 'alt', 'src'])
+        as a figure or a table. It is registered for the 'post' phase, so that
+        the standard cases have always been handled in the 'convert' phase.
+        """
+        graphic.tag = 'img'
+        graphic.attrib['alt'] = 'unowned-graphic'
+        ns_xlink_href = ns_format(graphic, 'xlink:href')
+        xlink_href = graphic.attrib.get(ns_xlink_href)
+        if xlink_href is not None:
+            graphic.attrib['src'] = self.image_src(xlink_href)
+        remove_all_attributes(graphic, exclude=['id', 'class', 'alt', 'src'])
+        if xlink_href is not None:
+            graphic.attrib.update(self.image_dimensions(xlink_href))
 
     @Publisher.maker2
     @Publisher.maker3
@@ -5,6 +5,7 @@ Common utility functions
 
 #Standard Library modules
 import collections
+import functools
 import logging
 import os
 import platform
@@ -83,8 +84,11 @@ class OrderedSet(collections.MutableSet):
         return set(self) == set(other)
 
 
+@functools.lru_cache(maxsize=None)
 def cache_location():
-    '''Cross-platform placement of cached files'''
+    '''
+    Cross-platform placement of cached files, resolved once per process
+    '''
     plat = platform.platform()
     log.debug('Platform read as: {0}'.format(plat))
     if plat.startswith('Windows'):
@@ -132,19 +136,12 @@ def publisher_plugin_location():
 
 def load_config_module():
     """
-    If the config.py file exists, import it as a module. If it does not exist,
-    call sys.exit() with a request to run oaepub configure.
+    Returns the settings resolved from the config file and the environment,
+    see openaccess_epub.utils.settings.load_settings. If the config file does
+    not exist, call sys.exit() with a request to run oaepub configure.
     """
-    import imp
-    config_path = config_location()
-    try:
-        config = imp.load_source('config', config_path)
-    except IOError:
-        log.critical('Config file not found. oaepub exiting...')
-        sys.exit('Config file not found. Please run \'oaepub configure\'')
-    else:
-        log.debug('Config file loaded from {0}'.format(config_path))
-        return config
+    from openaccess_epub.utils.settings import load_settings
+    return load_settings()
 
 
 def mkdir_p(dir):
@@ -190,14 +187,7 @@ def get_output_directory(args):
 
     All paths returned by this function are absolute.
     """
-    #Import the global config file as a module
-    import imp
-    config_path = os.path.join(cache_location(), 'config.py')
-    try:
-        config = imp.load_source('config', config_path)
-    except IOError:
-        print('Could not find {0}, please run oae-quickstart'.format(config_path))
-        sys.exit()
+    config = load_config_module()
     #args.output is the explicit user instruction, None if unspecified
     if args.output:
         #args.output may be an absolute path
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Reading articles and their images straight out of archives.
+
+Open access content is often distributed in archives: PubMed Central packages
+each article as a tar.gz of its XML and images, and publishers offer bundles of
+many articles as tar.gz or zip files. Rather than unpacking an archive to disk,
+its members are read as a stream, in the order they are stored, and the members
+in each directory of the archive are gathered into an archive_article. The XML
+is parsed from memory and the images are written from memory straight into the
+EPUB, so nothing is extracted.
+
+Only members with XML or image extensions are read; the rest, such as PDFs and
+supplementary data, are passed over without being decompressed into memory.
+The members of a directory are expected to be stored together, as they are in
+PMC packages. An article whose directory holds no images gets its images by
+the usual means instead, such as the image cache or fetching.
+"""
+
+#Standard Library modules
+from collections import namedtuple
+import hashlib
+import logging
+import os
+import posixpath
+import tarfile
+import zipfile
+
+#Non-Standard Library modules
+
+#OpenAccess_EPUB modules
+from openaccess_epub.utils.images import EXTENSION_FORMATS
+from openaccess_epub.utils.image_store import image_file
+
+log = logging.getLogger('openaccess_epub.utils.archives')
+
+archive_article = namedtuple('archive_article', 'archive, name, xml, images')
+
+#The archive types which are read, tar archives may be compressed in any way
+#the tarfile module supports
+ARCHIVE_EXTENSIONS = ('.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz',
+                      '.tar', '.zip')
+
+XML_EXTENSIONS = ('.xml', '.nxml')
+
+IMAGE_EXTENSIONS = tuple(extension for extension, image_format in EXTENSION_FORMATS)
+
+#The most XML to hold in memory for one directory while waiting to see if
+#images follow. A directory of many articles without images, such as in the
+#PMC bulk packages, is handed out in parts of about this size
+MAX_PENDING_XML = 64 * 1024 * 1024
+
+
+def is_archive(path):
+    """
+    Returns True if the path names an archive which can be read for articles.
+    """
+    return path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def find_archives(directory, recursive=False):
+    """
+    Yields the paths of the archives in a directory, and in its subdirectories
+    if `recursive`.
+    """
+    if recursive:
+        for dirname, subdirnames, filenames in os.walk(directory):
+            subdirnames.sort()
+            for filename in sorted(filenames):
+                if is_archive(filename):
+                    yield os.path.join(dirname, filename)
+    else:
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path) and is_archive(name):
+                yield path
+
+
+def wanted_member(name):
+    """
+    Returns True for the archive members which are read: XML and images, but
+    not the resource forks and hidden files some archivers add.
+    """
+    base = posixpath.basename(name)
+    if base.startswith('.') or name.startswith('__MACOSX/'):
+        return False
+    return base.lower().endswith(XML_EXTENSIONS + IMAGE_EXTENSIONS)
+
+
+def archive_members(path):
+    """
+    Yields (name, data) for each XML and image member of an archive, in the
+    order they are stored. A tar archive is read as a single stream.
+    """
+    if path.lower().endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if info.filename.endswith('/') or not wanted_member(info.filename):
+                    continue
+                yield info.filename, archive.read(info)
+    else:
+        with tarfile.open(path, mode='r|*') as archive:
+            for member in archive:
+                if not member.isfile() or not wanted_member(member.name):
+                    continue
+                yield member.name, archive.extractfile(member).read()
+
+
+def archive_articles(path):
+    """
+    Yields an archive_article(archive, name, xml, images) for each article XML
+    in an archive, with the XML as bytes and its images as a sorted list of
+    image_file(name, path, digest, data) holding their content. The images of
+    an article are those stored in the same directory of the archive.
+    """
+    directory = None
+    pending_xml = []
+    pending_size = 0
+    images = []
+    finished = set()
+    for name, data in archive_members(path):
+        member_directory, base = posixpath.split(name)
+        if member_directory != directory:
+            for article in _gather(path, pending_xml, images):
+                yield article
+            finished.add(directory)
+            if member_directory in finished:
+                log.warning('Members of {0} in {1} are not stored together, its articles may lack images'.format(member_directory, path))
+            directory = member_directory
+            pending_xml = []
+            pending_size = 0
+            images = []
+        if base.lower().endswith(XML_EXTENSIONS):
+            pending_xml.append((name, data))
+            pending_size += len(data)
+            if pending_size > MAX_PENDING_XML:
+                log.debug('Handing out {0} articles from {1} early'.format(len(pending_xml), directory))
+                for article in _gather(path, pending_xml, images):
+                    yield article
+                pending_xml = []
+                pending_size = 0
+        else:
+            images.append(image_file(base, None, hashlib.sha256(data).hexdigest(), data))
+    for article in _gather(path, pending_xml, images):
+        yield article
+
+
+def _gather(path, pending_xml, images):
+    images = sorted(images)
+    return [archive_article(path, name, data, images) for name, data in pending_xml]
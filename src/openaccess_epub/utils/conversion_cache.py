@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+A content-addressed cache of produced EPUB files.
+
+An EPUB produced by OpenAccess_EPUB is fully determined by the article XML, its
+images, the configuration, the EPUB version and the version of OpenAccess_EPUB
+itself. The conversion cache computes a key from all of these inputs and stores
+the finished EPUB file under it, so that converting an unchanged article again
+can simply reuse the previous output.
+
+The cache is a directory of files named by their key. Its total size is capped;
+when a newly stored file takes it over the cap, the least recently used files
+(judged by modification time, which is refreshed on every hit) are removed.
+"""
+
+#Standard Library modules
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+
+#Non-Standard Library modules
+
+#OpenAccess_EPUB modules
+import openaccess_epub
+from openaccess_epub.utils.image_store import file_digest
+
+log = logging.getLogger('openaccess_epub.utils.conversion_cache')
+
+#Config values which do not affect the content of the output. Those which say
+#where images are looked for, or whether a place is used, are among them: the
+#key covers the content of the images which were found
+IGNORED_CONFIG = ('cache_location', 'conversion_cache',
+                  'use_conversion_cache', 'conversion_cache_max_size',
+                  'default_output', 'epubcheck_jarfile', 'disable_epubcheck',
+                  'image_fetch_workers', 'image_fetch_rate',
+                  'image_fetch_retries', 'image_cache_max_size',
+                  'image_cache', 'use_image_cache', 'use_image_fetching',
+                  'input_relative_images', 'use_input_relative_images')
+
+
+def config_fingerprint(config_module):
+    """
+    Returns a string representing the values of the config module which may
+    affect the content of a produced EPUB.
+    """
+    items = []
+    #The fields of the settings, or the names in an old style config module
+    names = getattr(config_module, '_fields', None) or dir(config_module)
+    for name in sorted(names):
+        if name.startswith('_') or name in IGNORED_CONFIG:
+            continue
+        value = getattr(config_module, name)
+        if isinstance(value, (str, int, float, bool, list, tuple)):
+            items.append('{0}={1!r}'.format(name, value))
+    return '\n'.join(items)
+
+
+def conversion_key(xml_path, image_files, config_module, epub_version,
+                   xml_data=None):
+    """
+    Computes the cache key for a conversion.
+
+    Parameters
+    ----------
+    xml_path : str
+        The path to the input XML file.
+    image_files : list
+        The image_file(name, path, digest) tuples for the images of the
+        article as located, before any optimization. The content of each is
+        included in the key, by its digest where known so that the file need
+        not be read.
+    config_module : config module
+        The config module in use for the conversion.
+    epub_version : {2, 3}
+        The EPUB version being produced.
+    xml_data : bytes, optional
+        The content of the input XML, used instead of reading `xml_path` when
+        the article was not read from a file of its own.
+
+    Returns the hexadecimal SHA-256 digest of the inputs.
+    """
+    key = hashlib.sha256()
+
+    def update(label, data):
+        key.update('{0}:{1}:'.format(label, len(data)).encode('utf-8'))
+        key.update(data)
+
+    update('version', openaccess_epub.__version__.encode('utf-8'))
+    update('epub', str(epub_version).encode('utf-8'))
+    update('config', config_fingerprint(config_module).encode('utf-8'))
+    update('date', os.environ.get('SOURCE_DATE_EPOCH', '').encode('utf-8'))
+    if xml_data is None:
+        with open(xml_path, 'rb') as xml_file:
+            xml_data = xml_file.read()
+    update('xml', xml_data)
+    for image in image_files:
+        update('name', image.name.encode('utf-8'))
+        digest = image.digest
+        if digest is None:
+            digest = file_digest(image.path)
+        update('file', digest.encode('utf-8'))
+    return key.hexdigest()
+
+
+class ConversionCache(object):
+    """
+    A size-capped directory of EPUB files named by their conversion key.
+
+    Parameters
+    ----------
+    location : str
+        The directory holding the cached files, created if needed.
+    max_size : int
+        The maximum total size of the cached files, in bytes.
+    """
+    def __init__(self, location, max_size):
+        self.location = location
+        self.max_size = max_size
+        self._size = None  # Computed lazily, then kept up to date by store()
+
+    def path(self, key):
+        return os.path.join(self.location, key + '.epub')
+
+    def fetch(self, key, destination):
+        """
+        Copies the cached EPUB for `key` to `destination`.
+
+        Returns True on a hit, False if nothing is cached under `key`.
+        """
+        cached = self.path(key)
+        try:
+            shutil.copyfile(cached, destination)
+        except (IOError, OSError):
+            return False
+        try:
+            os.utime(cached, None)  # Mark as recently used
+        except OSError:
+            pass
+        log.info('Conversion cache hit for {0}'.format(destination))
+        return True
+
+    def store(self, key, source):
+        """
+        Copies the EPUB at `source` into the cache under `key`, then evicts the
+        least recently used files if the cache has grown over its size cap.
+        """
+        if not os.path.isdir(self.location):
+            os.makedirs(self.location)
+        #Write to a temporary file first so that an interrupted copy is never
+        #mistaken for a complete EPUB by another process
+        handle, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.location)
+        os.close(handle)
+        try:
+            shutil.copyfile(source, temp_path)
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, self.path(key))
+        except (IOError, OSError):
+            log.exception('Unable to store {0} in the conversion cache'.format(source))
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        if self._size is not None:
+            self._size += os.path.getsize(self.path(key))
+        self.evict()
+
+    def entries(self):
+        """
+        Returns a list of (mtime, size, path) for the cached files, oldest
+        first.
+        """
+        entries = []
+        if not os.path.isdir(self.location):
+            return entries
+        for filename in os.listdir(self.location):
+            if not filename.endswith('.epub'):
+                continue
+            path = os.path.join(self.location, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:  # Removed by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        return entries
+
+    def size(self):
+        if self._size is None:
+            self._size = sum(entry[1] for entry in self.entries())
+        return self._size
+
+    def evict(self):
+        """
+        Removes the least recently used files until the cache is no larger than
+        its size cap.
+        """
+        if self.size() <= self.max_size:
+            return
+        entries = self.entries()
+        self._size = sum(entry[1] for entry in entries)
+        for mtime, size, path in entries:
+            if self._size <= self.max_size:
+                break
+            log.debug('Evicting {0} from the conversion cache'.format(path))
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
+
+
+_caches = {}
+
+
+def get_conversion_cache(config_module):
+    """
+    Returns the ConversionCache described by the config module, or None if the
+    conversion cache is not enabled.
+    """
+    if not getattr(config_module, 'use_conversion_cache', False):
+        return None
+    location = getattr(config_module, 'conversion_cache', None)
+    if location is None:
+        location = os.path.join(openaccess_epub.utils.cache_location(),
+                                'conversion_cache')
+    max_size = getattr(config_module, 'conversion_cache_max_size', 2048)
+    max_size = int(max_size * 1024 * 1024)  # Configured in megabytes
+    try:
+        cache = _caches[(location, max_size)]
+    except KeyError:
+        cache = ConversionCache(location, max_size)
+        _caches[(location, max_size)] = cache
+    return cache
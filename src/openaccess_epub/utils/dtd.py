@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+A process-wide registry of parsed DTDs, keyed by their public identifier.
+
+Parsing a DTD with lxml means reading and resolving its full tree of entity
+files, which is a considerable amount of work for the Journal Publishing Tag
+Set. The registry parses each DTD the first time it is requested, then serves
+the same lxml.etree.DTD object for the rest of the life of the process.
+"""
+
+#Standard Library modules
+from collections import namedtuple
+import logging
+import threading
+
+#Non-Standard Library modules
+from lxml import etree
+
+#OpenAccess_EPUB modules
+from openaccess_epub import JPTS10_PATH, JPTS11_PATH, JPTS20_PATH,\
+    JPTS21_PATH, JPTS22_PATH, JPTS23_PATH, JPTS30_PATH
+
+log = logging.getLogger('openaccess_epub.utils.dtd')
+
+dtd_tuple = namedtuple('DTD_Tuple', 'path, name, version')
+
+dtds = {'-//NLM//DTD Journal Archiving and Interchange DTD v1.0 20021201//EN':
+        dtd_tuple(JPTS10_PATH, 'JPTS', 1.0),
+        '-//NLM//DTD Journal Archiving and Interchange DTD v1.1 20031101//EN':
+        dtd_tuple(JPTS11_PATH, 'JPTS', 1.1),
+        '-//NLM//DTD Journal Publishing DTD v2.0 20040830//EN':
+        dtd_tuple(JPTS20_PATH, 'JPTS', 2.0),
+        '-//NLM//DTD Journal Publishing DTD v2.1 20050630//EN':
+        dtd_tuple(JPTS21_PATH, 'JPTS', 2.1),
+        '-//NLM//DTD Journal Publishing DTD v2.2 20060430//EN':
+        dtd_tuple(JPTS22_PATH, 'JPTS', 2.2),
+        '-//NLM//DTD Journal Publishing DTD v2.3 20070202//EN':
+        dtd_tuple(JPTS23_PATH, 'JPTS', 2.3),
+        '-//NLM//DTD Journal Publishing DTD v3.0 20080202//EN':
+        dtd_tuple(JPTS30_PATH, 'JPTS', 3.0)}
+
+
+class DTDRegistry(object):
+    """
+    Lazily parses and caches lxml.etree.DTD objects by public id.
+
+    Parameters
+    ----------
+    dtd_map : dict, optional
+        Maps DTD public ids to DTD_Tuple(path, name, version). The module level
+        `dtds` mapping is used if not supplied.
+
+    Attributes
+    ----------
+    hits : int
+        The number of requests served by an already parsed DTD.
+    misses : int
+        The number of requests which required the DTD to be parsed.
+    """
+    def __init__(self, dtd_map=None):
+        self.dtd_map = dtds if dtd_map is None else dtd_map
+        self.hits = 0
+        self.misses = 0
+        self._parsed = {}
+        self._lock = threading.Lock()
+        self._validation_locks = {}
+
+    def __contains__(self, public_id):
+        return public_id in self.dtd_map
+
+    def info(self, public_id):
+        """
+        Returns the DTD_Tuple(path, name, version) for a public id.
+
+        Raises KeyError if the public id is not known.
+        """
+        return self.dtd_map[public_id]
+
+    def get(self, public_id):
+        """
+        Returns the parsed lxml.etree.DTD for a public id, parsing it only if
+        it has not been requested before.
+
+        Raises KeyError if the public id is not known.
+        """
+        with self._lock:
+            try:
+                dtd = self._parsed[public_id]
+            except KeyError:
+                dtd_info = self.dtd_map[public_id]
+                log.debug('Parsing DTD {0} {1} from {2}'.format(dtd_info.name,
+                                                               dtd_info.version,
+                                                               dtd_info.path))
+                dtd = etree.DTD(dtd_info.path)
+                self._parsed[public_id] = dtd
+                self.misses += 1
+            else:
+                self.hits += 1
+            return dtd
+
+    def validate(self, public_id, document):
+        """
+        Validates a parsed document against the DTD for a public id. Returns
+        whether it is valid, and a string of the validation errors.
+
+        A DTD keeps the errors of its last validation, so validations against
+        the same DTD are made one at a time to keep threads from reading each
+        other's errors.
+
+        Raises KeyError if the public id is not known.
+        """
+        dtd = self.get(public_id)
+        with self._lock:
+            lock = self._validation_locks.setdefault(public_id, threading.Lock())
+        with lock:
+            valid = dtd.validate(document)
+            errors = '' if valid else str(dtd.error_log.filter_from_errors())
+        return valid, errors
+
+    def preload(self, public_ids=None):
+        """
+        Parses the DTDs for the given public ids ahead of time, or all known
+        DTDs if no public ids are given. Useful for warming up worker processes.
+        """
+        if public_ids is None:
+            public_ids = list(self.dtd_map.keys())
+        for public_id in public_ids:
+            self.get(public_id)
+
+    def clear(self):
+        """
+        Discards all parsed DTDs and resets the counters.
+        """
+        with self._lock:
+            self._parsed = {}
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Returns a dictionary of the hit and miss counters, as well as the number
+        of DTDs currently parsed.
+        """
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'parsed': len(self._parsed)}
+
+
+#The registry shared by everything in this process
+registry = DTDRegistry()
+
+
+def get_dtd(public_id):
+    """
+    Returns the parsed DTD for a public id from the process-wide registry.
+    """
+    return registry.get(public_id)
+
+
+def validate(public_id, document):
+    """
+    Validates a document against the DTD for a public id from the process-wide
+    registry, see DTDRegistry.validate.
+    """
+    return registry.validate(public_id, document)
@@ -3,20 +3,49 @@
 Utilities related to the making and managing of EPUB files
 """
 #Standard Library modules
+import collections
+import concurrent.futures
+import contextlib
 import logging
 import os
-import zipfile
+import shutil
+import struct
+import threading
+import zlib
 
 #Non-Standard Library modules
 
 #OpenAccess_EPUB modules
 import openaccess_epub
+from openaccess_epub.utils.conversion_cache import get_conversion_cache,\
+    conversion_key
 from openaccess_epub.utils.css import DEFAULT_CSS
+from openaccess_epub.utils.settings import load_settings
+import openaccess_epub.utils.images
+from openaccess_epub.utils.image_store import clone_or_copy
+from openaccess_epub.utils import timing
 from openaccess_epub.navigation import Navigation
 from openaccess_epub.package import Package
 
 log = logging.getLogger('openaccess_epub.utils.epub')
 
+#The earliest date representable in a zip file, used for all entries, as the
+#MS-DOS date and time fields of the zip format
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+ZIP_DOS_DATE = ((ZIP_DATE_TIME[0] - 1980) << 9) | (ZIP_DATE_TIME[1] << 5) | ZIP_DATE_TIME[2]
+ZIP_DOS_TIME = (ZIP_DATE_TIME[3] << 11) | (ZIP_DATE_TIME[4] << 5) | (ZIP_DATE_TIME[5] // 2)
+
+#Entries in formats which are compressed already, deflate would only slow
+#the writing of them without making them smaller
+STORED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif')
+
+#Entries at least this many bytes long are deflated in the thread pool
+PARALLEL_DEFLATE_SIZE = 64 * 1024
+
+#The most entries held in memory while waiting to be deflated and written, so
+#that an EPUB of any size is written with bounded memory
+MAX_PENDING_ENTRIES = 64
+
 
 def make_EPUB(parsed_article,
               output_directory,
@@ -24,14 +53,19 @@ def make_EPUB(parsed_article,
               image_directory,
               config_module=None,
               epub_version=None,
-              batch=False):
+              batch=False,
+              keep_directory=False,
+              images=None,
+              xml_data=None,
+              replace=False):
     """
     Standard workflow for creating an EPUB document.
 
     make_EPUB is used to produce an EPUB file from a parsed article. In addition
     to the article it also requires a path to the appropriate image directory
     which it will insert into the EPUB file, as well the output directory
-    location for the EPUB file.
+    location for the EPUB file. The contents are written straight into the EPUB
+    file, no directory is created unless `keep_directory` is used.
 
     Parameters
     ----------
@@ -39,19 +73,19 @@ def make_EPUB(parsed_article,
         `article` is an Article instance for the XML document to be converted to
         EPUB.
     output_directory : str
-        `output_directory` is a string path to the directory in which the EPUB
-        will be produced. The name of the directory will be used as the EPUB's
-        filename.
+        `output_directory` is a string path naming the EPUB to be produced, the
+        EPUB file will be `output_directory` + '.epub'.
     input_path : str
         `input_path` is a string absolute path to the input XML file, used to
         locate input-relative images.
     image_directory : str
         `image_directory` is a string path indicating an explicit image
         directory. If supplied, other image input methods will not be used.
-    config_module : config module, optional
-        `config_module` is a pre-loaded config module for OpenAccess_EPUB; if
-        not used then this function will load the global config file. Might be
-        useful in certain cases to dynamically alter configuration.
+    config_module : openaccess_epub.utils.settings.settings, optional
+        `config_module` holds the settings resolved for OpenAccess_EPUB; if not
+        used then this function will resolve them from the global config file
+        and the environment. A modified copy, made with its _replace method,
+        may be passed to alter the configuration for one conversion.
     epub_version : {None, 2, 3}
         `epub_version` dictates which version of EPUB to be created. An error
         will be raised if the specified version is not supported for the
@@ -59,15 +93,38 @@ def make_EPUB(parsed_article,
         publisher default version.
     batch : bool, optional
         `batch` indicates that batch creation is being used (such as with the
-        `oaepub batch` command). In this case, directory conflicts will be
+        `oaepub batch` command). In this case, output conflicts will be
         automatically resolved (in favor of keeping previous data, skipping
         creation of EPUB).
+    keep_directory : bool, optional
+        If True, the contents of the EPUB are written to a directory at
+        `output_directory`, which is then zipped into the EPUB file and left in
+        place for inspection.
+    images : openaccess_epub.utils.images.located_images, optional
+        `images` are the images for the article when they come with the input,
+        as they do from an archive, so that they need not be located. If
+        supplied, `image_directory` is not used.
+    xml_data : bytes, optional
+        `xml_data` is the content of the input XML when it was not read from a
+        file at `input_path`, as for an article read from an archive. It is
+        used in the key for the conversion cache.
+    replace : bool, optional
+        If True, an existing EPUB file is not a batch output conflict, and is
+        replaced once the new EPUB is complete.
+
+    The EPUB is built under a temporary name beside its final one, and moved
+    into place only once it is complete, so a failed conversion neither leaves
+    a partial EPUB nor removes an existing one.
+
+    If the conversion cache is enabled in the config, an EPUB previously made
+    from identical inputs will be copied to the output as soon as the images
+    are located, instead of optimizing the images and rendering the article
+    again.
 
     Returns False in the case of a fatal error, True if successful.
     """
-    #command_log.info('Creating {0}.epub'.format(output_directory))
     if config_module is None:
-        config_module = openaccess_epub.utils.load_config_module()
+        config_module = load_settings()
 
     if epub_version not in (None, 2, 3):
         log.error('Invalid EPUB version: {0}'.format(epub_version))
@@ -76,116 +133,614 @@ def make_EPUB(parsed_article,
     if epub_version is None:
         epub_version = parsed_article.publisher.epub_default
 
-    #Handle directory output conflicts
-    if os.path.isdir(output_directory):
+    epub_filename = output_directory + '.epub'
+
+    #Handle output conflicts
+    if keep_directory and os.path.isdir(output_directory):
         if batch:  # No user prompt, default to protect previous data
             log.error('Directory conflict during batch conversion, skipping.')
             return False
         else:  # User prompting
             openaccess_epub.utils.dir_exists(output_directory)
-    else:
+    if batch and not replace and os.path.isfile(epub_filename):
+        log.error('EPUB conflict during batch conversion, skipping.')
+        return False
+    parent_directory = os.path.dirname(output_directory)
+    if parent_directory and not os.path.isdir(parent_directory):
         try:
-            os.makedirs(output_directory)
+            os.makedirs(parent_directory)
         except OSError as err:
             if err.errno != 17:
                 log.exception('Unable to recursively create output directories')
 
-    #Copy over the basic epub directory
-    make_epub_base(output_directory)
-
-    #Get the images, if possible, fail gracefully if not
-    success = openaccess_epub.utils.images.get_images(output_directory,
-                                                      image_directory,
-                                                      input_path,
-                                                      config_module,
-                                                      parsed_article)
-    if not success:
-        log.critical('Images for the article were not located! Aborting!')
-        return False
+    #Images from the image cache are read where they are stored, the lease on
+    #the article keeps them from being evicted until the EPUB is written
+    if images is None:
+        lease = openaccess_epub.utils.images.image_lease(config_module,
+                                                         parsed_article.doi)
+    else:
+        lease = contextlib.nullcontext()
+    with lease:
+        #Locate the images, if possible, fail gracefully if not
+        if images is None:
+            with timing.stage('images'):
+                images = openaccess_epub.utils.images.locate_images(image_directory,
+                                                                    input_path,
+                                                                    config_module,
+                                                                    parsed_article)
+        if images is None:
+            log.critical('Images for the article were not located! Aborting!')
+            return False
+
+        #Named by the process, which makes one EPUB at a time, and created as
+        #the EPUB itself would be so that it keeps the usual permissions
+        temp_filename = '{0}.{1}.tmp'.format(epub_filename, os.getpid())
+        try:
+            #Reuse a previously produced EPUB if none of the inputs have
+            #changed, before any work is done on the located images
+            conversion_cache = get_conversion_cache(config_module)
+            if conversion_cache is not None:
+                cache_key = conversion_key(input_path,
+                                           images.files,
+                                           config_module,
+                                           epub_version,
+                                           xml_data)
+                if conversion_cache.fetch(cache_key, temp_filename):
+                    os.replace(temp_filename, epub_filename)
+                    return True
+
+            with timing.stage('images'):
+                images = openaccess_epub.utils.images.optimize_images(images,
+                                                                      config_module)
+            #Missing or mismatched images fail here, before any rendering is
+            #done
+            if not openaccess_epub.utils.images.index_images(parsed_article,
+                                                             images,
+                                                             config_module):
+                return False
+
+            if keep_directory:
+                writer = DirectoryWriter(output_directory)
+            else:
+                writer = EPUBWriter(temp_filename,
+                                    **compression_options(config_module))
+
+            with writer:
+                write_EPUB(writer, parsed_article, images.files, epub_version)
+
+                #Finishing the deflation and the central directory
+                with timing.stage('zip'):
+                    writer.close()
+
+            #The kept directory still needs to be zipped into the EPUB
+            if keep_directory:
+                with timing.stage('zip'):
+                    epub_zip(output_directory,
+                             destination=temp_filename,
+                             **compression_options(config_module))
+
+            os.replace(temp_filename, epub_filename)
+        finally:
+            if images.temporary:
+                shutil.rmtree(images.path)
+            if os.path.isfile(temp_filename):
+                os.remove(temp_filename)
+
+    if conversion_cache is not None:
+        conversion_cache.store(cache_key, epub_filename)
+
+    return True
+
+
+def write_EPUB(writer, parsed_article, image_files, epub_version):
+    """
+    Writes the complete contents of the EPUB for an article with `writer`.
+
+    The images of the article must already be indexed, see
+    openaccess_epub.utils.images.index_images. Nothing is read or written
+    other than through `writer` and the image files, so this may be used by
+    several threads at once, each with its own writer and article.
+
+    Parameters
+    ----------
+    writer : EPUBWriter or DirectoryWriter
+        The writer for the EPUB being built, which is left open
+    parsed_article : openaccess_epub.article.Article instance
+        The article to be written
+    image_files : list
+        The image_files for the images of the article
+    epub_version : {2, 3}
+        The version of EPUB to be written
+    """
+    #Write the basic EPUB files, then the images
+    make_epub_base(writer)
+    with timing.stage('images'):
+        openaccess_epub.utils.images.copy_images(writer,
+                                                 image_files,
+                                                 parsed_article)
 
     #Instantiate Navigation and Package
     epub_nav = Navigation()
     epub_package = Package()
 
     #Process the article for navigation and package info
-    epub_nav.process(parsed_article)
-    epub_package.process(parsed_article)
+    with timing.stage('navigation'):
+        epub_nav.process(parsed_article)
+    with timing.stage('package'):
+        epub_package.process(parsed_article)
 
     #Render the content using publisher-specific methods
-    parsed_article.publisher.render_content(output_directory, epub_version)
+    with timing.stage('render'):
+        parsed_article.publisher.render_content(writer, epub_version)
     if epub_version == 2:
-        epub_nav.render_EPUB2(output_directory)
-        epub_package.render_EPUB2(output_directory)
+        with timing.stage('navigation'):
+            epub_nav.render_EPUB2(writer)
+        with timing.stage('package'):
+            epub_package.render_EPUB2(writer)
     elif epub_version == 3:
-        epub_nav.render_EPUB3(output_directory)
-        epub_package.render_EPUB3(output_directory)
-
-    #Zip the directory into EPUB
-    epub_zip(output_directory)
-
-    return True
+        with timing.stage('navigation'):
+            epub_nav.render_EPUB3(writer)
+        with timing.stage('package'):
+            epub_package.render_EPUB3(writer)
 
 
-def make_epub_base(location):
+def make_epub_base(writer):
     """
-    Creates the base structure for an EPUB file in a specified location.
+    Writes the base structure for an EPUB file.
 
-    This function creates constant components for the structure of the EPUB in
-    a specified directory location.
+    This function writes the constant components of an EPUB: the mimetype file,
+    which must come first, the container file, and the default CSS.
 
     Parameters
     ----------
-    location : str
-        A path string to a local directory in which the EPUB is to be built
+    writer : EPUBWriter or DirectoryWriter
+        The writer for the EPUB being built
     """
-    log.info('Making EPUB base files in {0}'.format(location))
-    with open(os.path.join(location, 'mimetype'), 'w') as out:  # mimetype file
-        out.write('application/epub+zip')
-
-    #Create EPUB and META-INF directorys
-    os.mkdir(os.path.join(location, 'META-INF'))
-    os.mkdir(os.path.join(location, 'EPUB'))
-    os.mkdir(os.path.join(location, 'EPUB', 'css'))
-
-    with open(os.path.join(location, 'META-INF', 'container.xml'), 'w') as out:
-        out.write('''\
+    log.info('Making EPUB base files in {0}'.format(writer.location))
+    writer.write('mimetype', 'application/epub+zip')
+    writer.write('META-INF/container.xml', '''\
 <?xml version="1.0" encoding="UTF-8"?>
 <container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
    <rootfiles>
       <rootfile full-path="EPUB/package.opf" media-type="application/oebps-package+xml"/>
    </rootfiles>
 </container>''')
+    writer.write('EPUB/css/default.css', DEFAULT_CSS)
+
+
+class ZipWriter(object):
+    """
+    Writes a zip file, entry by entry in the order given, from data which is
+    either stored or has already been deflated.
+
+    zipfile.ZipFile compresses each entry itself as it is written, and offers
+    no means of adding data compressed elsewhere, so it cannot write entries
+    deflated in parallel. This writer follows the zip file format
+    specification (PKWARE APPNOTE.TXT) and nothing else: a local header before
+    the data of each entry, then the central directory and its end record.
+    ZIP64 records are used only when there are too many entries, or sizes or
+    offsets too large, for the original format.
+
+    Parameters
+    ----------
+    fileobj : file object
+        A binary file object to write the zip file to, from its current
+        position
+    """
+    #Signatures of the records
+    LOCAL_HEADER = 0x04034b50
+    CENTRAL_HEADER = 0x02014b50
+    END_RECORD = 0x06054b50
+    ZIP64_END_RECORD = 0x06064b50
+    ZIP64_END_LOCATOR = 0x07064b50
+
+    STORED = 0
+    DEFLATED = 8
+
+    #Made by version 2.0 on Unix, so that the external attributes are
+    #read as Unix permissions; version 4.5 is needed for ZIP64
+    MADE_BY = (3 << 8) | 20
+    VERSION = 20
+    ZIP64_VERSION = 45
+
+    #The largest values the original fields hold
+    MAX_32 = 0xffffffff
+    MAX_16 = 0xffff
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.entries = []
+
+    def add(self, name, data, compressed=None, external_attr=0o644 << 16):
+        """
+        Writes an entry for the file `name`, whose content is `data`. If
+        `compressed` is given it is the raw deflate stream of `data`, as made by
+        deflate_entry, and its CRC-32, otherwise the data is stored.
+        """
+        filename = name.encode('utf-8')
+        #Bit 11 marks a UTF-8 name, ASCII names are left unmarked
+        flags = 0 if filename.decode('ascii', 'replace') == name else 0x800
+        if compressed is None:
+            method, crc, payload = self.STORED, zlib.crc32(data), data
+        else:
+            method, (crc, payload) = self.DEFLATED, compressed
+        offset = self.fileobj.tell()
+        size, compress_size = len(data), len(payload)
+        if size >= self.MAX_32 or compress_size >= self.MAX_32:
+            extra = struct.pack('<HHQQ', 0x0001, 16, size, compress_size)
+            header_sizes = (self.MAX_32, self.MAX_32)
+            version = self.ZIP64_VERSION
+        else:
+            extra = b''
+            header_sizes = (size, compress_size)
+            version = self.VERSION
+        self.fileobj.write(struct.pack('<IHHHHHIIIHH',
+                                       self.LOCAL_HEADER,
+                                       version,
+                                       flags,
+                                       method,
+                                       ZIP_DOS_TIME,
+                                       ZIP_DOS_DATE,
+                                       crc & self.MAX_32,
+                                       header_sizes[1],
+                                       header_sizes[0],
+                                       len(filename),
+                                       len(extra)))
+        self.fileobj.write(filename)
+        self.fileobj.write(extra)
+        self.fileobj.write(payload)
+        self.entries.append((filename, flags, method, crc & self.MAX_32, size,
+                             compress_size, offset, external_attr))
+
+    def close(self):
+        """
+        Writes the central directory and its end record. The file object is
+        not closed.
+        """
+        start = self.fileobj.tell()
+        for filename, flags, method, crc, size, compress_size, offset, attr in self.entries:
+            #Only the values too large for their fields go in the ZIP64 extra
+            #field, in this order
+            large = [value for value in (size, compress_size, offset)
+                     if value >= self.MAX_32]
+            if large:
+                extra = struct.pack('<HH', 0x0001, 8 * len(large))
+                extra += struct.pack('<{0}Q'.format(len(large)), *large)
+                version = self.ZIP64_VERSION
+            else:
+                extra = b''
+                version = self.VERSION
+            self.fileobj.write(struct.pack('<IHHHHHHIIIHHHHHII',
+                                           self.CENTRAL_HEADER,
+                                           self.MADE_BY,
+                                           version,
+                                           flags,
+                                           method,
+                                           ZIP_DOS_TIME,
+                                           ZIP_DOS_DATE,
+                                           crc,
+                                           min(compress_size, self.MAX_32),
+                                           min(size, self.MAX_32),
+                                           len(filename),
+                                           len(extra),
+                                           0,  # Comment length
+                                           0,  # Disk number
+                                           0,  # Internal attributes
+                                           attr,
+                                           min(offset, self.MAX_32)))
+            self.fileobj.write(filename)
+            self.fileobj.write(extra)
+        end = self.fileobj.tell()
+        count, directory_size = len(self.entries), end - start
+        if count >= self.MAX_16 or directory_size >= self.MAX_32 or start >= self.MAX_32:
+            self.fileobj.write(struct.pack('<IQHHIIQQQQ',
+                                           self.ZIP64_END_RECORD,
+                                           44,  # Size of the rest of the record
+                                           self.MADE_BY,
+                                           self.ZIP64_VERSION,
+                                           0,
+                                           0,
+                                           count,
+                                           count,
+                                           directory_size,
+                                           start))
+            self.fileobj.write(struct.pack('<IIQI', self.ZIP64_END_LOCATOR, 0, end, 1))
+        self.fileobj.write(struct.pack('<IHHHHIIH',
+                                       self.END_RECORD,
+                                       0,
+                                       0,
+                                       min(count, self.MAX_16),
+                                       min(count, self.MAX_16),
+                                       min(directory_size, self.MAX_32),
+                                       min(start, self.MAX_32),
+                                       0))
+        self.fileobj.flush()
+
+
+def deflate_entry(data, level):
+    """
+    Returns the CRC-32 of `data` and its raw deflate stream, as stored in zip
+    files. zlib releases the GIL while it works, so this runs in parallel in
+    the threads of deflate_pool.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return zlib.crc32(data), compressor.compress(data) + compressor.flush()
+
+
+_deflate_pool = None
+_deflate_pool_lock = threading.Lock()
+
+
+def deflate_pool():
+    """
+    Returns the thread pool used for compressing large entries, shared by all
+    EPUBWriters in the process.
+    """
+    global _deflate_pool
+    with _deflate_pool_lock:
+        if _deflate_pool is None:
+            workers = os.cpu_count() or 1
+            _deflate_pool = concurrent.futures.ThreadPoolExecutor(workers)
+        return _deflate_pool
+
+
+class EPUBWriter(object):
+    """
+    Writes the files of an EPUB straight into a new EPUB (zip) file.
+
+    Each file is added to the zip file as soon as it is written, so the EPUB is
+    built without any intermediate directory. Entries are given a fixed
+    timestamp, so that identical content produces a byte-identical EPUB. The
+    mimetype file should be the first file written, it is always stored
+    uncompressed as the OCF specification requires.
+
+    With deflate compression, entries of at least `PARALLEL_DEFLATE_SIZE` bytes
+    are compressed by a pool of threads while rendering continues, and written
+    by a ZipWriter in the order they were given. An entry which deflate does not
+    make smaller is stored instead, and those whose names end with one of the
+    `STORED_EXTENSIONS`, such as PNG and JPEG images, are stored without trying.
+    No more than `MAX_PENDING_ENTRIES` entries wait in memory to be written.
+
+    Used as a context manager, the EPUB file is closed on success and removed
+    if an exception is raised, so that no partial EPUB is left behind.
+
+    Parameters
+    ----------
+    location : str or file object
+        The path of the EPUB file to create, or a seekable binary file object
+        to write the EPUB to, which is left open
+    compression : {'stored', 'deflated'}, optional
+        How the entries other than mimetype are to be compressed.
+    compresslevel : int, optional
+        The zlib compression level, from 0 to 9, used for deflated entries.
+    """
+    def __init__(self, location, compression='stored', compresslevel=6):
+        if compression not in ('stored', 'deflated'):
+            raise ValueError('compression should be \'stored\' or \'deflated\'')
+        if not 0 <= compresslevel <= 9:
+            raise ValueError('compresslevel should be from 0 to 9')
+        self.location = location
+        self.compression = compression
+        self.compresslevel = compresslevel
+        if isinstance(location, str):
+            self._file = open(location, 'wb')
+        else:
+            self._file = None
+        self.zipfile = ZipWriter(self._file or location)
+        self._names = []
+        self._pending = collections.deque()
+
+    def write(self, name, data):
+        """
+        Writes `data`, bytes or str (encoded as UTF-8), to the file `name`,
+        given as a '/'-separated path relative to the root of the EPUB.
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if name in self._names:
+            raise ValueError('Duplicate name in EPUB: {0}'.format(name))
+        self._names.append(name)
+        if name == 'mimetype' or self.compression == 'stored' or \
+                name.lower().endswith(STORED_EXTENSIONS):
+            self._pending.append((name, data, None))
+        elif len(data) >= PARALLEL_DEFLATE_SIZE:
+            future = deflate_pool().submit(deflate_entry, data, self.compresslevel)
+            self._pending.append((name, data, future))
+        else:
+            self._pending.append((name, data, deflate_entry(data, self.compresslevel)))
+        self._flush()
+        while len(self._pending) > MAX_PENDING_ENTRIES:
+            self._flush_first()
+
+    def _flush_first(self):
+        """
+        Waits for the entry at the front of the queue to be compressed, then
+        writes it and any after it which are ready.
+        """
+        name, data, compressed = self._pending[0]
+        if isinstance(compressed, concurrent.futures.Future):
+            compressed.result()
+        self._flush()
+
+    def _flush(self, wait=False):
+        """
+        Writes the entries waiting at the front of the queue, in order,
+        stopping at the first one still being compressed unless `wait`.
+        """
+        while self._pending:
+            name, data, compressed = self._pending[0]
+            if isinstance(compressed, concurrent.futures.Future):
+                if not wait and not compressed.done():
+                    return
+                compressed = compressed.result()
+            self._pending.popleft()
+            if compressed is not None and len(compressed[1]) >= len(data):
+                compressed = None  # Deflate did not help, store it
+            self.zipfile.add(name, data, compressed)
+
+    def copy_file(self, name, path):
+        """
+        Writes the contents of the local file at `path` to the file `name`.
+        """
+        with open(path, 'rb') as inp:
+            self.write(name, inp.read())
+
+    def namelist(self):
+        """
+        Returns a list of the names of all files written so far, in order.
+        """
+        return list(self._names)
+
+    def close(self):
+        if self.zipfile is None:
+            return
+        self._flush(wait=True)
+        self.zipfile.close()
+        self.zipfile = None
+        if self._file is not None:
+            self._file.close()
+
+    def abort(self):
+        """
+        Closes and removes the incomplete EPUB file.
+        """
+        for name, data, compressed in self._pending:
+            if isinstance(compressed, concurrent.futures.Future):
+                compressed.cancel()
+        self._pending.clear()
+        self.zipfile = None
+        if self._file is not None:
+            self._file.close()
+            os.remove(self.location)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
 
-    with open(os.path.join(location, 'EPUB', 'css', 'default.css') ,'wb') as out:
-        out.write(bytes(DEFAULT_CSS, 'UTF-8'))
+def compression_options(config_module):
+    """
+    Returns a dictionary of the EPUBWriter compression keyword arguments set
+    by the config module.
+    """
+    return {'compression': getattr(config_module, 'epub_compression', 'deflated'),
+            'compresslevel': getattr(config_module, 'epub_compression_level', 6)}
 
 
-def epub_zip(outdirect):
+class DirectoryWriter(object):
     """
-    Zips up the input file directory into an EPUB file.
+    Writes the files of an EPUB into a directory tree, offering the same
+    interface as EPUBWriter. This is used when the contents of the EPUB should
+    be kept for inspection, the directory may then be zipped with epub_zip.
+    Copied files, such as images, are never linked to their sources, so the
+    kept directory may be edited safely.
+
+    Parameters
+    ----------
+    location : str
+        The path of the directory, created if it does not exist
     """
+    def __init__(self, location):
+        self.location = location
+        self._names = []
+        if not os.path.isdir(location):
+            os.makedirs(location)
+
+    def _local_path(self, name):
+        path = os.path.join(self.location, *name.split('/'))
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        return path
 
-    def recursive_zip(zipf, directory, folder=None):
-        if folder is None:
-            folder = ''
-        for item in os.listdir(directory):
-            if os.path.isfile(os.path.join(directory, item)):
-                zipf.write(os.path.join(directory, item),
-                           os.path.join(directory, item))
-            elif os.path.isdir(os.path.join(directory, item)):
-                recursive_zip(zipf, os.path.join(directory, item),
-                              os.path.join(folder, item))
+    def write(self, name, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with open(self._local_path(name), 'wb') as out:
+            out.write(data)
+        self._names.append(name)
 
+    def copy_file(self, name, path):
+        clone_or_copy(path, self._local_path(name))
+        self._names.append(name)
+
+    def namelist(self):
+        return list(self._names)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class BufferWriter(object):
+    """
+    Holds the files written for an EPUB in memory, in the order they were
+    written, offering the same interface as EPUBWriter. This is used to render
+    part of an EPUB in another process; the files are then passed back and
+    written in order to the real writer with write_to.
+    """
+    def __init__(self):
+        self.location = None
+        self.entries = []
+
+    def write(self, name, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.entries.append((name, data))
+
+    def copy_file(self, name, path):
+        with open(path, 'rb') as inp:
+            self.write(name, inp.read())
+
+    def namelist(self):
+        return [name for name, data in self.entries]
+
+    def write_to(self, writer):
+        """
+        Writes the held files, in order, with `writer`.
+        """
+        for name, data in self.entries:
+            writer.write(name, data)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def epub_zip(outdirect, compression='stored', compresslevel=6, destination=None):
+    """
+    Zips up the input file directory into an EPUB file, by default the
+    directory name with '.epub' added, otherwise `destination`.
+
+    The mimetype file is written first, followed by all other files in sorted
+    order. See EPUBWriter for the compression options.
+    """
     log.info('Zipping up the directory {0}'.format(outdirect))
-    epub_filename = outdirect + '.epub'
-    epub = zipfile.ZipFile(epub_filename, 'w')
-    current_dir = os.getcwd()
-    os.chdir(outdirect)
-    epub.write('mimetype')
-    log.info('Recursively zipping META-INF and EPUB')
-    for item in os.listdir('.'):
-        if item == 'mimetype':
-            continue
-        recursive_zip(epub, item)
-    os.chdir(current_dir)
-    epub.close()
\ No newline at end of file
+    if destination is None:
+        destination = outdirect + '.epub'
+    with EPUBWriter(destination, compression, compresslevel) as epub:
+        epub.copy_file('mimetype', os.path.join(outdirect, 'mimetype'))
+        log.info('Recursively zipping META-INF and EPUB')
+        for root, dirs, files in os.walk(outdirect):
+            dirs.sort()
+            for filename in sorted(files):
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, outdirect).replace(os.sep, '/')
+                if name == 'mimetype':
+                    continue
+                epub.copy_file(name, path)
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Running epubcheck alongside conversion, with structured results.
+
+epubcheck is a Java program, and starting the JVM and loading its schemas
+takes far longer than checking a typical article. The stock epubcheck command
+line checks one EPUB per invocation, so the EpubcheckRunner instead keeps an
+EpubcheckServer running for each of its background threads: a small Java
+program, shipped in data/epubcheck, which uses the epubcheck API to check EPUB
+after EPUB in a single JVM. Conversion carries on while the checks run. The
+server needs the single-file source launcher of Java 11 or later; with older
+Java, epubcheck is run once per EPUB instead. The output of each check is parsed
+into an epubcheck_result with a list of epubcheck_messages.
+"""
+
+#Standard Library modules
+from collections import namedtuple
+import concurrent.futures
+import logging
+import re
+import subprocess
+import threading
+import time
+import uuid
+
+#Non-Standard Library modules
+
+#OpenAccess_EPUB modules
+from openaccess_epub import get_data_path
+
+log = logging.getLogger('openaccess_epub.utils.epubcheck_runner')
+
+epubcheck_message = namedtuple('epubcheck_message', 'severity, id, location, text')
+epubcheck_result = namedtuple('epubcheck_result', 'epub, passed, messages, elapsed')
+
+#Matches the message lines of epubcheck 3 and 4, such as:
+#ERROR: article.epub/EPUB/main.xhtml(10,5): element "foo" not allowed here
+#WARNING(RSC-017): article.epub/EPUB/package.opf(2,3): some warning
+MESSAGE_LINE = re.compile(r'(?P<severity>FATAL|ERROR|WARNING|USAGE|INFO|HINT)'
+                          r'(?:\((?P<id>[^)]*)\))?: (?P<rest>.*)')
+
+#Severities which mean that the EPUB did not pass
+FAILING_SEVERITIES = ('FATAL', 'ERROR')
+
+#The Java source of the EpubcheckServer
+SERVER_SOURCE = get_data_path('epubcheck/EpubcheckServer.java')
+
+
+class EpubcheckServerError(Exception):
+    """
+    Raised when an EpubcheckServer stops without finishing a check. `output`
+    is what it printed for that check.
+    """
+    def __init__(self, message, output=''):
+        super(EpubcheckServerError, self).__init__(message)
+        self.output = output
+
+
+def parse_output(epubname, output):
+    """
+    Parses the text output of epubcheck for `epubname` into a list of
+    epubcheck_message(severity, id, location, text). The id is None for
+    versions of epubcheck which do not give message ids, and the location is
+    None for messages about the EPUB as a whole.
+    """
+    messages = []
+    for line in output.splitlines():
+        match = MESSAGE_LINE.match(line.strip())
+        if match is None:
+            continue
+        rest = match.group('rest')
+        location = None
+        #The location starts with the name of the EPUB, which may itself hold
+        #': ' (such as a Windows drive), so look for the separator after it
+        if rest.startswith(epubname):
+            end = rest.find(': ', len(epubname))
+            if end != -1:
+                location, rest = rest[:end], rest[end + 2:]
+        messages.append(epubcheck_message(match.group('severity'),
+                                          match.group('id'),
+                                          location,
+                                          rest))
+    return messages
+
+
+def run_epubcheck(epubname, jarfile, java='java'):
+    """
+    Runs epubcheck on a single EPUB file and returns an
+    epubcheck_result(epub, passed, messages, elapsed).
+
+    The EPUB passes if epubcheck exits successfully and reports no errors. If
+    epubcheck could not be run at all, the EPUB fails with a single FATAL
+    message explaining why.
+    """
+    start = time.time()
+    try:
+        process = subprocess.Popen([java, '-jar', jarfile, epubname],
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+    except OSError as err:
+        message = epubcheck_message('FATAL', None, None,
+                                    'Unable to run epubcheck: {0}'.format(err))
+        return epubcheck_result(epubname, False, [message], time.time() - start)
+    output = process.communicate()[0].decode('utf-8', 'replace')
+    messages = parse_output(epubname, output)
+    passed = process.returncode == 0 and \
+        not any(m.severity in FAILING_SEVERITIES for m in messages)
+    if process.returncode != 0 and not messages:
+        #Keep whatever epubcheck said, it did not look like a message
+        messages.append(epubcheck_message('FATAL', None, None, output.strip()))
+    return epubcheck_result(epubname, passed, messages, time.time() - start)
+
+
+class EpubcheckServer(object):
+    """
+    One JVM running the EpubcheckServer Java program, which checks the EPUBs
+    given to it one after another. It is used by one thread at a time.
+
+    Parameters
+    ----------
+    jarfile : str
+        The path to the epubcheck .jar file
+    java : str, optional
+        The java executable
+    """
+    def __init__(self, jarfile, java='java'):
+        #Marks the end of the output for each EPUB, it cannot be mistaken for
+        #a message
+        self.end_token = 'END-{0}'.format(uuid.uuid4().hex)
+        self.checked = 0
+        self.process = subprocess.Popen([java, '-cp', jarfile, SERVER_SOURCE,
+                                         self.end_token],
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT)
+
+    def check(self, epubname):
+        """
+        Checks an EPUB file and returns an epubcheck_result(epub, passed,
+        messages, elapsed). Raises EpubcheckServerError if the server stops
+        before it is done.
+        """
+        start = time.time()
+        lines = []
+        status = None
+        try:
+            self.process.stdin.write(epubname.encode('utf-8') + b'\n')
+            self.process.stdin.flush()
+            for line in self.process.stdout:
+                line = line.decode('utf-8', 'replace').rstrip('\r\n')
+                if line.startswith(self.end_token + ' '):
+                    status = line[len(self.end_token) + 1:]
+                    break
+                lines.append(line)
+        except OSError:
+            pass
+        output = '\n'.join(lines)
+        if status is None:
+            raise EpubcheckServerError('epubcheck server stopped', output)
+        self.checked += 1
+        messages = parse_output(epubname, output)
+        passed = status == 'DONE' and \
+            not any(m.severity in FAILING_SEVERITIES for m in messages)
+        return epubcheck_result(epubname, passed, messages, time.time() - start)
+
+    def close(self):
+        """
+        Stops the server once it has finished any check in progress.
+        """
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        self.process.wait()
+        self.process.stdout.close()
+
+
+class EpubcheckRunner(object):
+    """
+    Runs epubcheck on EPUB files in background threads.
+
+    Each call to `submit` queues an EPUB and returns immediately with a
+    concurrent.futures.Future for its epubcheck_result, so that conversion can
+    continue while epubcheck runs. Each thread checks its EPUBs with an
+    EpubcheckServer of its own, started for its first EPUB and kept until the
+    runner is closed, so that the JVM is started once per thread rather than
+    once per EPUB. If the server cannot be started, as with Java older than 11,
+    epubcheck is run once per EPUB instead. Used as a context manager, leaving
+    the block waits for all of the submitted checks to finish.
+
+    Parameters
+    ----------
+    jarfile : str
+        The path to the epubcheck .jar file
+    workers : int, optional
+        The number of epubcheck processes that may run at the same time
+    java : str, optional
+        The java executable
+    """
+    def __init__(self, jarfile, workers=1, java='java'):
+        self.jarfile = jarfile
+        self.java = java
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers)
+        self.use_server = True
+        self._local = threading.local()
+        self._servers = []
+        self._lock = threading.Lock()
+
+    def submit(self, epubname):
+        log.info('Queueing {0} for epubcheck'.format(epubname))
+        return self.executor.submit(self.check, epubname)
+
+    def check(self, epubname):
+        """
+        Checks an EPUB file with the server of the calling thread, falling
+        back to running epubcheck for it alone. Returns an epubcheck_result.
+        """
+        if not self.use_server or '\n' in epubname:
+            return run_epubcheck(epubname, self.jarfile, self.java)
+        server = getattr(self._local, 'server', None)
+        try:
+            if server is None:
+                server = EpubcheckServer(self.jarfile, self.java)
+                self._local.server = server
+                with self._lock:
+                    self._servers.append(server)
+            return server.check(epubname)
+        except (OSError, EpubcheckServerError) as err:
+            self._local.server = None
+            if server is not None:
+                server.close()
+            if server is None or not server.checked:
+                #It never worked, so it will not, such as with older Java
+                log.warning('Unable to start the epubcheck server, running epubcheck once per EPUB: {0} {1}'.format(err, getattr(err, 'output', '')))
+                self.use_server = False
+            else:
+                log.warning('epubcheck server stopped while checking {0}, starting another'.format(epubname))
+            return run_epubcheck(epubname, self.jarfile, self.java)
+
+    def close(self, wait=True):
+        self.executor.shutdown(wait=wait)
+        with self._lock:
+            servers, self._servers = self._servers, []
+        for server in servers:
+            server.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
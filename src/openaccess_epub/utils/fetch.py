@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent downloading of files over HTTP.
+
+The Fetcher downloads many files at once with a bounded pool of threads. It
+keeps the connections to each host open between requests, limits how many
+connections and how many requests per second go to each host, retries failed
+requests with exponential backoff, and writes each downloaded file atomically
+so that a failed or interrupted download never leaves a partial file behind.
+
+Only the standard library is used: connections are http.client connections,
+kept alive and reused for as long as the server allows.
+"""
+
+#Standard Library modules
+from collections import namedtuple
+import concurrent.futures
+import http.client
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib.parse
+
+#Non-Standard Library modules
+
+#OpenAccess_EPUB modules
+
+log = logging.getLogger('openaccess_epub.utils.fetch')
+
+fetch_result = namedtuple('fetch_result', 'url, path, ok, status, attempts, error')
+
+#Responses which are worth trying again after a wait
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+
+
+class FetchError(Exception):
+    """
+    Raised when a URL could not be downloaded. `status` is the HTTP status of
+    the last response, or None if there was no response.
+    """
+    def __init__(self, message, status=None, retry_after=None):
+        super(FetchError, self).__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class HostLimiter(object):
+    """
+    Limits the connections to a single host, both in number at once and in
+    requests started per second, and keeps idle connections for reuse.
+    """
+    def __init__(self, scheme, netloc, connections, rate, timeout):
+        self.scheme = scheme
+        self.netloc = netloc
+        self.timeout = timeout
+        self.interval = 1.0 / rate if rate else 0
+        self.slots = threading.BoundedSemaphore(connections)
+        self.idle = []
+        self.lock = threading.Lock()
+        self.next_start = 0
+
+    def wait_turn(self):
+        """
+        Sleeps until this host may be sent another request.
+        """
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+    def connection(self, reuse=True):
+        """
+        Returns a connection to the host and whether it is an idle one being
+        reused, rather than a new one.
+        """
+        if reuse:
+            with self.lock:
+                if self.idle:
+                    return self.idle.pop(), True
+        if self.scheme == 'https':
+            connection = http.client.HTTPSConnection(self.netloc,
+                                                     timeout=self.timeout)
+        else:
+            connection = http.client.HTTPConnection(self.netloc,
+                                                    timeout=self.timeout)
+        return connection, False
+
+    def release(self, connection):
+        with self.lock:
+            self.idle.append(connection)
+
+    def close(self):
+        with self.lock:
+            for connection in self.idle:
+                connection.close()
+            self.idle = []
+
+
+class Fetcher(object):
+    """
+    Downloads files over HTTP, concurrently and with retries.
+
+    Parameters
+    ----------
+    workers : int, optional
+        The number of downloads in progress at once, across all hosts
+    connections_per_host : int, optional
+        The number of connections open to any one host at once
+    rate : float, optional
+        The number of requests per second started to any one host, 0 or None
+        for no limit
+    retries : int, optional
+        The number of times a failed request is tried again
+    backoff : float, optional
+        The wait in seconds before the first retry, each retry waits about
+        twice as long as the one before
+    max_backoff : float, optional
+        The longest wait between retries
+    timeout : float, optional
+        The socket timeout in seconds
+    """
+    user_agent = 'OpenAccess_EPUB'
+
+    def __init__(self, workers=8, connections_per_host=4, rate=None, retries=4,
+                 backoff=0.5, max_backoff=30, timeout=30):
+        self.workers = workers
+        self.connections_per_host = connections_per_host
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def host(self, scheme, netloc):
+        with self._lock:
+            try:
+                return self._hosts[(scheme, netloc)]
+            except KeyError:
+                limiter = HostLimiter(scheme, netloc, self.connections_per_host,
+                                      self.rate, self.timeout)
+                self._hosts[(scheme, netloc)] = limiter
+                return limiter
+
+    def exchange(self, connection, path):
+        """
+        Sends a GET request on the connection and returns the response along
+        with its body, which must be read before the connection is reused.
+        """
+        connection.request('GET', path, headers={'User-Agent': self.user_agent})
+        response = connection.getresponse()
+        return response, response.read()
+
+    def request(self, url):
+        """
+        Makes a single GET request, following redirects, and returns the body
+        of the response. Raises FetchError on failure.
+        """
+        for redirect in range(MAX_REDIRECTS + 1):
+            parts = urllib.parse.urlsplit(url)
+            if parts.scheme not in ('http', 'https'):
+                raise FetchError('Unsupported URL scheme: {0}'.format(url))
+            path = urllib.parse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+            limiter = self.host(parts.scheme, parts.netloc)
+            with limiter.slots:
+                limiter.wait_turn()
+                connection, reused = limiter.connection()
+                try:
+                    response, body = self.exchange(connection, path)
+                except (OSError, http.client.HTTPException) as err:
+                    connection.close()
+                    if not reused:
+                        raise FetchError('{0}: {1}'.format(type(err).__name__, err))
+                    #The server may have closed the idle connection, which is
+                    #not a failure of the request, so try a new connection
+                    connection, reused = limiter.connection(reuse=False)
+                    try:
+                        response, body = self.exchange(connection, path)
+                    except (OSError, http.client.HTTPException) as err:
+                        connection.close()
+                        raise FetchError('{0}: {1}'.format(type(err).__name__, err))
+                if response.will_close:
+                    connection.close()
+                else:
+                    limiter.release(connection)
+            if response.status in REDIRECT_STATUSES and response.getheader('Location'):
+                url = urllib.parse.urljoin(url, response.getheader('Location'))
+                continue
+            if response.status != 200:
+                raise FetchError('HTTP {0} for {1}'.format(response.status, url),
+                                 response.status,
+                                 response.getheader('Retry-After'))
+            return body
+        raise FetchError('Too many redirects for {0}'.format(url))
+
+    def delay(self, attempt, retry_after=None):
+        """
+        Returns the wait before retry number `attempt` (counting from 1),
+        honoring a numeric Retry-After header if the server sent one.
+        """
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        delay = min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+        #Jitter keeps many workers from retrying in lockstep
+        return delay * random.uniform(0.5, 1.0)
+
+    def fetch(self, url):
+        """
+        Downloads a URL, retrying transient failures. Returns the body and the
+        number of attempts made. Raises FetchError if every attempt fails.
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return self.request(url), attempt
+            except FetchError as err:
+                retryable = err.status is None or err.status in RETRY_STATUSES
+                if not retryable or attempt > self.retries:
+                    err.attempts = attempt
+                    raise
+                wait = self.delay(attempt, err.retry_after)
+                log.debug('{0}, retrying in {1:.2f} seconds'.format(err, wait))
+                time.sleep(wait)
+
+    def fetch_to(self, url, path):
+        """
+        Downloads a URL to a file, which only appears at `path` once it is
+        complete. Returns a fetch_result(url, path, ok, status, attempts, error).
+        """
+        try:
+            data, attempts = self.fetch(url)
+        except FetchError as err:
+            log.error('Unable to download {0}: {1}'.format(url, err))
+            return fetch_result(url, path, False, err.status,
+                                getattr(err, 'attempts', 1), str(err))
+        directory = os.path.dirname(path) or '.'
+        temp_path = None
+        try:
+            handle, temp_path = tempfile.mkstemp(suffix='.part', dir=directory)
+            with os.fdopen(handle, 'wb') as output:
+                output.write(data)
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        except OSError as err:
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+            log.error('Unable to write {0}: {1}'.format(path, err))
+            return fetch_result(url, path, False, 200, attempts, str(err))
+        log.info('Downloaded {0}'.format(os.path.basename(path)))
+        return fetch_result(url, path, True, 200, attempts, None)
+
+    def fetch_all(self, downloads):
+        """
+        Downloads each (url, path) pair of `downloads` concurrently. Returns a
+        list of fetch_results in the same order.
+        """
+        downloads = list(downloads)
+        if not downloads:
+            return []
+        workers = min(self.workers, len(downloads))
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            futures = [executor.submit(self.fetch_to, url, path)
+                       for url, path in downloads]
+            return [future.result() for future in futures]
+
+    def close(self):
+        """
+        Closes the idle connections kept for reuse.
+        """
+        with self._lock:
+            for limiter in self._hosts.values():
+                limiter.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+_fetchers = {}
+
+
+def get_fetcher(config_module):
+    """
+    Returns a Fetcher configured by the config module, shared for the life of
+    the process so that connections are reused between articles.
+    """
+    options = (getattr(config_module, 'image_fetch_workers', 8),
+               getattr(config_module, 'image_fetch_rate', 4),
+               getattr(config_module, 'image_fetch_retries', 4))
+    try:
+        return _fetchers[options]
+    except KeyError:
+        workers, rate, retries = options
+        fetcher = Fetcher(workers=workers, rate=rate, retries=retries)
+        _fetchers[options] = fetcher
+        return fetcher
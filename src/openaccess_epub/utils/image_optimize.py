@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+Optional optimization of article images before they are put into the EPUB.
+
+Figures are often supplied as very large TIFFs, which EPUB readers do not
+support, or as PNGs which were never compressed well. When enabled in the
+config, each located image is transcoded and downscaled as needed by a pool of
+worker processes:
+
+  * TIFF images are converted to PNG or JPEG
+  * Images larger than the maximum dimension are scaled down to fit it
+  * PNG images are recompressed losslessly, kept only if smaller
+
+Results are kept in a cache keyed by the hash of the source image and the
+optimization settings, so building the same EPUB again does no image work at
+all. Optimization requires the Pillow package; without it, the images are used
+as they are.
+"""
+
+#Standard Library modules
+from collections import namedtuple
+import concurrent.futures
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import tempfile
+
+#Non-Standard Library modules
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional
+    Image = None
+
+#OpenAccess_EPUB modules
+import openaccess_epub.utils
+from openaccess_epub.utils.image_store import image_file, file_digest
+
+log = logging.getLogger('openaccess_epub.utils.image_optimize')
+
+optimize_options = namedtuple('optimize_options', 'max_dimension, tiff_format, jpeg_quality')
+
+#File extensions for the formats which optimization produces
+EXTENSIONS = {'png': '.png', 'jpeg': '.jpg'}
+
+#Names Pillow uses for the formats
+PIL_FORMATS = {'png': 'PNG', 'jpeg': 'JPEG'}
+
+#Marks a cached result where the source image was best left as it is
+UNCHANGED = '.unchanged'
+
+
+def get_options(config_module):
+    """
+    Returns the optimize_options set by the config module, or None if image
+    optimization is not enabled.
+    """
+    if not getattr(config_module, 'optimize_images', False):
+        return None
+    return optimize_options(getattr(config_module, 'image_max_dimension', 2048),
+                            getattr(config_module, 'tiff_conversion', 'png'),
+                            getattr(config_module, 'jpeg_quality', 85))
+
+
+def optimize_file(source, destination, source_format, options):
+    """
+    Optimizes a single image, run in a worker process. `source` is the path
+    of the image, or its content as bytes. The result is written to
+    `destination` plus the extension of its format.
+
+    Returns the format written, or None if the source image is best used as
+    it is, in which case nothing is written.
+    """
+    if isinstance(source, bytes):
+        source_size = len(source)
+        source = io.BytesIO(source)
+    else:
+        source_size = os.path.getsize(source)
+    with Image.open(source) as image:
+        target_format = options.tiff_format if source_format == 'tiff' else source_format
+        if target_format not in EXTENSIONS:  # GIF images are left alone
+            return None
+        resize = options.max_dimension and max(image.size) > options.max_dimension
+        if target_format == source_format and not resize and source_format != 'png':
+            return None
+        image.load()
+        if resize:
+            image.thumbnail((options.max_dimension, options.max_dimension),
+                            Image.LANCZOS)
+        if target_format == 'jpeg' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        elif target_format == 'png' and image.mode not in ('1', 'L', 'LA', 'P', 'RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.mode else 'RGB')
+        if target_format == 'jpeg':
+            save_options = {'quality': options.jpeg_quality, 'optimize': True}
+        else:
+            save_options = {'optimize': True}
+        output_path = destination + EXTENSIONS[target_format]
+        handle, temp_path = tempfile.mkstemp(suffix='.tmp',
+                                             dir=os.path.dirname(destination))
+        os.close(handle)
+        try:
+            image.save(temp_path, PIL_FORMATS[target_format], **save_options)
+        except Exception:
+            os.remove(temp_path)
+            raise
+    #A lossless recompression is only worth it if it is smaller
+    if not resize and target_format == source_format and \
+            os.path.getsize(temp_path) >= source_size:
+        os.remove(temp_path)
+        return None
+    os.chmod(temp_path, 0o644)
+    os.replace(temp_path, output_path)
+    return target_format
+
+
+class ImageOptimizer(object):
+    """
+    Optimizes images in a pool of worker processes, keeping the results in a
+    cache directory.
+
+    Parameters
+    ----------
+    options : optimize_options
+        The optimization settings
+    location : str
+        The cache directory for optimized images
+    workers : int, optional
+        The number of worker processes, by default the number of CPUs
+    """
+    def __init__(self, options, location, workers=None):
+        self.options = options
+        self.location = location
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = None
+
+    def pool(self):
+        """
+        Returns the process pool, or None if this process may not start one.
+        Worker processes of 'oaepub batch' are daemonic, and so optimize their
+        images themselves.
+        """
+        if multiprocessing.current_process().daemon or self.workers == 1:
+            return None
+        if self._pool is None:
+            self._pool = concurrent.futures.ProcessPoolExecutor(self.workers)
+        return self._pool
+
+    def cache_key(self, digest):
+        key = hashlib.sha256()
+        key.update('{0}:{1!r}'.format(digest, tuple(self.options)).encode('utf-8'))
+        return key.hexdigest()
+
+    def cached(self, key):
+        """
+        Returns the cached result for a key: the path and format of the
+        optimized image, UNCHANGED, or None if there is no result yet.
+        """
+        base = os.path.join(self.location, key)
+        for image_format, extension in EXTENSIONS.items():
+            if os.path.isfile(base + extension):
+                return base + extension, image_format
+        if os.path.isfile(base + UNCHANGED):
+            return UNCHANGED
+        return None
+
+    def optimize(self, files, formats):
+        """
+        Returns a new list of image_files in which each image which could be
+        optimized is replaced by its optimized version, renamed to the
+        extension of its new format.
+
+        `formats` maps the names of the files to their image formats, files
+        which are not images being absent from it.
+        """
+        os.makedirs(self.location, exist_ok=True)
+        results = {}
+        pending = {}
+        for image in files:
+            if image.name not in formats:
+                continue
+            digest = image.digest or file_digest(image.path)
+            key = self.cache_key(digest)
+            result = self.cached(key)
+            if result is not None:
+                results[image.name] = result
+                continue
+            destination = os.path.join(self.location, key)
+            source = image.data if image.data is not None else image.path
+            args = (source, destination, formats[image.name], self.options)
+            pool = self.pool()
+            if pool is None:
+                pending[image.name] = (key, self.run_here(*args))
+            else:
+                pending[image.name] = (key, pool.submit(optimize_file, *args))
+        for name, (key, future) in pending.items():
+            try:
+                image_format = future.result()
+            except Exception:
+                log.exception('Unable to optimize {0}, using it as it is'.format(name))
+                continue
+            base = os.path.join(self.location, key)
+            if image_format is None:
+                #Remember that there was nothing to gain
+                open(base + UNCHANGED, 'w').close()
+                results[name] = UNCHANGED
+            else:
+                results[name] = (base + EXTENSIONS[image_format], image_format)
+        names = set(image.name for image in files)
+        optimized = []
+        for image in files:
+            result = results.get(image.name)
+            if result is None or result == UNCHANGED:
+                optimized.append(image)
+                continue
+            path, image_format = result
+            name = os.path.splitext(image.name)[0] + EXTENSIONS[image_format]
+            if name != image.name and name in names:
+                #The image is already supplied in the new format as well
+                optimized.append(image)
+                continue
+            log.debug('Optimized {0} to {1}'.format(image.name, name))
+            optimized.append(image_file(name, path, None))
+        optimized.sort()
+        return optimized
+
+    @staticmethod
+    def run_here(*args):
+        """
+        Runs optimize_file in this process, returning a completed Future.
+        """
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(optimize_file(*args))
+        except Exception as err:
+            future.set_exception(err)
+        return future
+
+
+_optimizers = {}
+
+
+def get_optimizer(config_module):
+    """
+    Returns the ImageOptimizer described by the config module, shared for the
+    life of the process, or None if image optimization is not enabled or
+    Pillow is not installed.
+    """
+    options = get_options(config_module)
+    if options is None:
+        return None
+    if Image is None:
+        log.warning('Image optimization requires Pillow, which is not installed')
+        return None
+    cache_loc = getattr(config_module, 'cache_location', None) or \
+        openaccess_epub.utils.cache_location()
+    location = os.path.join(cache_loc, 'optimized_images')
+    try:
+        return _optimizers[(options, location)]
+    except KeyError:
+        optimizer = ImageOptimizer(options, location)
+        _optimizers[(options, location)] = optimizer
+        return optimizer
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Reading the pixel dimensions of images from their headers.
+
+Only as much of each file is read as is needed to find its width and height:
+the first 24 bytes of a PNG or 10 of a GIF, the segment headers of a JPEG up to
+its frame header, and the first directory of a TIFF. No pixel data is decoded,
+so probing costs about the same for a huge figure as for a small icon.
+"""
+
+#Standard Library modules
+from collections import namedtuple
+import logging
+import struct
+
+#Non-Standard Library modules
+
+#OpenAccess_EPUB modules
+
+log = logging.getLogger('openaccess_epub.utils.image_probe')
+
+image_size = namedtuple('image_size', 'width, height')
+
+#JPEG start of frame markers, which carry the dimensions of the image; the
+#others between 0xC0 and 0xCF are DHT (0xC4), JPG (0xC8) and DAC (0xCC)
+JPEG_FRAME_MARKERS = frozenset(range(0xC0, 0xD0)) - frozenset((0xC4, 0xC8, 0xCC))
+
+#JPEG markers which stand alone, without a segment length
+JPEG_STANDALONE_MARKERS = frozenset(range(0xD0, 0xDA)) | frozenset((0x01,))
+
+#TIFF tags for the width and height, and the sizes of the field types they use
+TIFF_WIDTH = 256
+TIFF_HEIGHT = 257
+TIFF_SHORT = 3
+TIFF_LONG = 4
+
+
+def png_size(image):
+    header = image.read(24)
+    if len(header) < 24 or header[12:16] != b'IHDR':
+        return None
+    return image_size(*struct.unpack('>II', header[16:24]))
+
+
+def gif_size(image):
+    header = image.read(10)
+    if len(header) < 10:
+        return None
+    return image_size(*struct.unpack('<HH', header[6:10]))
+
+
+def jpeg_size(image):
+    """
+    Walks the segments of a JPEG from the start of the file, seeking past the
+    content of each, until the start of frame segment is found.
+    """
+    image.seek(2)
+    while True:
+        byte = image.read(1)
+        while byte and byte != b'\xff':  # Tolerate junk between segments
+            byte = image.read(1)
+        while byte == b'\xff':  # Any number of fill bytes may come first
+            byte = image.read(1)
+        if not byte:
+            return None
+        marker = ord(byte)
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+        if marker == 0xDA:  # Start of scan, with no frame header before it
+            return None
+        length_bytes = image.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack('>H', length_bytes)[0]
+        if marker in JPEG_FRAME_MARKERS:
+            frame = image.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack('>HH', frame[1:5])
+            return image_size(width, height)
+        image.seek(length - 2, 1)
+
+
+def tiff_size(image):
+    """
+    Reads the width and height tags from the first image file directory.
+    """
+    header = image.read(8)
+    if len(header) < 8:
+        return None
+    order = '<' if header[:2] == b'II' else '>'
+    offset = struct.unpack(order + 'I', header[4:8])[0]
+    image.seek(offset)
+    count_bytes = image.read(2)
+    if len(count_bytes) < 2:
+        return None
+    count = struct.unpack(order + 'H', count_bytes)[0]
+    entries = image.read(count * 12)
+    dimensions = {}
+    for position in range(0, len(entries) - 11, 12):
+        tag, field_type = struct.unpack(order + 'HH', entries[position:position + 4])
+        if tag not in (TIFF_WIDTH, TIFF_HEIGHT):
+            continue
+        value = entries[position + 8:position + 12]
+        if field_type == TIFF_SHORT:
+            dimensions[tag] = struct.unpack(order + 'H', value[:2])[0]
+        elif field_type == TIFF_LONG:
+            dimensions[tag] = struct.unpack(order + 'I', value)[0]
+    if TIFF_WIDTH not in dimensions or TIFF_HEIGHT not in dimensions:
+        return None
+    return image_size(dimensions[TIFF_WIDTH], dimensions[TIFF_HEIGHT])
+
+
+def read_size(image):
+    """
+    Returns the image_size(width, height) in pixels of a PNG, JPEG, GIF or
+    TIFF image from a binary file object, read from its header. Returns None
+    if the file is not one of these or its header could not be read.
+    """
+    image.seek(0)
+    signature = image.read(8)
+    image.seek(0)
+    try:
+        if signature.startswith(b'\x89PNG\r\n\x1a\n'):
+            size = png_size(image)
+        elif signature.startswith(b'\xff\xd8'):
+            size = jpeg_size(image)
+        elif signature[:6] in (b'GIF87a', b'GIF89a'):
+            size = gif_size(image)
+        elif signature[:4] in (b'II*\x00', b'MM\x00*'):
+            size = tiff_size(image)
+        else:
+            size = None
+    except struct.error:
+        return None
+    if size is None or not size.width or not size.height:
+        return None
+    return size
+
+
+def probe_size(path):
+    """
+    Returns the image_size(width, height) in pixels of the image file at
+    `path`, or None, as for read_size.
+    """
+    try:
+        with open(path, 'rb') as image:
+            size = read_size(image)
+    except (IOError, OSError) as err:
+        log.debug('Unable to read the header of {0}: {1}'.format(path, err))
+        return None
+    if size is None:
+        log.debug('No dimensions found for {0}'.format(path))
+    return size
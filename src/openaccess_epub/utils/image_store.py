@@ -0,0 +1,652 @@
+# -*- coding: utf-8 -*-
+"""
+A content-addressed store for the image cache.
+
+Each image is stored once, as a blob named by the SHA-256 hash of its content,
+no matter how many articles use it. Each article has a manifest which maps the
+names of its image files to the hashes of their blobs. Building an EPUB reads
+the images straight out of the blobs, so nothing is copied out of the store.
+
+The layout beneath the image cache directory is:
+
+    blobs/ab/abcdef...       The image blobs, in directories by the first two
+                             characters of their hash
+    manifests/10.1371/journal.pone.0000001.json
+                             The manifest for each article, by its DOI
+    index.sqlite             The size of each blob, the blobs used by each
+                             article, when each article was last used, and
+                             the pixel dimensions of the image blobs
+    locks/10.1371/journal.pone.0000001.lock
+                             The lease held by the process populating the
+                             cache for an article, while it does so
+
+The index lets the store keep to a maximum size without walking the tree:
+whole articles are evicted, least recently used first, and then any blobs no
+longer used by a remaining article are removed. Should the index be lost, it is
+rebuilt from the manifests the first time it is needed.
+
+Several processes may use the store at once. Every file is written under a
+temporary name beside its final one and published by an atomic rename, the
+manifest last of all, so an article is never seen half stored. A process which
+is going to populate the cache for an article first takes its lease, so that
+other processes wanting the same article wait for it rather than fetching the
+same images again. The lease is an exclusive flock on the lock file of the
+article, which the operating system releases if its process dies, so a lease is
+never left behind and is held for as long as the work takes. Threads of one
+process wait for each other's leases on a lock of the process before taking the
+flock. Where flock is not available, only those threads wait; processes may then
+fetch the same images at once, which the atomic renames keep safe.
+"""
+
+#Standard Library modules
+from collections import namedtuple
+import contextlib
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+#Non-Standard Library modules
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+#OpenAccess_EPUB modules
+
+log = logging.getLogger('openaccess_epub.utils.image_store')
+
+#An image read from an archive has its content in `data`, and no path
+image_file = namedtuple('image_file', 'name, path, digest, data')
+image_file.__new__.__defaults__ = (None,)
+
+
+def file_digest(path):
+    """
+    Returns the hexadecimal SHA-256 digest of the content of a file.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as content_file:
+        for chunk in iter(lambda: content_file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def open_image_file(image):
+    """
+    Returns a binary file object for reading an image_file, from memory if
+    its content is held in `data`.
+    """
+    if image.data is not None:
+        return io.BytesIO(image.data)
+    return open(image.path, 'rb')
+
+
+def image_file_size(image):
+    """
+    Returns the size in bytes of an image_file.
+    """
+    if image.data is not None:
+        return len(image.data)
+    return os.path.getsize(image.path)
+
+
+def directory_files(directory):
+    """
+    Returns a list of image_file(name, path, digest) for every file beneath a
+    directory, sorted by name. Names use '/' as the separator and the digests
+    are None, as they have not been computed.
+    """
+    files = []
+    for root, dirs, filenames in os.walk(directory):
+        dirs.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, directory).replace(os.sep, '/')
+            files.append(image_file(name, path, None))
+    files.sort()
+    return files
+
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS articles (doi TEXT PRIMARY KEY, last_used REAL);
+CREATE INDEX IF NOT EXISTS articles_last_used ON articles (last_used);
+CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, size INTEGER);
+CREATE TABLE IF NOT EXISTS refs (doi TEXT, digest TEXT);
+CREATE INDEX IF NOT EXISTS refs_doi ON refs (doi);
+CREATE INDEX IF NOT EXISTS refs_digest ON refs (digest);
+CREATE TABLE IF NOT EXISTS dimensions (digest TEXT PRIMARY KEY, width INTEGER, height INTEGER);
+"""
+
+#The blobs of an article which no other article uses
+UNSHARED_BLOBS = """
+SELECT blobs.digest, blobs.size FROM blobs
+WHERE blobs.digest IN (SELECT digest FROM refs WHERE doi = ?)
+AND NOT EXISTS (SELECT 1 FROM refs WHERE refs.digest = blobs.digest AND refs.doi != ?)
+"""
+
+#The Linux ioctl which clones the data of one file into another
+FICLONE = 0x40049409
+
+#The leases held by each thread, by lock path, with how many times each is held
+_held_leases = threading.local()
+
+#A lock for each lock path leased in this process, with the number of threads
+#holding or waiting for it; threads take it before the flock, so that a lease
+#excludes the other threads of its process as well as other processes
+_thread_leases = {}
+_thread_leases_lock = threading.Lock()
+
+
+def remove_file(path):
+    """
+    Removes a file, if it exists.
+    """
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def clone_or_copy(source, destination):
+    """
+    Copies `source` to `destination`, as a copy-on-write clone (a reflink) where
+    the filesystem supports one, which shares the data on disk. Unlike a
+    hardlink, the copy is a file of its own, so editing it never alters the
+    source, which may be a blob of the image cache or an input image.
+    """
+    if fcntl is not None and sys.platform.startswith('linux'):
+        try:
+            with open(source, 'rb') as inp, open(destination, 'wb') as out:
+                fcntl.ioctl(out.fileno(), FICLONE, inp.fileno())
+            return
+        except OSError:  # Not supported here, such as across filesystems
+            pass
+    shutil.copyfile(source, destination)
+
+
+class ImageStore(object):
+    """
+    A directory of image blobs named by their hash, and of manifests mapping
+    the image file names of each article to their blobs.
+
+    Parameters
+    ----------
+    location : str
+        The top level directory of the store, the configured image cache.
+    max_size : int, optional
+        The maximum total size of the blobs in bytes. When adding an article
+        takes the store over this size, the least recently used articles are
+        evicted. If None, the store is not limited.
+    """
+    def __init__(self, location, max_size=None):
+        self.location = location
+        self.max_size = max_size
+        self.blob_directory = os.path.join(location, 'blobs')
+        self.manifest_directory = os.path.join(location, 'manifests')
+        self.index_path = os.path.join(location, 'index.sqlite')
+
+    def connect(self):
+        """
+        Returns a connection to the index, creating it from the manifests if
+        it does not exist yet.
+        """
+        os.makedirs(self.location, exist_ok=True)
+        new = not os.path.isfile(self.index_path)
+        connection = sqlite3.connect(self.index_path, timeout=60)
+        with connection:
+            connection.executescript(INDEX_SCHEMA)
+        if new:
+            self.rebuild_index(connection)
+        return connection
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_directory, digest[:2], digest)
+
+    def manifest_path(self, doi):
+        journal_doi, article_doi = doi.split('/')
+        return os.path.join(self.manifest_directory, journal_doi,
+                            article_doi + '.json')
+
+    def add_file(self, path):
+        """
+        Adds the file at `path` to the store, unless an identical blob is
+        already there. Returns the digest of the file.
+        """
+        digest = file_digest(path)
+        blob = self.blob_path(digest)
+        if os.path.isfile(blob):
+            return digest
+        blob_parent = os.path.dirname(blob)
+        if not os.path.isdir(blob_parent):
+            os.makedirs(blob_parent, exist_ok=True)
+        #Copy to a temporary name first, so that a blob is always complete
+        handle, temp_path = tempfile.mkstemp(suffix='.tmp', dir=blob_parent)
+        os.close(handle)
+        try:
+            shutil.copyfile(path, temp_path)
+            #Blobs are shared by articles and must never be altered
+            os.chmod(temp_path, 0o444)
+            os.replace(temp_path, blob)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return digest
+
+    def add_directory(self, doi, directory):
+        """
+        Adds every file beneath `directory` to the store, then writes the
+        manifest for the article with the given DOI. Returns the list of
+        image_files in the store.
+        """
+        sources = directory_files(directory)
+        files = [image_file(f.name, None, self.add_file(f.path)) for f in sources]
+        self.write_manifest(doi, files)
+        self.index_article(doi, files)
+        #A blob already in the store may have been evicted before the index
+        #referred to it; now that it does, no eviction will remove it again
+        missing = [source for source, stored in zip(sources, files)
+                   if not os.path.isfile(self.blob_path(stored.digest))]
+        if missing:
+            for source in missing:
+                self.add_file(source.path)
+            #Recording the sizes of the blobs added again
+            self.index_article(doi, files)
+        log.info('Stored {0} images for {1} in the image cache'.format(len(files), doi))
+        if self.max_size is not None:
+            self.prune(max_size=self.max_size, keep=doi)
+        return self.files(doi)
+
+    def index_article(self, doi, files, last_used=None):
+        """
+        Records an article, its blobs and their sizes in the index.
+        """
+        if last_used is None:
+            last_used = time.time()
+        connection = self.connect()
+        try:
+            previous = [row[0] for row in
+                        connection.execute('SELECT digest FROM refs WHERE doi = ?', (doi,))]
+            with connection:
+                self._index_article(connection, doi, files, last_used)
+            #Blobs which only the previous version of the article used
+            self.remove_orphans(connection, previous)
+        finally:
+            connection.close()
+
+    def remove_orphans(self, connection, digests):
+        """
+        Removes those of the given blobs which no article uses any more.
+
+        The blobs are removed inside a write transaction, which an article
+        being indexed waits for, so a blob is never removed once an article
+        refers to it.
+        """
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            for digest in digests:
+                used = connection.execute('SELECT 1 FROM refs WHERE digest = ? LIMIT 1',
+                                          (digest,)).fetchone()
+                if used:
+                    continue
+                connection.execute('DELETE FROM blobs WHERE digest = ?', (digest,))
+                connection.execute('DELETE FROM dimensions WHERE digest = ?', (digest,))
+                remove_file(self.blob_path(digest))
+
+    def _index_article(self, connection, doi, files, last_used):
+        connection.execute('DELETE FROM refs WHERE doi = ?', (doi,))
+        connection.execute('INSERT OR REPLACE INTO articles (doi, last_used) VALUES (?, ?)',
+                           (doi, last_used))
+        for digest in set(f.digest for f in files):
+            try:
+                size = os.path.getsize(self.blob_path(digest))
+            except OSError:
+                size = 0
+            connection.execute('INSERT OR REPLACE INTO blobs (digest, size) VALUES (?, ?)',
+                               (digest, size))
+            connection.execute('INSERT INTO refs (doi, digest) VALUES (?, ?)',
+                               (doi, digest))
+
+    def touch(self, doi):
+        """
+        Marks an article as used now, so it is the last to be evicted.
+        """
+        connection = self.connect()
+        try:
+            with connection:
+                connection.execute('UPDATE articles SET last_used = ? WHERE doi = ?',
+                                   (time.time(), doi))
+        finally:
+            connection.close()
+
+    def rebuild_index(self, connection):
+        """
+        Fills the index from the manifests in the store. This walks the
+        manifest directory, so it is only done when the index is missing. The
+        modification time of each manifest stands in for when it was last used.
+        """
+        log.info('Building the image cache index for {0}'.format(self.location))
+        with connection:
+            for root, dirs, filenames in os.walk(self.manifest_directory):
+                for filename in filenames:
+                    if not filename.endswith('.json'):
+                        continue
+                    path = os.path.join(root, filename)
+                    try:
+                        with open(path, 'r', encoding='utf-8') as manifest_file:
+                            manifest = json.load(manifest_file)
+                        last_used = os.path.getmtime(path)
+                    except (IOError, OSError, ValueError):
+                        continue
+                    files = [image_file(name, None, digest)
+                             for name, digest in manifest['files'].items()]
+                    self._index_article(connection, manifest['doi'], files, last_used)
+
+    def dimensions(self, digests):
+        """
+        Returns a dict mapping those of the given blob digests whose pixel
+        dimensions are recorded in the index to their (width, height).
+        """
+        digests = list(digests)
+        if not digests:
+            return {}
+        connection = self.connect()
+        try:
+            query = 'SELECT digest, width, height FROM dimensions WHERE digest IN ({0})'
+            rows = connection.execute(query.format(', '.join('?' * len(digests))),
+                                      digests).fetchall()
+        finally:
+            connection.close()
+        return dict((digest, (width, height)) for digest, width, height in rows)
+
+    def record_dimensions(self, dimensions):
+        """
+        Records the pixel dimensions of image blobs in the index, `dimensions`
+        mapping blob digests to (width, height).
+        """
+        if not dimensions:
+            return
+        connection = self.connect()
+        try:
+            with connection:
+                connection.executemany('INSERT OR REPLACE INTO dimensions (digest, width, height) VALUES (?, ?, ?)',
+                                       [(digest, width, height) for digest, (width, height)
+                                        in dimensions.items()])
+        finally:
+            connection.close()
+
+    def size(self):
+        """
+        Returns the total size in bytes of the blobs, according to the index.
+        """
+        connection = self.connect()
+        try:
+            return connection.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+        finally:
+            connection.close()
+
+    def prune(self, max_size=None, older_than=None, keep=None, dry_run=False):
+        """
+        Evicts articles from the store, least recently used first, along with
+        the blobs which no remaining article uses.
+
+        Parameters
+        ----------
+        max_size : int, optional
+            Evict articles until the blobs take up no more than this many bytes
+        older_than : float, optional
+            Evict articles not used in this many seconds
+        keep : str, optional
+            The DOI of an article which must not be evicted
+        dry_run : bool, optional
+            Only find what would be evicted
+
+        Returns a list of (doi, bytes freed) for the evicted articles, in the
+        order they were evicted, and the total number of bytes freed.
+
+        An article is only evicted while its lease can be taken without
+        waiting; those in use by another thread or process are skipped.
+        """
+        connection = self.connect()
+        evicted = []
+        freed = 0
+        try:
+            #The whole eviction is one write transaction, rolled back for a dry
+            #run. Each article is evicted as it is chosen, so a blob it shared
+            #only with articles already evicted is freed and counted with it
+            connection.execute('BEGIN IMMEDIATE')
+            total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+            cutoff = None if older_than is None else time.time() - older_than
+            #Oldest first, only as far as is needed
+            rows = connection.execute('SELECT doi, last_used FROM articles ORDER BY last_used').fetchall()
+            for doi, last_used in rows:
+                too_old = cutoff is not None and last_used < cutoff
+                too_big = max_size is not None and total > max_size
+                if not (too_old or too_big):
+                    break
+                if doi == keep:
+                    continue
+                if dry_run:
+                    doi_freed, doi_paths = self.evict(connection, doi)
+                else:
+                    handle = self.try_lease(doi)
+                    if handle is None:
+                        log.debug('Not evicting {0} from the image cache, it is in use'.format(doi))
+                        continue
+                    try:
+                        doi_freed, doi_paths = self.evict(connection, doi)
+                        for path in doi_paths:
+                            remove_file(path)
+                    finally:
+                        self.release_lease(doi, handle)
+                evicted.append((doi, doi_freed))
+                freed += doi_freed
+                total -= doi_freed
+            if dry_run:
+                connection.rollback()
+            else:
+                connection.commit()
+        finally:
+            connection.close()
+        if evicted:
+            log.info('Evicted {0} articles ({1} bytes) from the image cache'.format(len(evicted), freed))
+        return evicted, freed
+
+    def evict(self, connection, doi):
+        """
+        Removes an article from the index, along with its blobs if no other
+        article uses them, without committing. Returns the number of bytes
+        freed and the paths of the files to remove. The transaction should be a
+        write transaction, so that no article comes to use the blobs before
+        their files are removed.
+        """
+        orphans = connection.execute(UNSHARED_BLOBS, (doi, doi)).fetchall()
+        connection.execute('DELETE FROM refs WHERE doi = ?', (doi,))
+        connection.execute('DELETE FROM articles WHERE doi = ?', (doi,))
+        for digest, size in orphans:
+            connection.execute('DELETE FROM blobs WHERE digest = ?', (digest,))
+            connection.execute('DELETE FROM dimensions WHERE digest = ?', (digest,))
+        log.debug('Evicting {0} from the image cache'.format(doi))
+        paths = [self.manifest_path(doi)]
+        paths += [self.blob_path(digest) for digest, size in orphans]
+        return sum(size for digest, size in orphans), paths
+
+    def write_manifest(self, doi, files):
+        """
+        Writes the manifest mapping the image file names of an article to the
+        digests of their blobs.
+        """
+        manifest = {'doi': doi,
+                    'files': dict((f.name, f.digest) for f in files)}
+        path = self.manifest_path(doi)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(suffix='.tmp',
+                                             dir=os.path.dirname(path))
+        with os.fdopen(handle, 'w', encoding='utf-8') as manifest_file:
+            json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+
+    def read_manifest(self, doi):
+        """
+        Returns the manifest dictionary for an article, or None if the article
+        is not in the store.
+        """
+        try:
+            with open(self.manifest_path(doi), 'r', encoding='utf-8') as manifest_file:
+                return json.load(manifest_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def lock_path(self, doi):
+        journal_doi, article_doi = doi.split('/')
+        return os.path.join(self.location, 'locks', journal_doi,
+                            article_doi + '.lock')
+
+    def try_acquire(self, doi, blocking=False):
+        """
+        Takes the lease for an article, an exclusive flock on its lock file.
+        Returns the file descriptor of the lock file if this process now holds
+        the lease, or None if another process holds it and `blocking` is
+        False; otherwise this waits for the lease.
+        """
+        path = self.lock_path(doi)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        operation = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        while True:
+            handle = os.open(path, os.O_CREAT | os.O_RDWR, 0o644)
+            try:
+                fcntl.flock(handle, operation)
+            except BlockingIOError:
+                os.close(handle)
+                return None
+            except BaseException:
+                os.close(handle)
+                raise
+            #The holder before us removes the lock file as it releases it, a
+            #lock taken on a removed file is no lease, so try again
+            try:
+                if os.path.samestat(os.fstat(handle), os.stat(path)):
+                    return handle
+            except OSError:
+                pass
+            os.close(handle)
+
+    def release(self, doi, handle):
+        """
+        Gives up the lease held with the lock file descriptor `handle`,
+        removing the lock file only if it is still the one this process locked.
+        """
+        path = self.lock_path(doi)
+        try:
+            if os.path.samestat(os.fstat(handle), os.stat(path)):
+                os.remove(path)
+        except OSError:
+            pass
+        finally:
+            os.close(handle)
+
+    def try_lease(self, doi, blocking=False):
+        """
+        Takes the lease for an article for the calling thread. Returns a handle
+        to pass to release_lease, or None if another thread or process holds
+        the lease and `blocking` is False; otherwise this waits for the lease.
+        """
+        path = self.lock_path(doi)
+        with _thread_leases_lock:
+            entry = _thread_leases.setdefault(path, [threading.Lock(), 0])
+            entry[1] += 1
+        handle = None
+        try:
+            if entry[0].acquire(blocking):
+                try:
+                    handle = self.try_acquire(doi, blocking) if fcntl else -1
+                finally:
+                    if handle is None:
+                        entry[0].release()
+        finally:
+            if handle is None:
+                self._forget_lease(path)
+        return handle
+
+    def release_lease(self, doi, handle):
+        """
+        Gives up the lease taken by try_lease with `handle`.
+        """
+        path = self.lock_path(doi)
+        try:
+            if handle != -1:
+                self.release(doi, handle)
+        finally:
+            with _thread_leases_lock:
+                lock = _thread_leases[path][0]
+            lock.release()
+            self._forget_lease(path)
+
+    @staticmethod
+    def _forget_lease(path):
+        """
+        Drops a thread's claim on the lock of a lock path, and the lock with
+        the last claim.
+        """
+        with _thread_leases_lock:
+            entry = _thread_leases[path]
+            entry[1] -= 1
+            if not entry[1]:
+                del _thread_leases[path]
+
+    @contextlib.contextmanager
+    def lease(self, doi):
+        """
+        Holds the lease for an article for the duration of the block, first
+        waiting for any other thread or process holding it to finish. Leases
+        are reentrant within a thread.
+        """
+        path = self.lock_path(doi)
+        held = getattr(_held_leases, 'counts', None)
+        if held is None:
+            held = _held_leases.counts = {}
+        if held.get(path):
+            held[path] += 1
+            try:
+                yield
+            finally:
+                held[path] -= 1
+            return
+        handle = self.try_lease(doi)
+        if handle is None:
+            log.info('Waiting for another process to cache the images for {0}'.format(doi))
+            handle = self.try_lease(doi, blocking=True)
+        held[path] = 1
+        try:
+            yield
+        finally:
+            del held[path]
+            self.release_lease(doi, handle)
+
+    def files(self, doi):
+        """
+        Returns a sorted list of image_file(name, path, digest) for the images
+        of an article, the paths being those of the blobs. Returns None if the
+        article is not in the store, or if any of its blobs are missing.
+        """
+        manifest = self.read_manifest(doi)
+        if manifest is None:
+            return None
+        files = []
+        for name, digest in sorted(manifest['files'].items()):
+            path = self.blob_path(digest)
+            if not os.path.isfile(path):
+                log.warning('Image cache is missing {0} for {1}'.format(name, doi))
+                return None
+            files.append(image_file(name, path, digest))
+        self.touch(doi)
+        return files
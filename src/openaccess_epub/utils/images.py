@@ -3,61 +3,229 @@
 Utility suite for handling images.
 """
 
+from collections import namedtuple
+import contextlib
 import urllib.request
 import urllib.error
 import time
 import re
 import os.path
 import shutil
+import tempfile
 import logging
 import openaccess_epub.utils as utils
+from openaccess_epub.utils.fetch import Fetcher, get_fetcher
+from openaccess_epub.utils.image_store import ImageStore, directory_files,\
+    open_image_file, image_file_size
+from openaccess_epub.utils.image_optimize import get_optimizer
+from openaccess_epub.utils.image_probe import read_size
 
 
 log = logging.getLogger('openaccess_epub.utils.images')
 
+located_images = namedtuple('located_images', 'files, path, temporary')
 
-def move_images_to_cache(source, destination):
+image_entry = namedtuple('image_entry', 'href, src, path, format, media_type, size, manifest_id, width, height')
+
+#The image formats which may be referenced by articles, with their media types
+MEDIA_TYPES = {'png': 'image/png',
+               'jpeg': 'image/jpeg',
+               'gif': 'image/gif',
+               'tiff': 'image/tiff'}
+
+#The formats indicated by file extensions, in order of preference where an
+#article's images are available in more than one format
+EXTENSION_FORMATS = (('.png', 'png'),
+                     ('.jpg', 'jpeg'),
+                     ('.jpeg', 'jpeg'),
+                     ('.gif', 'gif'),
+                     ('.tif', 'tiff'),
+                     ('.tiff', 'tiff'))
+
+
+class ImageError(Exception):
     """
-    Handles the movement of images to the cache. Must be helpful if it finds
-    that the folder for this article already exists.
+    Raised when the images referenced by an article are missing, or are not
+    what their names claim them to be.
     """
-    if os.path.isdir(destination):
-        log.debug('Cached images for this article already exist')
-        return
-    else:
-        log.debug('Cache location: {0}'.format(destination))
-        try:
-            shutil.copytree(source, destination)
-        except:
-            log.exception('Images could not be moved to cache')
-        else:
-            log.info('Moved images to cache'.format(destination))
 
 
-def explicit_images(images, image_destination, rootname, config):
+def sniff_format(path):
+    """
+    Returns the image format of a file from its first few bytes, one of the
+    keys of MEDIA_TYPES, or None if the format is not recognized.
+    """
+    with open(path, 'rb') as image:
+        return header_format(image.read(8))
+
+
+def header_format(header):
+    """
+    Returns the image format indicated by the first eight bytes of a file, as
+    for sniff_format.
+    """
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if header[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'tiff'
+    return None
+
+
+class ImageIndex(object):
+    """
+    Maps the xlink:href of each image referenced by an article to the file
+    which will be used for it, as an image_entry(href, src, path, format,
+    media_type, size, manifest_id, width, height). The width and height in
+    pixels are None if they could not be read from the header of the image.
+
+    `src` is the location of the image relative to the content documents, which
+    is also its location relative to the EPUB directory. The index is built
+    once the images are located, and is then used both to point the content at
+    the images and to describe them in the package manifest.
+    """
+    def __init__(self, entries):
+        self.entries = entries
+        self.by_src = dict((entry.src, entry) for entry in entries.values())
+
+    def __contains__(self, href):
+        return href in self.entries
+
+    def __getitem__(self, href):
+        return self.entries[href]
+
+    def __iter__(self):
+        return iter(sorted(self.entries.values()))
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def referenced_hrefs(parsed_article):
+        """
+        Returns the xlink:href of every <graphic> and <inline-graphic> in the
+        article, in document order and without repeats.
+        """
+        root = parsed_article.root
+        xlink = '{http://www.w3.org/1999/xlink}href'
+        hrefs = []
+        for graphic in root.iter('graphic', 'inline-graphic'):
+            href = graphic.get(xlink)
+            if href is not None and href not in hrefs:
+                hrefs.append(href)
+        return hrefs
+
+    @classmethod
+    def build(cls, parsed_article, files, store=None):
+        """
+        Builds the index for an article from its located image_files, matching
+        each referenced xlink:href to a file by name.
+
+        The pixel dimensions of each image are read from its header. If an
+        ImageStore is given, the dimensions of the images kept in it are
+        looked up in its index, and recorded there once read.
+
+        An xlink:href is matched by its file name, then by its file name
+        without its extension, so that 'fig1.tif' finds 'fig1.tif' or else a
+        file such as 'fig1.png' or 'fig1.jpg' (as fetched, or as converted from
+        TIFF by image optimization). A PLoS xlink:href such as
+        'info:doi/10.1371/journal.pone.0000001.g001' is matched by its last
+        part, 'g001', to a file such as 'g001.png'.
+
+        Raises ImageError, naming every problem found, if any referenced image
+        is missing or if the content of its file does not match its extension.
+        """
+        article_doi = parsed_article.doi.split('/', 1)[1]
+        img_dir = 'images-' + article_doi
+        #Each file may be found by its name or its name without extension
+        by_name = {}
+        for image in files:
+            root, extension = os.path.splitext(image.name.rsplit('/', 1)[-1])
+            extension = extension.lower()
+            for preference, (known, image_format) in enumerate(EXTENSION_FORMATS):
+                if extension == known:
+                    by_name.setdefault(root, []).append((preference, image_format, image))
+                    by_name[root + extension] = [(preference, image_format, image)]
+        digests = set(image.digest for image in files if image.digest)
+        known = store.dimensions(digests) if store is not None else {}
+        probed = {}
+        entries = {}
+        problems = []
+        for href in cls.referenced_hrefs(parsed_article):
+            base = href.rsplit('/', 1)[-1]
+            candidates = (by_name.get(base) or
+                          by_name.get(os.path.splitext(base)[0]) or
+                          by_name.get(base.split('.')[-1]))
+            if not candidates:
+                problems.append('No image file found for {0}'.format(href))
+                continue
+            preference, image_format, image = min(candidates)
+            with open_image_file(image) as handle:
+                if header_format(handle.read(8)) != image_format:
+                    problems.append('{0} for {1} is not a {2} image'.format(image.name,
+                                                                           href,
+                                                                           image_format.upper()))
+                    continue
+                if image.digest in known:
+                    dimensions = known[image.digest]
+                else:
+                    dimensions = read_size(handle) or (None, None)
+                    if image.digest and dimensions[0] is not None:
+                        probed[image.digest] = dimensions
+            src = '/'.join([img_dir, image.name])
+            entries[href] = image_entry(href,
+                                        src,
+                                        image.path,
+                                        image_format,
+                                        MEDIA_TYPES[image_format],
+                                        image_file_size(image),
+                                        '-'.join([article_doi,
+                                                  image.name.replace('/', '-').replace('.', '-')]),
+                                        *dimensions)
+        if problems:
+            raise ImageError('; '.join(problems))
+        if store is not None and probed:
+            store.record_dimensions(probed)
+        return cls(entries)
+
+
+def store_images(store, doi, directory):
+    """
+    Adds the images in `directory` to the image cache `store` for the article
+    with the given DOI. Returns the list of image_files in the store, or None
+    if the images could not be stored.
+    """
+    try:
+        with store.lease(doi):
+            return store.add_directory(doi, directory)
+    except (IOError, OSError):
+        log.exception('Images could not be moved to cache')
+        return None
+
+
+def explicit_images(images, rootname):
     """
     The method used to handle an explicitly defined image directory by the
-    user as a parsed argument.
+    user as a parsed argument. Returns the directory, or None if it does not
+    exist.
     """
     log.info('Explicit image directory specified: {0}'.format(images))
     if '*' in images:
         images = images.replace('*', rootname)
         log.debug('Wildcard expansion for image directory: {0}'.format(images))
-    try:
-        shutil.copytree(images, image_destination)
-    except:
-        #The following is basically a recipe for log.exception() but with a
-        #CRITICAL level if the execution should be killed immediately
-        #log.critical('Unable to copy from indicated directory', exc_info=True)
-        log.exception('Unable to copy from indicated directory')
-        return False
-    else:
-        return True
+    if not os.path.isdir(images):
+        log.error('Unable to find indicated directory {0}'.format(images))
+        return None
+    return images
 
 
-def input_relative_images(input_path, image_destination, rootname, config):
+def input_relative_images(input_path, rootname, config):
     """
-    The method used to handle Input-Relative image inclusion.
+    The method used to handle Input-Relative image inclusion. Returns the first
+    of the configured directories found, or None.
     """
     log.debug('Looking for input relative images')
     input_dirname = os.path.dirname(input_path)
@@ -68,38 +236,60 @@ def input_relative_images(input_path, image_destination, rootname, config):
         images = os.path.normpath(os.path.join(input_dirname, path))
         if os.path.isdir(images):
             log.info('Input-Relative image directory found: {0}'.format(images))
-            shutil.copytree(images, image_destination)
-            return True
-    return False
+            return images
+    return None
 
 
-def image_cache(article_cache, img_dir):
+def image_store(config):
     """
-    The method to be used by get_images() for copying images out of the cache.
+    Returns the ImageStore for the image cache described by the config module,
+    or None if the image cache is not in use.
     """
-    log.debug('Looking for image directory in the cache')
-    if os.path.isdir(article_cache):
-        log.info('Cached image directory found: {0}'.format(article_cache))
-        shutil.copytree(article_cache, img_dir)
-        return True
-    return False
+    if not config.use_image_cache:
+        return None
+    #Configured in megabytes, 0 for no limit
+    max_size = getattr(config, 'image_cache_max_size', 0)
+    return ImageStore(config.image_cache,
+                      int(max_size * 1024 * 1024) if max_size else None)
+
+
+def image_lease(config, doi):
+    """
+    Returns a context manager holding the lease for an article in the image
+    cache, so that its images are not evicted while they are read from the
+    cache; it does nothing if the image cache is not in use.
+    """
+    store = image_store(config)
+    if store is None:
+        return contextlib.nullcontext()
+    return store.lease(doi)
 
 
-def get_images(output_directory, explicit, input_path, config, parsed_article):
+def cached_images(store, doi):
     """
-    Main logic controller for the placement of images into the output directory
+    The method to be used by locate_images() for finding images in the cache.
+    Returns the list of image_files for the article in the store, or None.
+    """
+    log.debug('Looking for images in the cache')
+    files = store.files(doi)
+    if files is not None:
+        log.info('Cached images found for {0}'.format(doi))
+    return files
+
 
-    Controlling logic for placement of the appropriate imager files into the
-    EPUB directory. This function interacts with interface arguments as well as
-    the local installation config.py file. These may change behavior of this
-    function in terms of how it looks for images relative to the input, where it
-    finds explicit images, whether it will attempt to download images, and
-    whether successfully downloaded images will be stored in the cache.
+def locate_images(explicit, input_path, config, parsed_article):
+    """
+    Main logic controller for locating the images of an article
+
+    Controlling logic for finding the image files for the article. This
+    function interacts with interface arguments as well as the local
+    installation config.py file. These may change behavior of this function in
+    terms of how it looks for images relative to the input, where it finds
+    explicit images, whether it will attempt to download images, and whether
+    located images will be stored in the cache.
 
     Parameters
     ----------
-    output_directory : str
-        The directory path where the EPUB is being constructed/output
     explicit : str
         A directory path to a user specified directory of images. Allows *
         wildcard expansion.
@@ -109,63 +299,184 @@ def get_images(output_directory, explicit, input_path, config, parsed_article):
         The imported configuration module
     parsed_article : openaccess_epub.article.Article object
         The Article instance for the article being converted to EPUB
+
+    Returns
+    -------
+    located_images or None
+        located_images(files, path, temporary) for the images, or None if
+        the images could not be located. `files` is a sorted list of
+        image_file(name, path, digest), `path` is the directory the images were
+        found in, or None if they come from the cache. If `temporary` is True,
+        the images were downloaded to a temporary directory which the caller
+        should remove once the images have been copied.
     """
-    #Split the DOI
-    journal_doi, article_doi = parsed_article.doi.split('/')
+    doi = parsed_article.doi
+    journal_doi, article_doi = doi.split('/')
     log.debug('journal-doi : {0}'.format(journal_doi))
     log.debug('article-doi : {0}'.format(article_doi))
 
     #Get the rootname for wildcard expansion
     rootname = utils.file_root_name(input_path)
 
-    #Specify where to place the images in the output
-    img_dir = os.path.join(output_directory,
-                           'EPUB',
-                           'images-{0}'.format(article_doi))
-    log.info('Using {0} as image directory target'.format(img_dir))
-
-    #Construct path to cache for article
-    article_cache = os.path.join(config.image_cache, journal_doi, article_doi)
+    store = image_store(config)
 
     #Use manual image directory, explicit images
     if explicit:
-        success = explicit_images(explicit, img_dir, rootname, config)
-        if success and config.use_image_cache:
-            move_images_to_cache(img_dir, article_cache)
-        #Explicit images prevents all other image methods
-        return success
+        images = explicit_images(explicit, rootname)
+        if images is None:
+            #Explicit images prevents all other image methods
+            return None
+        if store is not None:
+            files = store_images(store, doi, images)
+            if files is not None:
+                return located_images(files, images, False)
+        return located_images(directory_files(images), images, False)
 
     #Input-Relative import, looks for any one of the listed options
     if config.use_input_relative_images:
         #Prevents other image methods only if successful
-        if input_relative_images(input_path, img_dir, rootname, config):
-            if config.use_image_cache:
-                move_images_to_cache(img_dir, article_cache)
-            return True
+        images = input_relative_images(input_path, rootname, config)
+        if images is not None:
+            if store is not None:
+                files = store_images(store, doi, images)
+                if files is not None:
+                    return located_images(files, images, False)
+            return located_images(directory_files(images), images, False)
 
     #Use cache for article if it exists
-    if config.use_image_cache:
+    if store is not None:
         #Prevents other image methods only if successful
-        if image_cache(article_cache, img_dir):
-            return True
+        files = cached_images(store, doi)
+        if files is not None:
+            return located_images(files, None, False)
 
     #Download images from Internet
     if config.use_image_fetching:
-        os.mkdir(img_dir)
-        if journal_doi == '10.3389':
-            fetch_frontiers_images(article_doi, img_dir)
-            if config.use_image_cache:
-                move_images_to_cache(img_dir, article_cache)
-            return True
-        elif journal_doi == '10.1371':
-            success = fetch_plos_images(article_doi, img_dir, parsed_article)
-            if success and config.use_image_cache:
-                move_images_to_cache(img_dir, article_cache)
-            return success
+        if store is None:
+            img_dir = fetch_images(parsed_article, config)
+            if img_dir is None:
+                return None
+            return located_images(directory_files(img_dir), img_dir, True)
+        #Only one process fetches the images for an article, any others wait
+        #for it to finish and then find the images in the cache
+        with store.lease(doi):
+            files = cached_images(store, doi)
+            if files is not None:
+                return located_images(files, None, False)
+            img_dir = fetch_images(parsed_article, config)
+            if img_dir is None:
+                return None
+            #Once in the cache, the downloaded copies are not needed
+            files = store_images(store, doi, img_dir)
+            if files is None:
+                return located_images(directory_files(img_dir), img_dir, True)
+            shutil.rmtree(img_dir)
+            return located_images(files, None, False)
+    return None
+
+
+def fetch_images(parsed_article, config):
+    """
+    Downloads the images for the article into a new temporary directory, which
+    is returned. Returns None if the images could not all be downloaded.
+    """
+    journal_doi, article_doi = parsed_article.doi.split('/')
+    img_dir = tempfile.mkdtemp(prefix='oaepub-images-')
+    if journal_doi == '10.3389':
+        fetch_frontiers_images(article_doi, img_dir)
+        success = True
+    elif journal_doi == '10.1371':
+        success = fetch_plos_images(article_doi, img_dir, parsed_article,
+                                    get_fetcher(config))
+    else:
+        log.error('Fetching images for this publisher is not supported!')
+        success = False
+    if not success:
+        shutil.rmtree(img_dir)
+        return None
+    return img_dir
+
+
+def copy_images(writer, files, parsed_article):
+    """
+    Writes the image_files in `files` into the EPUB being built by `writer`, in
+    the 'images-' directory for the article.
+    """
+    article_doi = parsed_article.doi.split('/')[1]
+    target = 'EPUB/images-{0}'.format(article_doi)
+    log.info('Using {0} as image directory target'.format(target))
+    for image in files:
+        if image.data is not None:
+            writer.write('/'.join([target, image.name]), image.data)
         else:
-            log.error('Fetching images for this publisher is not supported!')
+            writer.copy_file('/'.join([target, image.name]), image.path)
+
+
+def optimize_images(images, config):
+    """
+    Returns the located_images with each image optimized as set in the config,
+    see openaccess_epub.utils.image_optimize. The images are returned as they
+    are if optimization is not enabled.
+
+    Optimized images keep the names of their originals apart from the
+    extension, which follows the new format, so the ImageIndex still matches
+    them to their references and gives them the right media types.
+    """
+    optimizer = get_optimizer(config)
+    if optimizer is None:
+        return images
+    formats = {}
+    for image in images.files:
+        extension = os.path.splitext(image.name)[1].lower()
+        if extension in dict(EXTENSION_FORMATS):
+            with open_image_file(image) as handle:
+                image_format = header_format(handle.read(8))
+            if image_format is not None:
+                formats[image.name] = image_format
+    files = optimizer.optimize(images.files, formats)
+    return images._replace(files=files)
+
+
+def index_images(parsed_article, images, config=None):
+    """
+    Builds the ImageIndex for the located images of an article and sets it as
+    the `image_index` of the article. Returns False, having logged the reasons,
+    if any referenced image is missing or mismatched.
+
+    If the config module puts the image cache in use, the dimensions of the
+    cached images are memoized in its index.
+    """
+    store = image_store(config) if config is not None else None
+    try:
+        parsed_article.image_index = ImageIndex.build(parsed_article,
+                                                      images.files,
+                                                      store)
+    except ImageError as err:
+        log.critical('Images for the article do not match its references: {0}'.format(err))
+        return False
+    return True
+
+
+def get_images(writer, explicit, input_path, config, parsed_article):
+    """
+    Locates and indexes the images for the article and writes them into the
+    EPUB being built by `writer`. See locate_images for the parameters.
+
+    Returns True if successful, False if the images could not be located or
+    do not match the references in the article.
+    """
+    images = locate_images(explicit, input_path, config, parsed_article)
+    if images is None:
+        return False
+    try:
+        images = optimize_images(images, config)
+        if not index_images(parsed_article, images, config):
             return False
-    return False
+        copy_images(writer, images.files, parsed_article)
+    finally:
+        if images.temporary:
+            shutil.rmtree(images.path)
+    return True
 
 
 def make_image_cache(img_cache):
@@ -173,10 +484,9 @@ def make_image_cache(img_cache):
     Initiates the image cache if it does not exist
     """
     log.info('Initiating the image cache at {0}'.format(img_cache))
-    if not os.path.isdir(img_cache):
-        utils.mkdir_p(img_cache)
-        utils.mkdir_p(os.path.join(img_cache, '10.1371'))
-        utils.mkdir_p(os.path.join(img_cache, '10.3389'))
+    store = ImageStore(img_cache)
+    utils.mkdir_p(store.blob_directory)
+    utils.mkdir_p(store.manifest_directory)
 
 
 def fetch_frontiers_images(doi, output_dir):
@@ -273,39 +583,46 @@ def fetch_frontiers_images(doi, output_dir):
     print("Done downloading images")
 
 
-def fetch_plos_images(article_doi, output_dir, document):
+#URLs for PLoS subjournals, formatted with the resource to fetch
+PLOS_JOURNAL_URLS = {'pgen': 'http://www.plosgenetics.org/article/{0}',
+                     'pcbi': 'http://www.ploscompbiol.org/article/{0}',
+                     'ppat': 'http://www.plospathogens.org/article/{0}',
+                     'pntd': 'http://www.plosntds.org/article/{0}',
+                     'pmed': 'http://www.plosmedicine.org/article/{0}',
+                     'pbio': 'http://www.plosbiology.org/article/{0}',
+                     'pone': 'http://www.plosone.org/article/{0}',
+                     'pctr': 'http://clinicaltrials.ploshubs.org/article/{0}'}
+
+
+def fetch_plos_images(article_doi, output_dir, document, fetcher=None):
     """
     Fetch the images for a PLoS article from the internet.
 
     PLoS images are known through the inspection of <graphic> and
     <inline-graphic> elements. The information in these tags are then parsed
-    into appropriate URLs for downloading.
+    into appropriate URLs for downloading. The images are downloaded
+    concurrently by `fetcher`, an openaccess_epub.utils.fetch.Fetcher, with a
+    default Fetcher used if it is not given.
+
+    Returns True if every image was downloaded, False otherwise.
     """
     log.info('Processing images for {0}...'.format(article_doi))
-
-    #A dict of URLs for PLoS subjournals
-    journal_urls = {'pgen': 'http://www.plosgenetics.org/article/{0}',
-                    'pcbi': 'http://www.ploscompbiol.org/article/{0}',
-                    'ppat': 'http://www.plospathogens.org/article/{0}',
-                    'pntd': 'http://www.plosntds.org/article/{0}',
-                    'pmed': 'http://www.plosmedicine.org/article/{0}',
-                    'pbio': 'http://www.plosbiology.org/article/{0}',
-                    'pone': 'http://www.plosone.org/article/{0}',
-                    'pctr': 'http://clinicaltrials.ploshubs.org/article/{0}'}
+    if fetcher is None:
+        fetcher = Fetcher()
 
     #Identify subjournal name for base URL
     subjournal_name = article_doi.split('.')[1]
-    base_url = journal_urls[subjournal_name]
+    base_url = PLOS_JOURNAL_URLS[subjournal_name]
 
     #Acquire <graphic> and <inline-graphic> xml elements
-    graphics = document.document.getroot().findall('.//graphic')
-    graphics += document.document.getroot().findall('.//inline-graphic')
+    root = document.document.getroot()
+    graphics = root.findall('.//graphic')
+    graphics += root.findall('.//inline-graphic')
 
-    #Begin to download
-    log.info('Downloading images, this may take some time...')
+    downloads = []
+    names = set()
     for graphic in graphics:
-        nsmap = document.document.getroot().nsmap
-        xlink_href = graphic.attrib['{' + nsmap['xlink'] + '}' + 'href']
+        xlink_href = graphic.attrib['{' + root.nsmap['xlink'] + '}' + 'href']
 
         #Equations are handled a bit differently than the others
         #Here we decide that an image name starting with "e" is an equation
@@ -313,24 +630,22 @@ def fetch_plos_images(article_doi, output_dir, document):
             resource = 'fetchObject.action?uri=' + xlink_href + '&representation=PNG'
         else:
             resource = xlink_href + '/largerimage'
-        full_url = base_url.format(resource)
-        try:
-            image = urllib.request.urlopen(full_url)
-        except urllib.error.HTTPError as e:
-            if e.code == 503:  # Server overload error
-                time.sleep(1)  # Wait a second
-                try:
-                    image = urllib.request.urlopen(full_url)
-                except:
-                    return False  # Happened twice, give up
-            else:
-                log.error('urllib.error.HTTPError {0}'.format(e.code))
-                return False
-        else:
-            img_name = xlink_href.split('.')[-1] + '.png'
-            img_path = os.path.join(output_dir, img_name)
-            with open(img_path, 'wb') as output:
-                output.write(image.read())
-            log.info('Downloaded image {0}'.format(img_name))
+        img_name = xlink_href.split('.')[-1] + '.png'
+        if img_name in names:  # The same image may be referenced repeatedly
+            continue
+        names.add(img_name)
+        downloads.append((base_url.format(resource),
+                          os.path.join(output_dir, img_name)))
+
+    #Begin to download
+    log.info('Downloading {0} images...'.format(len(downloads)))
+    results = fetcher.fetch_all(downloads)
+    failures = [result for result in results if not result.ok]
+    for result in failures:
+        log.error('Failed to download {0} after {1} attempts: {2}'.format(result.url,
+                                                                          result.attempts,
+                                                                          result.error))
+    if failures:
+        return False
     log.info('Done downloading images')
     return True
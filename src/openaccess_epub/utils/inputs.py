@@ -112,29 +112,31 @@ def frontiersZipInput(zip_path, output_prefix, download=None):
         shutil.rmtree(output)  # Delete previous output
     output_meta = os.path.join(output, 'META-INF')
     images_output = os.path.join(output, 'EPUB', 'images')
+    #Members are copied straight from the zipfiles to the output, without
+    #being extracted first
     with zipfile.ZipFile(os.path.join(path, zipname1), 'r') as xml_zip:
         zip_dir = '{0}-r1'.format(file_root)
         xml = '/'.join([zip_dir, '{0}.xml'.format(file_root)])
         try:
-            xml_zip.extract(xml)
+            xml_info = xml_zip.getinfo(xml)
         except KeyError:
             log.critical('There is no item {0} in the zipfile'.format(xml))
             sys.exit('There is no item {0} in the zipfile'.format(xml))
-        else:
-            if not os.path.isdir(output_meta):
-                os.makedirs(output_meta)
-            shutil.copy(xml, os.path.join(output_meta))
-            os.remove(xml)
-            os.rmdir(zip_dir)
+        if not os.path.isdir(output_meta):
+            os.makedirs(output_meta)
+        xml_output = os.path.join(output_meta, '{0}.xml'.format(file_root))
+        with xml_zip.open(xml_info) as member, open(xml_output, 'wb') as out:
+            shutil.copyfileobj(member, out)
     with zipfile.ZipFile(os.path.join(path, zipname2), 'r') as image_zip:
         zip_dir = '{0}-r2'.format(file_root)
-        for i in image_zip.namelist():
-            if 'image_m' in i:
-                image_zip.extract(i)
+        image_dir = '/'.join([zip_dir, 'images', 'image_m']) + '/'
         if not os.path.isdir(images_output):
             os.makedirs(images_output)
-        unzipped_images = os.path.join(zip_dir, 'images', 'image_m')
-        for i in os.listdir(unzipped_images):
-            shutil.copy(os.path.join(unzipped_images, i), images_output)
-        shutil.rmtree(zip_dir)
+        for info in image_zip.infolist():
+            name = info.filename
+            if not name.startswith(image_dir) or name.endswith('/'):
+                continue
+            image_output = os.path.join(images_output, name.rsplit('/', 1)[-1])
+            with image_zip.open(info) as member, open(image_output, 'wb') as out:
+                shutil.copyfileobj(member, out)
     return file_root
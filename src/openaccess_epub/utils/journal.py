@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+An append-only journal of batch conversion results, so that an interrupted
+batch can be resumed.
+
+The journal is a file of JSON records, one per line, each one describing the
+outcome of converting a single input: its path, the size, modification time and
+SHA-256 hash of its content, the status, the output EPUB and the time taken. A
+line is written and flushed as soon as each result is known, so a batch which
+dies partway through leaves behind a journal of everything it finished. A line
+cut short by the crash is simply ignored when the journal is read back.
+
+When an input appears more than once, the last record wins. An input holding
+several articles, such as an archive, is recorded with the list of its EPUBs.
+"""
+
+#Standard Library modules
+from collections import namedtuple
+import hashlib
+import json
+import logging
+import os
+import time
+
+#Non-Standard Library modules
+
+#OpenAccess_EPUB modules
+
+log = logging.getLogger('openaccess_epub.utils.journal')
+
+journal_entry = namedtuple('journal_entry', 'input, hash, size, mtime, status, epub, elapsed, finished')
+
+
+def content_hash(path):
+    """
+    Returns the hexadecimal SHA-256 digest of the content of a file.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as content_file:
+        for chunk in iter(lambda: content_file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BatchJournal(object):
+    """
+    Reads and appends to a batch journal file.
+
+    Parameters
+    ----------
+    path : str
+        The location of the journal file. It is created if it does not exist,
+        otherwise the records already in it are loaded.
+
+    Attributes
+    ----------
+    entries : dict
+        Maps absolute input paths to their latest journal_entry.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._file = None
+        if os.path.isfile(path):
+            self.load()
+
+    def load(self):
+        with open(self.path, 'r', encoding='utf-8') as journal_file:
+            for line_number, line in enumerate(journal_file, 1):
+                try:
+                    entry = journal_entry(**json.loads(line))
+                except (ValueError, TypeError):
+                    log.warning('Ignoring bad line {0} of journal {1}'.format(line_number, self.path))
+                    continue
+                self.entries[entry.input] = entry
+        log.info('Loaded {0} journal entries from {1}'.format(len(self.entries), self.path))
+
+    def is_complete(self, input_path):
+        """
+        Returns True if the journal records a successful conversion of the
+        input as it currently is, and the EPUBs it produced still exist.
+
+        This is a dictionary lookup and a stat of the input and output. The
+        input is only hashed if its size or modification time have changed
+        since it was recorded.
+        """
+        entry = self.entries.get(input_path)
+        if entry is None or entry.status != 'converted':
+            return False
+        epubs = entry.epub if isinstance(entry.epub, list) else [entry.epub]
+        if None in epubs or not all(os.path.isfile(epub) for epub in epubs):
+            return False
+        try:
+            stat = os.stat(input_path)
+        except OSError:
+            return False
+        if stat.st_size == entry.size and stat.st_mtime == entry.mtime:
+            return True
+        return stat.st_size == entry.size and content_hash(input_path) == entry.hash
+
+    def unfinished_epubs(self):
+        """
+        Returns a frozenset of the EPUBs recorded for the inputs which were not
+        converted, such as those of a failed conversion or of an archive whose
+        conversion did not finish. These were made, or meant to be made, by
+        the batch which kept this journal, so they may be replaced.
+        """
+        epubs = set()
+        for entry in self.entries.values():
+            if entry.status == 'converted' or entry.epub is None:
+                continue
+            recorded = entry.epub if isinstance(entry.epub, list) else [entry.epub]
+            epubs.update(epub for epub in recorded if epub is not None)
+        return frozenset(epubs)
+
+    def open(self):
+        """
+        Opens the journal file for appending. If the last line was cut short,
+        it is ended so that it does not swallow the next record.
+        """
+        ends_cleanly = True
+        if os.path.isfile(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path, 'rb') as journal_file:
+                journal_file.seek(-1, os.SEEK_END)
+                ends_cleanly = journal_file.read(1) == b'\n'
+        self._file = open(self.path, 'a', encoding='utf-8')
+        if not ends_cleanly:
+            self._file.write('\n')
+
+    def record(self, input_path, status, epub, elapsed):
+        """
+        Appends a record for an input and flushes it to disk. Returns the
+        journal_entry which was written.
+        """
+        stat = os.stat(input_path)
+        entry = journal_entry(input_path,
+                              content_hash(input_path),
+                              stat.st_size,
+                              stat.st_mtime,
+                              status,
+                              epub,
+                              round(elapsed, 6),
+                              time.time())
+        if self._file is None:
+            self.open()
+        self._file.write(json.dumps(entry._asdict()) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.entries[input_path] = entry
+        return entry
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+The settings in use for a run of OpenAccess_EPUB.
+
+The settings are resolved once, when a command starts, from three sources,
+each overriding the one before it:
+
+  * The config file, see 'oaepub configure where', with a default for each
+    value the file does not set
+  * Environment variables named 'OAEPUB_' and the name of the setting in upper
+    case, such as OAEPUB_USE_IMAGE_CACHE=y or OAEPUB_EPUB_COMPRESSION_LEVEL=9
+  * The options given to the command on the command line
+
+The result is a settings namedtuple, which is immutable and can be pickled, so
+it is passed explicitly to everything which needs it, worker processes
+included, instead of each of them importing the config file again. Its values
+are read as attributes, just as they were from the config module.
+"""
+
+#Standard Library modules
+from collections import OrderedDict, namedtuple
+import logging
+import os
+import runpy
+import sys
+
+#Non-Standard Library modules
+
+#OpenAccess_EPUB modules
+import openaccess_epub.utils
+
+log = logging.getLogger('openaccess_epub.utils.settings')
+
+#The value of each setting when neither the config file nor the environment
+#gives one; None for those which default to a place in the cache location
+DEFAULTS = OrderedDict([('cache_location', None),
+                        ('input_relative_images', ('images-*',)),
+                        ('use_input_relative_images', True),
+                        ('image_cache', None),
+                        ('use_image_cache', False),
+                        ('image_cache_max_size', 4096),
+                        ('use_image_fetching', True),
+                        ('image_fetch_workers', 8),
+                        ('image_fetch_rate', 4),
+                        ('image_fetch_retries', 4),
+                        ('optimize_images', False),
+                        ('image_max_dimension', 2048),
+                        ('tiff_conversion', 'png'),
+                        ('jpeg_quality', 85),
+                        ('default_output', '.'),
+                        ('epub_compression', 'deflated'),
+                        ('epub_compression_level', 6),
+                        ('conversion_cache', None),
+                        ('use_conversion_cache', False),
+                        ('conversion_cache_max_size', 2048),
+                        ('input_relative_css', '.'),
+                        ('epubcheck_jarfile', None),
+                        ('disable_epubcheck', False)])
+
+settings = namedtuple('settings', list(DEFAULTS))
+
+ENVIRONMENT_PREFIX = 'OAEPUB_'
+
+
+def location_defaults(cache_loc):
+    """
+    Returns the defaults for the settings which lie in the cache location.
+    """
+    return {'cache_location': cache_loc,
+            'image_cache': os.path.join(cache_loc, 'img_cache'),
+            'conversion_cache': os.path.join(cache_loc, 'conversion_cache'),
+            'epubcheck_jarfile': os.path.join(cache_loc, 'epubcheck-3.0',
+                                              'epubcheck-3.0.jar')}
+
+
+def read_config_file(config_path):
+    """
+    Executes the config file and returns a dictionary of the settings it sets.
+    Raises IOError if the file does not exist.
+    """
+    if not os.path.isfile(config_path):
+        raise IOError('No config file at {0}'.format(config_path))
+    values = runpy.run_path(config_path)
+    return dict((name, values[name]) for name in DEFAULTS if name in values)
+
+
+def parse_value(name, text):
+    """
+    Converts the text of an environment variable to the type of the setting
+    `name`. Raises ValueError if it cannot be.
+    """
+    default = DEFAULTS[name]
+    if isinstance(default, bool):
+        if text.lower() in ('y', 'yes', 'true', '1'):
+            return True
+        if text.lower() in ('n', 'no', 'false', '0'):
+            return False
+        raise ValueError('{0} should be one of y or n'.format(name))
+    if isinstance(default, int):
+        try:
+            return int(text)
+        except ValueError:
+            raise ValueError('{0} should be a whole number'.format(name))
+    if isinstance(default, tuple):
+        return tuple(item.strip() for item in text.split(',') if item.strip())
+    return text
+
+
+def environment_values(environ=None):
+    """
+    Returns a dictionary of the settings given by environment variables.
+    """
+    if environ is None:
+        environ = os.environ
+    values = {}
+    for name in DEFAULTS:
+        text = environ.get(ENVIRONMENT_PREFIX + name.upper())
+        if text is not None:
+            values[name] = parse_value(name, text)
+    return values
+
+
+def command_overrides(args):
+    """
+    Returns the settings given by the options common to the conversion
+    commands, --output and --no-epubcheck, from their parsed `args`.
+    """
+    overrides = {'disable_epubcheck': args.get('--no-epubcheck') or None}
+    #An explicit output directory is relative to the working directory
+    if args.get('--output') is not None:
+        overrides['default_output'] = openaccess_epub.utils.get_absolute_path(args['--output'])
+    return overrides
+
+
+def load_settings(overrides=None, config_path=None, environ=None):
+    """
+    Resolves the settings from the config file, the environment and the
+    `overrides`, a dictionary of settings given on the command line in which
+    None values are ignored.
+
+    If the config file does not exist, or a setting from the environment
+    cannot be read, this calls sys.exit() with an explanation.
+
+    Parameters
+    ----------
+    overrides : dict, optional
+        Settings which take precedence over all others
+    config_path : str, optional
+        The config file to read, by default the one in the cache location
+    environ : mapping, optional
+        The environment variables, by default os.environ
+
+    Returns
+    -------
+    settings : settings
+    """
+    cache_loc = openaccess_epub.utils.cache_location()
+    if config_path is None:
+        config_path = openaccess_epub.utils.config_location()
+    try:
+        from_file = read_config_file(config_path)
+    except IOError:
+        log.critical('Config file not found. oaepub exiting...')
+        sys.exit('Config file not found. Please run \'oaepub configure\'')
+    log.debug('Config file loaded from {0}'.format(config_path))
+    try:
+        from_environment = environment_values(environ)
+    except ValueError as err:
+        log.critical('Invalid setting in the environment: {0}'.format(err))
+        sys.exit('Invalid setting in the environment: {0}'.format(err))
+    values = dict(DEFAULTS)
+    values.update(location_defaults(cache_loc))
+    values.update(from_file)
+    values.update(from_environment)
+    for name, value in (overrides or {}).items():
+        if name not in DEFAULTS:
+            raise KeyError('Unknown setting: {0}'.format(name))
+        if value is not None:
+            values[name] = value
+    #The config file records the cache location only for reference
+    values['cache_location'] = cache_loc
+    if isinstance(values['input_relative_images'], list):
+        values['input_relative_images'] = tuple(values['input_relative_images'])
+    return settings(**values)
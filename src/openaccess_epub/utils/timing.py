@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Timing of the stages of a conversion.
+
+A StageTimer accumulates wall clock and CPU time under named stages. The code
+doing the work marks its stages with the module level `stage` context manager,
+which records into whichever StageTimer is active in the thread, and does
+nothing at all when none is. This keeps the timing out of the signatures of
+Article, make_EPUB and the rest, while letting a command such as 'oaepub batch'
+collect the time spent in each stage for every article.
+"""
+
+#Standard Library modules
+from collections import OrderedDict, namedtuple
+import contextlib
+import logging
+import math
+import threading
+import time
+
+#Non-Standard Library modules
+
+#OpenAccess_EPUB modules
+
+log = logging.getLogger('openaccess_epub.utils.timing')
+
+stage_time = namedtuple('stage_time', 'wall, cpu')
+
+#The stages of a conversion, in the order they happen
+STAGES = ('parse', 'validate', 'images', 'render', 'navigation', 'package',
+          'zip', 'epubcheck')
+
+
+class StageTimer(object):
+    """
+    Accumulates wall clock and CPU time for named stages.
+
+    A stage entered more than once accumulates the time of each entry. CPU time
+    is that of the whole process, so it is only meaningful while the process
+    works on one thing at a time.
+
+    Attributes
+    ----------
+    stages : OrderedDict
+        Maps stage names to stage_time(wall, cpu) in seconds, in the order the
+        stages were first entered.
+    """
+    def __init__(self):
+        self.stages = OrderedDict()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            self.add(name,
+                     time.perf_counter() - wall_start,
+                     time.process_time() - cpu_start)
+
+    def add(self, name, wall, cpu):
+        """
+        Adds time to a stage, cpu may be None if it is not known.
+        """
+        previous = self.stages.get(name)
+        if previous is not None:
+            wall += previous.wall
+            if cpu is not None and previous.cpu is not None:
+                cpu += previous.cpu
+        self.stages[name] = stage_time(wall, cpu)
+
+
+#Each thread has its own active timer, so that conversions in other threads
+#neither record into it nor are recorded by it
+_local = threading.local()
+
+
+def activate(timer):
+    """
+    Makes `timer` the StageTimer which `stage` records into in this thread,
+    None to stop recording. Returns the timer.
+    """
+    _local.active = timer
+    return timer
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Times the enclosed block as the named stage of the StageTimer active in
+    this thread, if there is one.
+    """
+    active = getattr(_local, 'active', None)
+    if active is None:
+        yield
+    else:
+        with active.stage(name):
+            yield
+
+
+def percentile(values, fraction):
+    """
+    Returns the value at `fraction` (between 0 and 1) of the way through the
+    sorted `values`, interpolating linearly between neighbours. Returns None
+    for no values.
+    """
+    values = sorted(values)
+    if not values:
+        return None
+    position = (len(values) - 1) * fraction
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    if lower == upper:
+        return values[lower]
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(values, fractions=(0.5, 0.9, 0.99)):
+    """
+    Returns an OrderedDict of percentiles of `values`, keyed like 'p50', with
+    the count, total and maximum. None values are left out.
+    """
+    values = [value for value in values if value is not None]
+    summary = OrderedDict()
+    summary['count'] = len(values)
+    summary['total'] = sum(values)
+    for fraction in fractions:
+        summary['p{0:g}'.format(fraction * 100)] = percentile(values, fraction)
+    summary['max'] = max(values) if values else None
+    return summary
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for writing EPUB files.
+"""
+
+#Standard Library modules
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+#Non-Standard Library modules
+
+#OpenAccess_EPUB modules
+from openaccess_epub.utils.epub import EPUBWriter, epub_zip,\
+    PARALLEL_DEFLATE_SIZE, MAX_PENDING_ENTRIES
+
+CONTENTS = [('mimetype', 'application/epub+zip'),
+            ('META-INF/container.xml', '<container/>'),
+            ('EPUB/main.xhtml', '<p>Some text</p>' * 20000),
+            ('EPUB/images-1/g001.png', os.urandom(100000)),
+            ('EPUB/styles.css', b'')]
+
+
+class EPUBWriterTest(unittest.TestCase):
+
+    def write_epub(self, compression, compresslevel=6):
+        epub = io.BytesIO()
+        with EPUBWriter(epub, compression, compresslevel) as writer:
+            for name, data in CONTENTS:
+                writer.write(name, data)
+        epub.seek(0)
+        return zipfile.ZipFile(epub)
+
+    def check_epub(self, epub):
+        self.assertIsNone(epub.testzip())
+        self.assertEqual(epub.namelist(), [name for name, data in CONTENTS])
+        for name, data in CONTENTS:
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            self.assertEqual(epub.read(name), data)
+        self.assertEqual(epub.getinfo('mimetype').compress_type, zipfile.ZIP_STORED)
+
+    def test_stored(self):
+        epub = self.write_epub('stored')
+        self.check_epub(epub)
+        for info in epub.infolist():
+            self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+
+    def test_deflated(self):
+        for level in (0, 1, 6, 9):
+            epub = self.write_epub('deflated', level)
+            self.check_epub(epub)
+            main = epub.getinfo('EPUB/main.xhtml')
+            if level:
+                self.assertEqual(main.compress_type, zipfile.ZIP_DEFLATED)
+                self.assertLess(main.compress_size, main.file_size)
+            else:
+                #Level 0 only adds deflate's framing, so the entry is stored
+                self.assertEqual(main.compress_type, zipfile.ZIP_STORED)
+            #Images are compressed by their format already
+            png = epub.getinfo('EPUB/images-1/g001.png')
+            self.assertEqual(png.compress_type, zipfile.ZIP_STORED)
+
+    def test_reproducible(self):
+        first, second = io.BytesIO(), io.BytesIO()
+        for epub in (first, second):
+            with EPUBWriter(epub, 'deflated') as writer:
+                for name, data in CONTENTS:
+                    writer.write(name, data)
+        self.assertEqual(first.getvalue(), second.getvalue())
+
+    def test_abort_removes_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'partial.epub')
+            with self.assertRaises(RuntimeError):
+                with EPUBWriter(path, 'deflated') as writer:
+                    writer.write('mimetype', 'application/epub+zip')
+                    raise RuntimeError
+            self.assertFalse(os.path.exists(path))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_parallel_deflate(self):
+        #More large entries than may wait in memory, written in their order
+        contents = [('mimetype', b'application/epub+zip')]
+        for index in range(MAX_PENDING_ENTRIES * 2):
+            data = '<p>{0}</p>'.format(index).encode('utf-8') * PARALLEL_DEFLATE_SIZE
+            contents.append(('EPUB/{0}.xhtml'.format(index), data))
+        contents.append(('EPUB/random.bin', os.urandom(PARALLEL_DEFLATE_SIZE * 2)))
+        epub = io.BytesIO()
+        with EPUBWriter(epub, 'deflated', 1) as writer:
+            for name, data in contents:
+                writer.write(name, data)
+        epub.seek(0)
+        with zipfile.ZipFile(epub) as epub:
+            self.assertIsNone(epub.testzip())
+            self.assertEqual(epub.namelist(), [name for name, data in contents])
+            for name, data in contents[1:-1]:
+                self.assertEqual(epub.getinfo(name).compress_type, zipfile.ZIP_DEFLATED)
+                self.assertEqual(epub.read(name), data)
+            #Deflate does not make random data smaller, so it is stored
+            random = epub.getinfo('EPUB/random.bin')
+            self.assertEqual(random.compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(epub.read('EPUB/random.bin'), contents[-1][1])
+
+    def test_utf8_name(self):
+        epub = io.BytesIO()
+        with EPUBWriter(epub, 'deflated') as writer:
+            writer.write('mimetype', 'application/epub+zip')
+            writer.write('EPUB/images-1/g\u00e9.png', b'image')
+        epub.seek(0)
+        with zipfile.ZipFile(epub) as epub:
+            self.assertIsNone(epub.testzip())
+            self.assertEqual(epub.read('EPUB/images-1/g\u00e9.png'), b'image')
+
+    def test_zip64_entry_count(self):
+        epub = io.BytesIO()
+        names = ['EPUB/{0}.xhtml'.format(index) for index in range(0x10000)]
+        with EPUBWriter(epub, 'deflated') as writer:
+            writer.write('mimetype', 'application/epub+zip')
+            for name in names:
+                writer.write(name, name)
+        epub.seek(0)
+        with zipfile.ZipFile(epub) as epub:
+            self.assertIsNone(epub.testzip())
+            self.assertEqual(len(epub.namelist()), len(names) + 1)
+            self.assertEqual(epub.read(names[-1]), names[-1].encode('utf-8'))
+
+    def test_epub_zip(self):
+        directory = tempfile.mkdtemp()
+        try:
+            contents = os.path.join(directory, 'article')
+            for name, data in CONTENTS:
+                path = os.path.join(contents, *name.split('/'))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as out:
+                    out.write(data.encode('utf-8') if isinstance(data, str) else data)
+            epub_zip(contents, 'deflated', 9)
+            with zipfile.ZipFile(contents + '.epub') as epub:
+                self.assertIsNone(epub.testzip())
+                self.assertEqual(epub.namelist()[0], 'mimetype')
+                self.assertEqual(sorted(epub.namelist()),
+                                 sorted(name for name, data in CONTENTS))
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for running epubcheck, with a stand-in for java which behaves as
+epubcheck and the EpubcheckServer do.
+"""
+
+#Standard Library modules
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+#Non-Standard Library modules
+
+#OpenAccess_EPUB modules
+from openaccess_epub.utils.epubcheck_runner import EpubcheckRunner
+
+#Records each start in the file STARTS, reports an error for EPUBs with 'bad'
+#in their names and, if SERVER is False, has no single-file source launcher
+FAKE_JAVA = '''#!{python}
+import sys
+STARTS = {starts!r}
+SERVER = {server!r}
+
+def report(path):
+    if 'bad' in path:
+        print('ERROR(RSC-005): {{0}}/EPUB/main.xhtml(1,2): bad'.format(path))
+        return False
+    print('No errors or warnings detected.')
+    return True
+
+args = sys.argv[1:]
+with open(STARTS, 'a') as starts:
+    starts.write(args[0] + '\\n')
+if args[0] == '-jar':
+    sys.exit(0 if report(args[2]) else 1)
+if not SERVER:
+    print('Error: Could not find or load main class EpubcheckServer.java')
+    sys.exit(1)
+for line in sys.stdin:
+    report(line.rstrip('\\n'))
+    print(args[3] + ' DONE', flush=True)
+'''
+
+
+class EpubcheckRunnerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.starts = os.path.join(self.directory, 'starts')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def fake_java(self, server=True):
+        path = os.path.join(self.directory, 'java')
+        with open(path, 'w') as java:
+            java.write(FAKE_JAVA.format(python=sys.executable,
+                                        starts=self.starts,
+                                        server=server))
+        os.chmod(path, 0o755)
+        return path
+
+    def check_all(self, java, workers=1):
+        names = ['good{0}.epub'.format(index) for index in range(4)] + ['bad.epub']
+        with EpubcheckRunner('epubcheck.jar', workers, java) as runner:
+            futures = [runner.submit(name) for name in names]
+        results = [future.result() for future in futures]
+        self.assertEqual([result.passed for result in results],
+                         [True, True, True, True, False])
+        message = results[-1].messages[0]
+        self.assertEqual((message.severity, message.id, message.location, message.text),
+                         ('ERROR', 'RSC-005', 'bad.epub/EPUB/main.xhtml(1,2)', 'bad'))
+        with open(self.starts) as starts:
+            return starts.read().split()
+
+    def test_one_jvm_per_worker(self):
+        self.assertEqual(self.check_all(self.fake_java()), ['-cp'])
+        os.remove(self.starts)
+        starts = self.check_all(self.fake_java(), workers=2)
+        self.assertIn(starts, (['-cp'], ['-cp', '-cp']))
+
+    def test_fallback_without_server(self):
+        starts = self.check_all(self.fake_java(server=False))
+        self.assertEqual(starts, ['-cp'] + ['-jar'] * 5)
+
+    def test_java_missing(self):
+        java = os.path.join(self.directory, 'no-java')
+        with EpubcheckRunner('epubcheck.jar', 1, java) as runner:
+            result = runner.submit('article.epub').result()
+        self.assertFalse(result.passed)
+        self.assertEqual(result.messages[0].severity, 'FATAL')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for downloading files, against an HTTP server on localhost.
+"""
+
+#Standard Library modules
+import http.server
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+#Non-Standard Library modules
+
+#OpenAccess_EPUB modules
+from openaccess_epub.utils.fetch import Fetcher
+
+BODY = b'image data' * 100
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """
+    Answers according to the path: /ok/... with BODY, /flaky with 503 for
+    the first two requests, /missing with 404 and /truncated with less of the
+    body than it promised. Every request is recorded by the server.
+    """
+    protocol_version = 'HTTP/1.1'  # Keeps connections alive
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, self.client_address, time.monotonic()))
+            count = sum(1 for path, address, when in server.requests if path == self.path)
+        if self.path.startswith('/ok/'):
+            self.reply(200, BODY)
+        elif self.path == '/flaky':
+            self.reply(503 if count <= 2 else 200, BODY)
+        elif self.path == '/missing':
+            self.reply(404, b'Not Found')
+        elif self.path == '/truncated':
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(BODY)))
+            self.end_headers()
+            self.wfile.write(BODY[:10])
+            self.close_connection = True
+        else:
+            self.reply(500, b'')
+
+    def reply(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FetcherTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        cls.server.daemon_threads = True
+        cls.server.lock = threading.Lock()
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.start()
+        cls.base = 'http://127.0.0.1:{0}'.format(cls.server.server_address[1])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.thread.join()
+
+    def setUp(self):
+        self.server.requests = []
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def requests(self, path):
+        return [request for request in self.server.requests if request[0] == path]
+
+    def test_connection_reused(self):
+        with Fetcher(workers=1, connections_per_host=1, backoff=0.01) as fetcher:
+            for index in range(5):
+                body, attempts = fetcher.fetch(self.base + '/ok/{0}'.format(index))
+                self.assertEqual(body, BODY)
+        addresses = set(address for path, address, when in self.server.requests)
+        self.assertEqual(len(self.server.requests), 5)
+        self.assertEqual(len(addresses), 1)
+
+    def test_retry_with_backoff(self):
+        with Fetcher(backoff=0.1, retries=4) as fetcher:
+            start = time.monotonic()
+            body, attempts = fetcher.fetch(self.base + '/flaky')
+            elapsed = time.monotonic() - start
+        self.assertEqual(body, BODY)
+        self.assertEqual(attempts, 3)
+        self.assertEqual(len(self.requests('/flaky')), 3)
+        #Waits of at least half of 0.1 and 0.2 seconds, with jitter
+        self.assertGreaterEqual(elapsed, 0.15)
+
+    def test_backoff_grows(self):
+        fetcher = Fetcher(backoff=1, max_backoff=5)
+        for attempt, (low, high) in enumerate([(0.5, 1), (1, 2), (2, 4), (2.5, 5),
+                                               (2.5, 5)], 1):
+            self.assertTrue(low <= fetcher.delay(attempt) <= high)
+        self.assertEqual(fetcher.delay(1, retry_after='3'), 3)
+
+    def test_no_retry_on_404(self):
+        with Fetcher(backoff=0.01, retries=4) as fetcher:
+            result = fetcher.fetch_to(self.base + '/missing',
+                                      os.path.join(self.directory, 'missing.png'))
+        self.assertFalse(result.ok)
+        self.assertEqual((result.status, result.attempts), (404, 1))
+        self.assertEqual(len(self.requests('/missing')), 1)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_write_is_atomic(self):
+        path = os.path.join(self.directory, 'g001.png')
+        with Fetcher(backoff=0.01) as fetcher:
+            result = fetcher.fetch_to(self.base + '/ok/g001', path)
+        self.assertTrue(result.ok)
+        with open(path, 'rb') as downloaded:
+            self.assertEqual(downloaded.read(), BODY)
+        self.assertEqual(os.listdir(self.directory), ['g001.png'])
+
+    def test_no_partial_file_after_failure(self):
+        path = os.path.join(self.directory, 'g001.png')
+        with Fetcher(backoff=0.01, retries=2) as fetcher:
+            #The connection closes before the whole body is sent
+            result = fetcher.fetch_to(self.base + '/truncated', path)
+            self.assertFalse(result.ok)
+            self.assertEqual(result.attempts, 3)
+            self.assertEqual(os.listdir(self.directory), [])
+            #Writing fails, as the path is taken by a directory
+            os.mkdir(path)
+            result = fetcher.fetch_to(self.base + '/ok/g001', path)
+            self.assertFalse(result.ok)
+            self.assertEqual(os.listdir(self.directory), ['g001.png'])
+            #Or because the directory does not exist
+            result = fetcher.fetch_to(self.base + '/ok/g001',
+                                      os.path.join(self.directory, 'none', 'g001.png'))
+            self.assertFalse(result.ok)
+
+    def test_rate_limit(self):
+        downloads = [(self.base + '/ok/{0}'.format(index),
+                      os.path.join(self.directory, '{0}.png'.format(index)))
+                     for index in range(6)]
+        with Fetcher(workers=6, rate=20) as fetcher:
+            results = fetcher.fetch_all(downloads)
+        self.assertTrue(all(result.ok for result in results))
+        starts = sorted(when for path, address, when in self.server.requests)
+        self.assertEqual(len(starts), 6)
+        #No more than 20 requests a second, so 5 intervals of 0.05 seconds
+        self.assertGreaterEqual(starts[-1] - starts[0], 0.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
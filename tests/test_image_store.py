@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the content-addressed image store of the image cache.
+"""
+
+#Standard Library modules
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+#Non-Standard Library modules
+
+#OpenAccess_EPUB modules
+from openaccess_epub.utils.image_store import ImageStore
+
+DOI = '10.1371/journal.pone.0000001'
+
+
+class LeaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.store = ImageStore(self.location)
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+
+    def test_reentrant(self):
+        with self.store.lease(DOI):
+            with self.store.lease(DOI):
+                pass
+            #Still held by this thread after the inner block
+            self.assertIsNone(self.store.try_lease(DOI))
+
+    def test_threads_exclude_each_other(self):
+        holders, overlaps = [], []
+
+        def work():
+            for repeat in range(5):
+                with self.store.lease(DOI):
+                    holders.append(None)
+                    if len(holders) > 1:
+                        overlaps.append(None)
+                    time.sleep(0.01)
+                    holders.pop()
+
+        threads = [threading.Thread(target=work) for index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(overlaps, [])
+
+    def test_try_lease_busy(self):
+        taken, done = threading.Event(), threading.Event()
+
+        def hold():
+            with self.store.lease(DOI):
+                taken.set()
+                done.wait()
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        try:
+            taken.wait()
+            self.assertIsNone(self.store.try_lease(DOI))
+        finally:
+            done.set()
+            thread.join()
+        handle = self.store.try_lease(DOI)
+        self.assertIsNotNone(handle)
+        self.store.release_lease(DOI, handle)
+
+
+class PruneTest(unittest.TestCase):
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.sources = tempfile.mkdtemp()
+        self.store = ImageStore(self.location)
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+        shutil.rmtree(self.sources)
+
+    def add_article(self, doi, contents, age):
+        directory = os.path.join(self.sources, doi.replace('/', '_'))
+        os.makedirs(directory)
+        for index, content in enumerate(contents):
+            with open(os.path.join(directory, 'g{0}.png'.format(index)), 'wb') as out:
+                out.write(content)
+        files = self.store.add_directory(doi, directory)
+        self.store.index_article(doi, files, time.time() - age)
+        return directory
+
+    def test_shared_blob_freed_with_last_user(self):
+        self.add_article('10.1/x', [b's' * 1000, b'x' * 10], 300)
+        self.add_article('10.1/y', [b's' * 1000, b'y' * 10], 200)
+        self.add_article('10.1/z', [b'z' * 1000], 100)
+        evicted, freed = self.store.prune(max_size=1100)
+        self.assertEqual(evicted, [('10.1/x', 10), ('10.1/y', 1010)])
+        self.assertEqual(self.store.size(), 1000)
+        self.assertIsNotNone(self.store.files('10.1/z'))
+
+    def test_busy_article_skipped(self):
+        self.add_article('10.1/x', [b'x' * 1000], 300)
+        self.add_article('10.1/y', [b'y' * 1000], 200)
+        taken, done = threading.Event(), threading.Event()
+
+        def hold():
+            with self.store.lease('10.1/x'):
+                taken.set()
+                done.wait()
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        try:
+            taken.wait()
+            evicted, freed = self.store.prune(max_size=1000)
+        finally:
+            done.set()
+            thread.join()
+        self.assertEqual(evicted, [('10.1/y', 1000)])
+        files = self.store.files('10.1/x')
+        self.assertTrue(all(os.path.isfile(f.path) for f in files))
+
+    def test_evicted_blob_added_again(self):
+        #A blob found in the store, then evicted before the article using it
+        #is indexed, is added to the store again
+        self.add_article('10.1/x', [b's' * 1000], 300)
+        add_file = self.store.add_file
+
+        def add_then_evict(path):
+            digest = add_file(path)
+            self.store.prune(max_size=0, keep='10.1/y')
+            return digest
+
+        self.store.add_file = add_then_evict
+        directory = os.path.join(self.sources, 'y')
+        os.makedirs(directory)
+        with open(os.path.join(directory, 'g0.png'), 'wb') as out:
+            out.write(b's' * 1000)
+        files = self.store.add_directory('10.1/y', directory)
+        self.assertEqual(len(files), 1)
+        self.assertTrue(os.path.isfile(files[0].path))
+        self.assertEqual(self.store.size(), 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
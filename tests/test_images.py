@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for matching the images referenced by an article to their files.
+"""
+
+#Standard Library modules
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+
+#Non-Standard Library modules
+from lxml import etree
+
+#OpenAccess_EPUB modules
+from openaccess_epub.utils.images import ImageIndex, ImageError
+from openaccess_epub.utils.image_optimize import ImageOptimizer,\
+    optimize_options, Image
+from openaccess_epub.utils.image_store import image_file
+
+
+def png_data(width=3, height=2):
+    """
+    Returns the bytes of a minimal PNG image of the given size.
+    """
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data +
+                struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+    header = struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)
+    pixels = zlib.compress(b''.join(b'\x00' + b'\x00' * width for row in range(height)))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) +
+            chunk(b'IDAT', pixels) + chunk(b'IEND', b''))
+
+
+class FakeArticle(object):
+    """
+    Just enough of an Article for ImageIndex.build: a DOI and a root element
+    holding a graphic for each xlink:href.
+    """
+    def __init__(self, hrefs, doi='10.3389/fpsyg.2013.00001'):
+        self.doi = doi
+        self.root = etree.Element('article')
+        for href in hrefs:
+            graphic = etree.SubElement(self.root, 'graphic')
+            graphic.set('{http://www.w3.org/1999/xlink}href', href)
+
+
+class ImageIndexTest(unittest.TestCase):
+
+    def build(self, hrefs, names):
+        files = [image_file(name, None, None, png_data()) for name in names]
+        return ImageIndex.build(FakeArticle(hrefs), files)
+
+    def test_exact_name(self):
+        index = self.build(['fig1.png'], ['fig1.png'])
+        self.assertEqual(index['fig1.png'].src, 'images-fpsyg.2013.00001/fig1.png')
+
+    def test_name_without_extension(self):
+        index = self.build(['fig1'], ['fig1.png'])
+        self.assertEqual(index['fig1'].format, 'png')
+
+    def test_href_with_other_extension(self):
+        #Frontiers references its figures as TIFFs, fetched as other formats
+        index = self.build(['fpsyg-04-00001-g001.tif'], ['fpsyg-04-00001-g001.png'])
+        entry = index['fpsyg-04-00001-g001.tif']
+        self.assertEqual(entry.src, 'images-fpsyg.2013.00001/fpsyg-04-00001-g001.png')
+        self.assertEqual((entry.width, entry.height), (3, 2))
+
+    def test_plos_href(self):
+        href = 'info:doi/10.1371/journal.pone.0000001.g001'
+        files = [image_file('g001.png', None, None, png_data())]
+        index = ImageIndex.build(FakeArticle([href], '10.1371/journal.pone.0000001'), files)
+        self.assertEqual(index[href].src, 'images-journal.pone.0000001/g001.png')
+
+    def test_missing_image(self):
+        with self.assertRaises(ImageError):
+            self.build(['fig2.tif'], ['fig1.png'])
+
+
+class OptimizedTiffTest(unittest.TestCase):
+    """
+    A TIFF referenced as 'name.tif' is still found once image optimization has
+    converted it to 'name.png'.
+    """
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.options = optimize_options(2048, 'png', 85)
+        self.optimizer = ImageOptimizer(self.options, self.location, workers=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+
+    def check_index(self, optimized):
+        self.assertEqual([image.name for image in optimized], ['fig1.png'])
+        index = ImageIndex.build(FakeArticle(['fig1.tif']), optimized)
+        self.assertEqual(index['fig1.tif'].src, 'images-fpsyg.2013.00001/fig1.png')
+        self.assertEqual(index['fig1.tif'].media_type, 'image/png')
+
+    def test_cached_conversion(self):
+        #A conversion already in the cache needs no Pillow
+        tiff = image_file('fig1.tif', None, 'tiffdigest', b'II*\x00')
+        base = os.path.join(self.location, self.optimizer.cache_key('tiffdigest'))
+        with open(base + '.png', 'wb') as converted:
+            converted.write(png_data())
+        self.check_index(self.optimizer.optimize([tiff], {'fig1.tif': 'tiff'}))
+
+    @unittest.skipIf(Image is None, 'Pillow is not installed')
+    def test_conversion(self):
+        tiff_path = os.path.join(self.location, 'fig1.tif')
+        Image.new('RGB', (4, 3)).save(tiff_path, 'TIFF')
+        tiff = image_file('fig1.tif', tiff_path, None)
+        self.check_index(self.optimizer.optimize([tiff], {'fig1.tif': 'tiff'}))
+
+
+if __name__ == '__main__':
+    unittest.main()